@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from board import QUADRANTS
+
+
+# Queries behind /analytics, all on task_stats (one row per user, day and
+# quadrant with completions, maintained by triggers on tasks), so their cost
+# follows the number of days shown, not the number of tasks.
+
+DAILY_SQL = '''
+    SELECT day, urgency, importance, completed, lead_seconds FROM task_stats
+    WHERE user_id = %(user_id)s AND day > %(since)s AND day <= %(today)s AND completed > 0
+    ORDER BY day
+'''
+
+# Gaps and islands over active days: consecutive days share day - row_number
+STREAKS_SQL = '''
+    SELECT max(length) AS longest,
+        COALESCE(max(length) FILTER (WHERE last_day >= %(today)s::date - 1), 0) AS current
+    FROM (
+        SELECT count(*) AS length, max(day) AS last_day
+        FROM (
+            SELECT day, day - (row_number() OVER (ORDER BY day))::int AS island
+            FROM task_stats
+            WHERE user_id = %(user_id)s AND day <= %(today)s
+            GROUP BY day
+            HAVING sum(completed) > 0
+        ) active
+        GROUP BY island
+    ) streaks
+'''
+
+# Bounded by the user's open tasks, through tasks_user_completed_due_idx
+OVERDUE_SQL = 'SELECT count(*) AS overdue FROM tasks WHERE user_id = %s AND completed = FALSE AND due_date < %s'
+
+
+def load_analytics(cur, user_id, today, days=30):
+    params = {'user_id': user_id, 'today': today, 'since': today - timedelta(days=days)}
+    keys = {(urgency, importance): key for key, urgency, importance, _, _ in QUADRANTS}
+    daily = {today - timedelta(days=offset): dict.fromkeys(keys.values(), 0) for offset in range(days)}
+    completed = 0
+    lead_seconds = 0.0
+    cur.execute(DAILY_SQL, params)
+    for row in cur.fetchall():
+        key = keys.get((row['urgency'], row['importance']))
+        if key:
+            daily[row['day']][key] += row['completed']
+        completed += row['completed']
+        lead_seconds += row['lead_seconds']
+    cur.execute(STREAKS_SQL, params)
+    streaks = cur.fetchone()
+    cur.execute(OVERDUE_SQL, (user_id, today))
+    overdue = cur.fetchone()['overdue']
+    return {
+        'days': [dict(counts, day=day, total=sum(counts.values())) for day, counts in sorted(daily.items())],
+        'completed': completed,
+        'average_lead_hours': lead_seconds / completed / 3600 if completed else None,
+        'overdue': overdue,
+        'current_streak': streaks['current'] or 0,
+        'longest_streak': streaks['longest'] or 0,
+    }
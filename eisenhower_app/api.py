@@ -0,0 +1,167 @@
+import hashlib
+from datetime import date, datetime
+
+from flask import Blueprint, Response, current_app, request, jsonify, abort
+from flask_login import current_user
+
+from analytics import load_analytics
+from board import QUADRANTS
+from db import TaskCursor, db_connection
+from sync import load_changes
+from versions import data_stamp
+
+
+api = Blueprint('api', __name__)
+
+# Columns clients may ask for with ?fields=
+TASK_FIELDS = ('id', 'title', 'urgency', 'importance', 'due_date', 'impact', 'frequency', 'completed', 'created_at')
+QUADRANT_FILTERS = {key: (urgency, importance) for key, urgency, importance, _, _ in QUADRANTS}
+MAX_LIMIT = 1000
+MAX_DAYS = 365
+SYNC_PAGE_SIZE = 500
+
+
+@api.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        abort(401)
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def json_error(error):
+    return jsonify({"error": error.description}), error.code
+
+
+def to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def not_modified(version, changed_at, extra=''):
+    # A strong validator per user, data version and representation (query
+    # string), so a 304 costs one primary-key lookup and no serialisation.
+    representation = '%s|%s|%s|%s' % (current_user.id, version, request.query_string.decode(), extra)
+    etag = hashlib.sha1(representation.encode()).hexdigest()[:20]
+    if request.if_none_match:
+        return etag, request.if_none_match.contains(etag)
+    if changed_at and request.if_modified_since:
+        return etag, changed_at.replace(microsecond=0) <= request.if_modified_since
+    return etag, False
+
+
+def conditional(response, etag, changed_at):
+    response.set_etag(etag)
+    if changed_at:
+        response.last_modified = changed_at
+    # Clients must revalidate, which is cheap, and shared caches must not keep it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def task_list_query(user_id, fields, quadrant=None, completed=None, after=0, limit=MAX_LIMIT):
+    query = 'SELECT %s FROM tasks WHERE user_id = %%(user_id)s AND id > %%(after)s' % ', '.join(sorted(set(fields) | {'id'}))
+    params = {'user_id': user_id, 'after': after, 'limit': limit}
+    if quadrant:
+        query += ' AND urgency = %(urgency)s AND importance = %(importance)s'
+        params['urgency'], params['importance'] = QUADRANT_FILTERS[quadrant]
+    if completed:
+        query += ' AND completed = %(completed)s'
+        params['completed'] = completed == 'true'
+    query += ' ORDER BY id LIMIT %(limit)s'
+    return query, params
+
+
+def list_tasks_args():
+    # (fields, query, params, limit) for the request's arguments
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(TASK_FIELDS)
+    unknown = set(fields) - set(TASK_FIELDS)
+    if unknown:
+        abort(400, "Unknown fields: %s" % ', '.join(sorted(unknown)))
+    quadrant = request.args.get('quadrant')
+    if quadrant and quadrant not in QUADRANT_FILTERS:
+        abort(400, "Unknown quadrant: %s" % quadrant)
+    completed = request.args.get('completed')
+    if completed not in (None, 'true', 'false'):
+        abort(400, "completed must be true or false")
+    limit = min(request.args.get('limit', MAX_LIMIT, type=int), MAX_LIMIT)
+    if limit < 1:
+        abort(400, "limit must be at least 1")
+    after = request.args.get('after', 0, type=int)
+
+    query, params = task_list_query(current_user.id, fields, quadrant, completed, after, limit + 1)
+    return fields, query, params, limit
+
+
+def task_list_response(rows, fields, limit, version, etag, changed_at):
+    next_after = None
+    if len(rows) > limit:
+        del rows[limit:]
+        next_after = rows[-1].id
+    tasks = [{field: to_json(getattr(row, field)) for field in fields} for row in rows]
+    response = jsonify({"version": version, "tasks": tasks, "next_after": next_after})
+    return conditional(response, etag, changed_at)
+
+
+def sync_response(changes):
+    changes['tasks'] = [{key: to_json(value) for key, value in task.items()} for task in changes['tasks']]
+    response = jsonify(changes)
+    response.cache_control.no_store = True
+    return response
+
+
+# asgi.py serves /tasks and /sync from the same helpers with an async driver;
+# keep the two views in step
+@api.route('/tasks')
+def list_tasks():
+    fields, query, params, limit = list_tasks_args()
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        version, changed_at = data_stamp(cur, current_user.id)
+        cur.close()
+        etag, fresh = not_modified(version, changed_at)
+        if fresh:
+            return conditional(Response(status=304), etag, changed_at)
+        with conn.cursor(cursor_factory=TaskCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+    return task_list_response(rows, fields, limit, version, etag, changed_at)
+
+
+@api.route('/analytics')
+def analytics():
+    days = request.args.get('days', 30, type=int)
+    if not 1 <= days <= MAX_DAYS:
+        abort(400, "days must be between 1 and %d" % MAX_DAYS)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        version, _ = data_stamp(cur, current_user.id)
+        # Streaks and overdue counts also move with the calendar, so the
+        # validator includes the day and Last-Modified is not used
+        today = date.today()
+        etag, fresh = not_modified(version, None, today.isoformat())
+        if fresh:
+            cur.close()
+            return conditional(Response(status=304), etag, None)
+        stats = load_analytics(cur, current_user.id, today, days)
+        cur.close()
+    stats['days'] = [{key: to_json(value) for key, value in day.items()} for day in stats['days']]
+    return conditional(jsonify(dict(stats, version=version)), etag, None)
+
+
+@api.route('/sync')
+def sync():
+    # Tasks changed and deleted since ?since=<cursor from the last response>;
+    # without one (or with an expired one) every task, with reset set
+    with db_connection() as conn:
+        cur = conn.cursor()
+        changes = load_changes(cur, current_user.id, request.args.get('since'), SYNC_PAGE_SIZE,
+                               current_app.config['SYNC_RETENTION_DAYS'])
+        cur.close()
+    return sync_response(changes)
@@ -1,61 +1,126 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Response, current_app, render_template, stream_template, request, redirect, url_for, flash, jsonify, abort
+from flask.cli import AppGroup
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_apscheduler import APScheduler
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, date, timedelta
-from pywebpush import webpush
+from datetime import date
+import hashlib
+import io
 import json
+import queue
+import time
+from db import db_connection, get_pool
+from cache import MISSING, cache_from_env
+from fragments import FragmentCache, quadrant_key
+from markupsafe import Markup
+from board import QUADRANTS
+from models import Frequency, Importance, Urgency
+from cursors import InvalidCursor, check_id
+from repository import BatchConflict, Conflict, repository_from_env
+from batch import BatchError, parse_operations
+from migrations import db_cli
+from api import api, MAX_DAYS
+from analytics import load_analytics
+import metrics
+from events import broker
+from notifications import PushDispatcher, notify_due_tasks, record_results
+from transfer import FORMATS, RowError, export_tasks, format_for, import_tasks, tasks_cli
+from jobs import JobRunner
+from sync import prune_deletions
+from functools import cache, wraps
 
-# Initialize Flask app
-load_dotenv()
-app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "default-secret-for-dev")
+
+def settings_from_env():
+    load_dotenv()
+    return {
+        'SECRET_KEY': os.getenv("SECRET_KEY", "default-secret-for-dev"),
+        'STATS_ENABLED': os.getenv("STATS_ENABLED", "0") == "1",
+        'TASK_PAGE_SIZE': int(os.getenv("TASK_PAGE_SIZE", "25")),
+        'SEARCH_PAGE_SIZE': int(os.getenv("SEARCH_PAGE_SIZE", "20")),
+        'REPORT_PAGE_SIZE': int(os.getenv("REPORT_PAGE_SIZE", "200")),
+        'METRICS_ENABLED': os.getenv("METRICS_ENABLED", "0") == "1",
+        'EVENT_STREAM': os.getenv("EVENT_STREAM", "0") == "1",
+        'EVENT_HEARTBEAT': float(os.getenv("EVENT_HEARTBEAT", "15")),
+        'SYNC_RETENTION_DAYS': int(os.getenv("SYNC_RETENTION_DAYS", "30")),
+        # Web push; the sweep only runs once a VAPID key is configured
+        'VAPID_PRIVATE_KEY': os.getenv("VAPID_PRIVATE_KEY"),
+        'VAPID_CLAIM_SUB': os.getenv("VAPID_CLAIM_SUB", "mailto:your@email.com"),
+        'PUSH_WORKERS': int(os.getenv("PUSH_WORKERS", "8")),
+        'PUSH_PER_HOST': int(os.getenv("PUSH_PER_HOST", "4")),
+        # None: lease on PostgreSQL, local on SQLite (see start_scheduler)
+        'SCHEDULER_MODE': os.getenv("SCHEDULER_MODE"),
+        'JOB_LEASE_SECONDS': int(os.getenv("JOB_LEASE_SECONDS", "3600")),
+        'JOB_POLL_INTERVAL': int(os.getenv("JOB_POLL_INTERVAL", "60")),
+        'NOTIFY_INTERVAL': int(os.getenv("NOTIFY_INTERVAL", "3600")),
+    }
+
+# Views and jobs below are collected at import and bound to an app by
+# create_app, views under their bare endpoint names (url_for('tasks'), the
+# metrics labels)
+ROUTES = []
+JOBS = []
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, options, view))
+        return view
+    return decorator
+
+# The current app's subsystems, set up by create_app. Users, tasks and the
+# pages built on them go through the repository (STORAGE_BACKEND=sqlite for a
+# single file, no server). The API, analytics, import/export, live events and
+# push reminders need PostgreSQL.
+repository = LocalProxy(lambda: current_app.extensions['eisenhower']['repository'])
+push_dispatcher = LocalProxy(lambda: current_app.extensions['eisenhower']['push_dispatcher'])
+job_runner = LocalProxy(lambda: current_app.extensions['eisenhower']['job_runner'])
+
+def postgres_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config['POSTGRES']:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
 
 # Flask-Login setup
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "login"
 
 # User model
 class User(UserMixin):
-    def __init__(self, id, name, password):
+    def __init__(self, id, name):
         self.id = id
         self.name = name
-        self.password = password
+
+# Cached {'id', 'name'} per user id (None for unknown ids), so authenticated
+# requests don't need a database roundtrip to rebuild current_user
+user_cache = cache_from_env('USER_CACHE', maxsize=4096, ttl=300)
+
+def invalidate_user(user_id):
+    # Call whenever a user row is created, renamed or gets a new password
+    user_cache.delete(user_id)
+
+# Rendered /tasks quadrant panels per user, version, day and page; bounded by
+# count and total size
+fragment_cache = FragmentCache(cache_from_env('FRAGMENT_CACHE', maxsize=4096, ttl=86400, maxbytes=64 * 1024 * 1024))
+
+# Check-in dashboards per user, day and data version
+checkin_cache = cache_from_env('CHECKIN_CACHE', maxsize=1024, ttl=86400)
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, name, password FROM users WHERE id = %s', (user_id,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    user = user_cache.get(user_id)
+    if user is MISSING:
+        row = repository.get_user(user_id)
+        user = {'id': row['id'], 'name': row['name']} if row else None
+        user_cache.set(user_id, user)
     if user:
-        return User(user['id'], user['name'], user['password'])
+        return User(user['id'], user['name'])
     return None
 
-# Database connection
-def get_db_connection():
-    if 'DATABASE_URL' in os.environ:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=RealDictCursor)
-    else:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT", "5432"),
-            cursor_factory=RealDictCursor
-        )
-    return conn
-
 # Custom Jinja2 filter for datetime formatting
-@app.template_filter('datetimeformat')
 def datetimeformat(value, format='%Y-%m-%d'):
     if value is None:
         return ""
@@ -64,60 +129,92 @@ def datetimeformat(value, format='%Y-%m-%d'):
     return value.strftime(format)
 
 # Routes
-@app.route('/')
+def invalid_cursor(e):
+    # A hand-edited or truncated paging link
+    return "Malformed page cursor", 400
+
+@route('/')
 @login_required
 def index():
     return redirect(url_for('tasks'))
-from pywebpush import webpush
-import json
 
-@app.route('/subscribe', methods=['POST'])
+
+@cache
+def asset_version():
+    # Changes whenever any static file does. Hashed on the first /sw.js
+    # request rather than at import, and kept for the life of the process
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(current_app.static_folder)):
+        path = os.path.join(current_app.static_folder, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()[:12]
+
+@route('/sw.js')
+def service_worker():
+    # From the root rather than /static, so its scope covers every page
+    response = Response(render_template('sw.js', asset_version=asset_version()),
+                        mimetype='application/javascript')
+    response.cache_control.no_cache = True
+    return response
+
+def tag_page_user(response):
+    # The service worker keeps the offline board per user and drops it when
+    # this changes (see templates/sw.js)
+    if response.mimetype == 'text/html' and current_user.is_authenticated:
+        response.headers['X-Sync-User'] = current_user.id
+    return response
+
+@route('/subscribe', methods=['POST'])
 @login_required
+@postgres_only
 def subscribe():
     subscription = request.get_json()
     # Store subscription in DB (e.g., new table 'subscriptions')
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        'INSERT INTO subscriptions (user_id, subscription) VALUES (%s, %s)',
-        (current_user.id, json.dumps(subscription))
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            'INSERT INTO subscriptions (user_id, subscription) VALUES (%s, %s)',
+            (current_user.id, json.dumps(subscription))
+        )
+        conn.commit()
+        cur.close()
     return jsonify({"status": "success"})
 
-@app.route('/send_notification', methods=['POST'])
+@route('/send_notification', methods=['POST'])
 @login_required
+@postgres_only
 def send_notification():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT subscription FROM subscriptions WHERE user_id = %s', (current_user.id,))
-    subscription = cur.fetchone()
-    cur.close()
-    conn.close()
-    if subscription:
-        webpush(
-            subscription_info=json.loads(subscription['subscription']),
-            data=json.dumps({"title": "Task Reminder", "body": "You have overdue tasks!"}),
-            vapid_private_key="your_vapid_private_key",
-            vapid_claims={"sub": "mailto:your@email.com"}
-        )
-    return jsonify({"status": "sent"})
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT id, subscription FROM subscriptions WHERE user_id = %s', (current_user.id,))
+        rows = cur.fetchall()
+        conn.commit()
+        message = {"title": "Task Reminder", "body": "You have overdue tasks!"}
+        messages, unreadable = [], []
+        for row in rows:
+            try:
+                messages.append((row['id'], json.loads(row['subscription']), message))
+            except ValueError:
+                unreadable.append(row['id'])
+        # Answering a request, so a busy push service isn't waited on
+        results = push_dispatcher.dispatch(messages, max_retries=0)
+        results['failed'].extend(unreadable)
+        record_results(cur, results)
+        conn.commit()
+        cur.close()
+    return jsonify({"status": "sent", "sent": len(results['sent']), "failed": len(results['failed'])})
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         user_id = request.form['user_id']
         password = request.form['password']
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id, name, password FROM users WHERE id = %s', (user_id,))
-        user_data = cur.fetchone()
-        cur.close()
-        conn.close()
+        user_data = repository.get_user(user_id)
         if user_data and check_password_hash(user_data['password'], password):
-            user = User(user_data['id'], user_data['name'], user_data['password'])
+            user = User(user_data['id'], user_data['name'])
+            user_cache.set(user.id, {'id': user.id, 'name': user.name})
             login_user(user)
             flash("Logged in successfully!", "success")
             return redirect(url_for('tasks'))
@@ -126,270 +223,428 @@ def login():
             return redirect(url_for('login'))
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         user_id = request.form['user_id']
         name = request.form['name']
         password = request.form['password']
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id FROM users WHERE id = %s', (user_id,))
-        if cur.fetchone():
+        if not repository.create_user(user_id, name, generate_password_hash(password)):
             flash("Username already taken!", "danger")
-            cur.close()
-            conn.close()
             return redirect(url_for('register'))
-        hashed_password = generate_password_hash(password)
-        cur.execute(
-            'INSERT INTO users (id, name, password) VALUES (%s, %s, %s)',
-            (user_id, name, hashed_password)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        invalidate_user(user_id)
         flash("Registered successfully! Please log in.", "success")
         return redirect(url_for('login'))
     return render_template('register.html')
 
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout():
     logout_user()
     flash("Logged out successfully!", "success")
     return redirect(url_for('login'))
 
-@app.route('/tasks')
+@route('/tasks')
 @login_required
 def tasks():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM tasks WHERE user_id = %s ORDER BY due_date ASC', (current_user.id,))
-    tasks = cur.fetchall()
     today = date.today()
-    for task in tasks:
-        impact = task.get('impact', 5)
-        days_until_due = (task['due_date'] - today).days if task['due_date'] else 30
-        task['priority'] = impact * (1 if task['importance'] == 'important' else 0.5) / max(days_until_due, 1)
-    suggested_tasks = sorted(tasks, key=lambda x: x['priority'], reverse=True)[:int(len(tasks) * 0.2) or 1]
-    cur.close()
-    conn.close()
-    return render_template('tasks.html', tasks=tasks, suggested_tasks=suggested_tasks, today=today)
-
-@app.route('/add_task', methods=['GET', 'POST'])
+    hide_completed = request.args.get('hide_completed') == '1'
+    cursors = {key: request.args.get(key + '_after') for key, *_ in QUADRANTS}
+    page_size = current_app.config['TASK_PAGE_SIZE']
+    # Read before the board, so a panel is never cached under a newer
+    # version than the data it shows
+    version = repository.data_version(current_user.id)
+    keys = {key: quadrant_key(current_user.id, key, version, today, page_size, request.query_string.decode())
+            for key, *_ in QUADRANTS}
+    panels = {key: fragment_cache.get(cache_key) for key, cache_key in keys.items()}
+    quadrants = []
+    if MISSING in panels.values():
+        quadrants = repository.load_board(current_user.id, cursors, hide_completed, page_size)
+    suggested = repository.suggested_tasks(current_user.id, today, open_only=hide_completed)
+    for quadrant in quadrants:
+        if panels[quadrant['key']] is not MISSING:
+            continue
+        # Paging one quadrant keeps the others where they are
+        args = request.args.to_dict()
+        args.pop(quadrant['key'] + '_after', None)
+        quadrant['first_url'] = url_for('tasks', **args)
+        if quadrant['next_cursor']:
+            args[quadrant['key'] + '_after'] = quadrant['next_cursor']
+            quadrant['next_url'] = url_for('tasks', **args)
+        panels[quadrant['key']] = fragment_cache.render(
+            keys[quadrant['key']], lambda: render_template('_quadrant.html', quadrant=quadrant, today=today))
+    panels = [Markup(panels[key]) for key, *_ in QUADRANTS]
+    return render_template('tasks.html', panels=panels, suggested_tasks=suggested, today=today,
+                           hide_completed=hide_completed)
+
+def task_form():
+    # A select value that isn't one of the enum's can only come from a
+    # hand-built request (400)
+    try:
+        return {
+            'title': request.form['title'],
+            'urgency': Urgency(request.form['urgency']),
+            'importance': Importance(request.form['importance']),
+            'due_date': request.form['due_date'] or None,
+            'impact': int(request.form['impact']),
+            'frequency': Frequency(request.form['frequency']),
+        }
+    except ValueError:
+        abort(400)
+
+def version_from(values):
+    # The version a link or form was rendered with, or None to write
+    # regardless; one that isn't an int4 can't be ours (400)
+    version = values.get('version')
+    if version in (None, ''):
+        return None
+    try:
+        return check_id(version)
+    except ValueError:
+        abort(400)
+
+@route('/add_task', methods=['GET', 'POST'])
 @login_required
 def add_task():
     if request.method == 'POST':
-        title = request.form['title']
-        urgency = request.form['urgency']
-        importance = request.form['importance']
-        due_date = request.form['due_date'] or None
-        impact = int(request.form['impact'])
-        frequency = request.form['frequency']
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s)',
-            (title, urgency, importance, due_date, impact, frequency, current_user.id)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        repository.add_task(current_user.id, task_form())
         flash("Task added successfully!", "success")
         return redirect(url_for('tasks'))
     return render_template('add_task.html')
 
-@app.route('/edit_task/<int:task_id>', methods=['GET', 'POST'])
+@route('/edit_task/<int:task_id>', methods=['GET', 'POST'])
 @login_required
 def edit_task(task_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
     if request.method == 'POST':
-        title = request.form['title']
-        urgency = request.form['urgency']
-        importance = request.form['importance']
-        due_date = request.form['due_date'] or None
-        impact = int(request.form['impact'])
-        frequency = request.form['frequency']
-        cur.execute(
-            'UPDATE tasks SET title = %s, urgency = %s, importance = %s, due_date = %s, impact = %s, frequency = %s WHERE id = %s AND user_id = %s',
-            (title, urgency, importance, due_date, impact, frequency, task_id, current_user.id)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            repository.update_task(current_user.id, task_id, task_form(), version_from(request.form))
+        except Conflict as e:
+            # Show what is saved now; submitting again overwrites it knowingly
+            flash("This task was changed somewhere else. Review the current version and save again.", "warning")
+            return render_template('edit_task.html', task=e.task), 409
         flash("Task updated successfully!", "success")
         return redirect(url_for('tasks'))
-    cur.execute('SELECT * FROM tasks WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-    task = cur.fetchone()
-    cur.close()
-    conn.close()
+    task = repository.get_task(current_user.id, task_id)
     if not task:
         flash("Task not found!", "danger")
         return redirect(url_for('tasks'))
     return render_template('edit_task.html', task=task)
 
-@app.route('/delete_task/<int:task_id>')
+@route('/delete_task/<int:task_id>')
 @login_required
 def delete_task(task_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM tasks WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    repository.delete_task(current_user.id, task_id)
     flash("Task deleted successfully!", "success")
     return redirect(url_for('tasks'))
 
-@app.route('/toggle_task/<int:task_id>')
+@route('/toggle_task/<int:task_id>')
 @login_required
 def toggle_task(task_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM tasks WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-    task = cur.fetchone()
-    if task and not task['completed'] and task['frequency'] != 'none':
-        new_due_date = None
-        if task['frequency'] == 'daily':
-            new_due_date = task['due_date'] + timedelta(days=1) if task['due_date'] else date.today() + timedelta(days=1)
-        elif task['frequency'] == 'weekly':
-            new_due_date = task['due_date'] + timedelta(weeks=1) if task['due_date'] else date.today() + timedelta(weeks=1)
-        elif task['frequency'] == 'monthly':
-            new_due_date = task['due_date'] + timedelta(days=30) if task['due_date'] else date.today() + timedelta(days=30)
-        if new_due_date:
-            cur.execute(
-                'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s)',
-                (task['title'], task['urgency'], task['importance'], new_due_date, task['impact'], task['frequency'], current_user.id)
-            )
-    cur.execute('UPDATE tasks SET completed = NOT completed WHERE id = %s AND user_id = %s', (task_id, current_user.id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Links carry the version they were rendered with, so a double click or
+    # a stale tab can't flip the task back
+    try:
+        repository.toggle_task(current_user.id, task_id, version=version_from(request.args))
+    except Conflict:
+        flash("This task was changed somewhere else, so it was left as it is.", "warning")
+        return redirect(url_for('tasks'))
     flash("Task status updated successfully!", "success")
     return redirect(url_for('tasks'))
 
-@app.route('/report')
+@route('/tasks/batch', methods=['POST'])
+@login_required
+def batch_tasks():
+    # Bulk edits from the board (see batch.py): all or nothing, one
+    # statement per operation
+    try:
+        operations = parse_operations(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        results, versions = repository.apply_batch(current_user.id, operations)
+    except BatchConflict as e:
+        return jsonify({"error": "changed", "tasks": [
+            {"id": task.id, "version": task.version} for task in e.tasks]}), 409
+    return jsonify({
+        "results": [{"op": operation['op'], "ids": ids} for operation, ids in zip(operations, results)],
+        # Where the written tasks are now, so a client can make its next edit
+        # to them without reloading
+        "tasks": [{"id": task_id, "version": version} for task_id, version in sorted(versions.items())],
+        "version": repository.data_version(current_user.id),
+    })
+
+@route('/tasks/import', methods=['GET', 'POST'])
+@login_required
+@postgres_only
+def import_tasks_route():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash("Choose a file to import.", "danger")
+            return redirect(url_for('import_tasks_route'))
+        # Werkzeug spools large uploads to disk; rows are read from it as COPY asks for them
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        try:
+            with db_connection() as conn:
+                count = import_tasks(conn, current_user.id, lines, format_for(upload.filename))
+        except RowError as e:
+            flash("Nothing imported, %s" % e, "danger")
+            return redirect(url_for('import_tasks_route'))
+        flash("Imported %d tasks." % count, "success")
+        return redirect(url_for('tasks'))
+    return render_template('import_tasks.html')
+
+@route('/tasks/export')
+@login_required
+@postgres_only
+def export_tasks_route():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    user_id = current_user.id
+
+    def stream():
+        # The connection is held only while the download runs
+        with db_connection() as conn:
+            yield from export_tasks(conn, user_id, fmt)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = 'tasks.%s' % fmt
+    return Response(stream(), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+@route('/report')
 @login_required
 def report():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    query = 'SELECT * FROM tasks WHERE user_id = %s AND completed = TRUE'
-    params = [current_user.id]
-    if start_date:
-        query += ' AND created_at >= %s'
-        params.append(start_date)
-    if end_date:
-        query += ' AND created_at <= %s'
-        params.append(end_date)
-    query += ' ORDER BY created_at DESC'
-    cur.execute(query, params)
-    completed_tasks = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('report.html', completed_tasks=completed_tasks)
-
-@app.route('/checkin')
+    start_date, end_date = request.args.get('start_date'), request.args.get('end_date')
+    if request.args.get('view') == 'summary':
+        summary = repository.report_summary(current_user.id, start_date, end_date)
+        return render_template('report.html', summary=summary)
+    after = request.args.get('after')
+    # Rendered while rows arrive; the connection is held until the page is sent
+    page = repository.report_page(current_user.id, start_date, end_date, after, current_app.config['REPORT_PAGE_SIZE'])
+    return current_app.response_class(stream_template('report.html', completed_tasks=page, paged=bool(after)))
+
+@route('/analytics')
+@login_required
+@postgres_only
+def analytics():
+    days = min(max(request.args.get('days', 30, type=int), 1), MAX_DAYS)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        stats = load_analytics(cur, current_user.id, date.today(), days)
+        cur.close()
+    return render_template('analytics.html', stats=stats, days=days, quadrants=QUADRANTS)
+
+@route('/checkin')
 @login_required
 def checkin():
-    conn = get_db_connection()
-    cur = conn.cursor()
     today = date.today()
-    week_ago = today - timedelta(days=7)
-    next_week = today + timedelta(days=7)
-    cur.execute(
-        'SELECT * FROM tasks WHERE user_id = %s AND completed = TRUE AND created_at >= %s ORDER BY created_at DESC',
-        (current_user.id, week_ago)
-    )
-    completed_tasks = cur.fetchall()
-    cur.execute(
-        'SELECT * FROM tasks WHERE user_id = %s AND completed = FALSE AND due_date < %s',
-        (current_user.id, today)
-    )
-    overdue_tasks = cur.fetchall()
-    cur.execute(
-        'SELECT * FROM tasks WHERE user_id = %s AND completed = FALSE AND due_date BETWEEN %s AND %s ORDER BY due_date ASC',
-        (current_user.id, today, next_week)
-    )
-    upcoming_tasks = cur.fetchall()
-    cur.execute('SELECT * FROM tasks WHERE user_id = %s AND completed = FALSE ORDER BY due_date ASC', (current_user.id,))
-    tasks = cur.fetchall()
-    for task in tasks:
-        impact = task.get('impact', 5)
-        days_until_due = (task['due_date'] - today).days if task['due_date'] else 30
-        task['priority'] = impact * (1 if task['importance'] == 'important' else 0.5) / max(days_until_due, 1)
-    suggested_tasks = sorted(tasks, key=lambda x: x['priority'], reverse=True)[:int(len(tasks) * 0.2) or 1]
-    cur.close()
-    conn.close()
-    return render_template('checkin.html', completed_tasks=completed_tasks, overdue_tasks=overdue_tasks,
-                          upcoming_tasks=upcoming_tasks, suggested_tasks=suggested_tasks, today=today)
-
-
-# Initialize scheduler
-scheduler = APScheduler()
-scheduler.init_app(app)
-scheduler.start()
-
-# Scheduled task
-@scheduler.task('interval', id='create_recurring_tasks', seconds=86400)  # Daily
+    # Any task write bumps the version, so a cached page is never stale
+    key = '%s:%s:%s' % (current_user.id, today.isoformat(), repository.data_version(current_user.id))
+    dashboard = checkin_cache.get(key)
+    if dashboard is MISSING:
+        dashboard = repository.load_checkin(current_user.id, today)
+        checkin_cache.set(key, dashboard)
+    return render_template('checkin.html', today=today, **dashboard)
+
+# Server-sent events: pushes task changes to the user's open tabs. Each stream
+# holds its worker while open, so enable it (EVENT_STREAM=1) only with an async
+# worker class, e.g. WEB_WORKER_CLASS=gevent, or with SERVER_MODE=asgi, where
+# asgi.py serves it (see gunicorn.conf.py).
+@route('/events')
+@login_required
+def events():
+    if not current_app.config['EVENT_STREAM'] or not current_app.config['POSTGRES']:
+        # 204 tells EventSource not to reconnect; the page keeps polling instead
+        return Response(status=204)
+    user_id = current_user.id
+    heartbeat = current_app.config['EVENT_HEARTBEAT']
+
+    def stream():
+        queue_ = broker.subscribe(user_id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = queue_.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'event: task\ndata: %s\n\n' % json.dumps(event)
+        finally:
+            broker.unsubscribe(user_id, queue_)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Prometheus scrape target, off unless METRICS_ENABLED=1
+@route('/metrics')
+def prometheus_metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Internal counters, off unless STATS_ENABLED=1
+@route('/internal/stats')
+def internal_stats():
+    if not current_app.config['STATS_ENABLED']:
+        abort(404)
+    return jsonify({
+        "db_pool": get_pool().stats(),
+        "user_cache": user_cache.stats(),
+        "checkin_cache": checkin_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "jobs": job_runner.status() if current_app.config['SCHEDULER_MODE'] == 'lease' else None,
+    })
+
+
+# Scheduled jobs. SCHEDULER_MODE=lease (the default on PostgreSQL): every
+# process polls the job_runs table and each due job runs in exactly one of
+# them, on a schedule that survives restarts. local: every process runs every
+# job on its own timer (fine for a single SQLite node). off: no jobs here.
+# Either way they only run in processes that call start_scheduler.
+def scheduled(name, seconds):
+    # seconds: an interval, or the config key holding one
+    def decorator(func):
+        func = metrics.timed_job(name)(func)
+        JOBS.append((name, seconds, func))
+        return func
+    return decorator
+
+@scheduled('create_recurring_tasks', 86400)
 def create_recurring_tasks():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    today = date.today()
-    cur.execute("SELECT * FROM tasks WHERE frequency != 'none' AND completed = TRUE")
-    completed_tasks = cur.fetchall()
-    for task in completed_tasks:
-        new_due_date = None
-        if task['frequency'] == 'daily':
-            new_due_date = (task['due_date'] or today) + timedelta(days=1)
-        elif task['frequency'] == 'weekly':
-            new_due_date = (task['due_date'] or today) + timedelta(weeks=1)
-        elif task['frequency'] == 'monthly':
-            new_due_date = (task['due_date'] or today) + timedelta(days=30)
-        if new_due_date:
-            cur.execute(
-                'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id, completed) '
-                'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-                (task['title'], task['urgency'], task['importance'], new_due_date, task['impact'], task['frequency'], task['user_id'], False)
-            )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-@app.route('/search', methods=['GET'])
+    repository.rollover_recurring_tasks(chunk_size=int(os.getenv("ROLLOVER_CHUNK_SIZE", "500")))
+
+@scheduled('notify_due_tasks', 'NOTIFY_INTERVAL')
+def send_due_task_reminders():
+    if not current_app.config['VAPID_PRIVATE_KEY'] or not current_app.config['POSTGRES']:
+        return
+    with db_connection() as conn:
+        notify_due_tasks(conn, push_dispatcher, quiet_hours=float(os.getenv("NOTIFY_QUIET_HOURS", "12")))
+
+@scheduled('prune_task_deletions', 86400)
+def prune_task_deletions():
+    if not current_app.config['POSTGRES']:
+        return
+    with db_connection() as conn:
+        cur = conn.cursor()
+        prune_deletions(cur, current_app.config['SYNC_RETENTION_DAYS'])
+        conn.commit()
+        cur.close()
+
+@route('/search', methods=['GET'])
 @login_required
 def search():
     query = request.args.get('q', '')
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM tasks WHERE user_id = %s AND title ILIKE %s", (current_user.id, f'%{query}%'))
-    tasks = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('search_results.html', tasks=tasks)
+    tasks, next_cursor = repository.search_tasks(current_user.id, query, request.args.get('after'), current_app.config['SEARCH_PAGE_SIZE'])
+    next_url = url_for('search', q=query, after=next_cursor) if next_cursor else None
+    return render_template('search_results.html', tasks=tasks, query=query, next_url=next_url)
+
+# Typeahead for the navbar search box
+@route('/search/suggest', methods=['GET'])
+@login_required
+def search_suggest():
+    tasks, _ = repository.search_tasks(current_user.id, request.args.get('q', ''), limit=8)
+    return jsonify([{"id": task.id, "title": task.title} for task in tasks])
+
+jobs_cli = AppGroup('jobs', help='Scheduled jobs.')
+
+@jobs_cli.command('run')
+def run_jobs_command():
+    """Run the scheduled jobs in this process until interrupted."""
+    if start_scheduler(current_app._get_current_object()) is None:
+        raise SystemExit('SCHEDULER_MODE is off')
+    while True:
+        time.sleep(3600)
+
+
+def create_app(config=None, repository=None):
+    # config overrides the environment (settings_from_env). Nothing here
+    # connects or starts a thread: the pool opens connections on first use
+    # and jobs only run where start_scheduler is called.
+    app = Flask(__name__)
+    app.config.update(settings_from_env())
+    app.config.update(config or {})
+    repository = repository or repository_from_env()
+    app.config['POSTGRES'] = repository.name == 'postgres'
+    if app.config['SCHEDULER_MODE'] is None:
+        app.config['SCHEDULER_MODE'] = 'lease' if app.config['POSTGRES'] else 'local'
+    if app.config['SCHEDULER_MODE'] not in ('lease', 'local', 'off'):
+        raise ValueError("SCHEDULER_MODE must be lease, local or off")
+    if app.config['SCHEDULER_MODE'] == 'lease' and not app.config['POSTGRES']:
+        raise ValueError("SCHEDULER_MODE=lease needs PostgreSQL")
+
+    job_runner = JobRunner(lease_seconds=app.config['JOB_LEASE_SECONDS'])
+    for name, seconds, func in JOBS:
+        job_runner.job(name, job_interval(app, seconds))(func)
+    app.extensions['eisenhower'] = {
+        'repository': repository,
+        'job_runner': job_runner,
+        'push_dispatcher': PushDispatcher(
+            app.config['VAPID_PRIVATE_KEY'],
+            {"sub": app.config['VAPID_CLAIM_SUB']},
+            max_workers=app.config['PUSH_WORKERS'],
+            per_host=app.config['PUSH_PER_HOST'],
+        ),
+    }
+
+    metrics.init_app(app)
+    login_manager.init_app(app)
+    app.add_template_filter(datetimeformat, 'datetimeformat')
+    # The task forms list the enums' members
+    app.jinja_env.globals.update(Urgency=Urgency, Importance=Importance, Frequency=Frequency)
+    app.register_error_handler(InvalidCursor, invalid_cursor)
+    app.after_request(tag_page_user)
+    for rule, options, view in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.cli.add_command(jobs_cli)
+    if app.config['POSTGRES']:
+        app.cli.add_command(db_cli)
+        app.cli.add_command(tasks_cli)
+        # JSON API; /api always serves the latest version
+        app.register_blueprint(api, url_prefix='/api/v1')
+        app.register_blueprint(api, url_prefix='/api', name='api_latest')
+    return app
+
+
+def job_interval(app, seconds):
+    return app.config[seconds] if isinstance(seconds, str) else seconds
+
+
+def in_app_context(app, func):
+    @wraps(func)
+    def run():
+        with app.app_context():
+            return func()
+    return run
+
+
+def start_scheduler(app):
+    # Starts the app's jobs in this process and returns the scheduler, or
+    # None with SCHEDULER_MODE=off. Called only where jobs belong: gunicorn
+    # workers (gunicorn.conf.py, unless RUN_JOBS=0), `flask jobs run` and
+    # `python app.py`; never by imports, tests or other CLI commands.
+    if app.config['SCHEDULER_MODE'] == 'off':
+        return None
+    # APScheduler is only imported by the processes that run jobs
+    from flask_apscheduler import APScheduler
+
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    if app.config['SCHEDULER_MODE'] == 'lease':
+        runner = app.extensions['eisenhower']['job_runner']
+        scheduler.add_job('run_due_jobs', in_app_context(app, runner.run_due), trigger='interval',
+                          seconds=app.config['JOB_POLL_INTERVAL'])
+    else:
+        for name, seconds, func in JOBS:
+            scheduler.add_job(name, in_app_context(app, func), trigger='interval', seconds=job_interval(app, seconds))
+    scheduler.start()
+    return scheduler
+
 
 if __name__ == '__main__':
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        password TEXT NOT NULL
-    )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS tasks (
-        id SERIAL PRIMARY KEY,
-        title TEXT NOT NULL,
-        urgency TEXT NOT NULL,
-        importance TEXT NOT NULL,
-        due_date DATE,
-        impact INTEGER DEFAULT 5,
-        frequency TEXT DEFAULT 'none',
-        completed BOOLEAN DEFAULT FALSE,
-        user_id TEXT NOT NULL REFERENCES users(id),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    conn.commit()
-    cur.close()
-    conn.close()
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    with app.app_context():
+        repository.migrate()
+    start_scheduler(app)
+    app.run(debug=True)
@@ -0,0 +1,303 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import Response, request, session
+from flask_login import current_user
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from werkzeug.exceptions import HTTPException
+
+from api import SYNC_PAGE_SIZE, conditional, list_tasks_args, not_modified, sync_response, task_list_response
+from app import create_app, user_cache
+from cache import MISSING
+from db import connection_args
+from models import row_maker
+from events import CHANNEL
+from sync import HORIZON_SQL, SYNC_SQL, changes_page, changes_params, plan_changes
+from versions import DATA_VERSION_SQL, stamp_of
+
+
+# ASGI entry point (SERVER_MODE=asgi, see gunicorn.conf.py). The JSON task
+# list, /api/sync and /events run on the event loop with psycopg 3's async
+# pool, so a slow query or an open event stream costs a coroutine rather than
+# a worker. Every other route is the Flask view, run in a thread pool with the
+# usual blocking pool, so pages, templates, sessions and hooks are shared with
+# the WSGI app.
+
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+# Threads for the Flask views; each may hold one of the blocking pool's
+# connections, so keep it at or below DB_POOL_MAX
+executor = ThreadPoolExecutor(int(os.getenv("ASGI_THREADS", "10")), thread_name_prefix='asgi-wsgi')
+
+
+def pool_from_env():
+    conninfo, params = connection_args()
+    return AsyncConnectionPool(
+        conninfo,
+        kwargs=dict(params, row_factory=dict_row),
+        min_size=int(os.getenv("DB_POOL_MIN", "1")),
+        max_size=int(os.getenv("DB_POOL_MAX", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        open=False,
+    )
+
+
+# Created when the server starts (lifespan) and closed when it stops
+pool = None
+
+
+def task_row(cursor):
+    # psycopg row factory for models.Task, as db.TaskCursor is for psycopg2
+    return row_maker(tuple(column.name for column in cursor.description))
+
+
+class WsgiRequest(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call in one shared thread; requests are
+    # independent here, so they get the executor's threads instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.run_wsgi_app.__wrapped__, thread_sensitive=False, executor=executor)
+
+    def environ(self, scope):
+        self.scope = scope
+        return self.build_environ(scope, io.BytesIO())
+
+
+class AsyncEventBroker:
+    # events.EventBroker on the event loop: one LISTEN connection per process,
+    # started with the first stream, fans notifications out to asyncio queues
+    def __init__(self, channel=CHANNEL, max_queue=100):
+        self.channel = channel
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._listener = None
+        self.listening = None
+
+    def subscribe(self, user_id):
+        if self._listener is None or self._listener.done():
+            self.listening = asyncio.Event()
+            self._listener = asyncio.ensure_future(self._listen())
+        events = asyncio.Queue(self.max_queue)
+        self._subscribers.setdefault(user_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        streams = self._subscribers.get(user_id, set())
+        streams.discard(events)
+        if not streams:
+            self._subscribers.pop(user_id, None)
+
+    def subscriber_count(self):
+        return sum(len(streams) for streams in self._subscribers.values())
+
+    def publish(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        for events in list(self._subscribers.get(message.get('user_id'), ())):
+            try:
+                events.put_nowait(message)
+            except asyncio.QueueFull:
+                # A stalled client only loses events; it refetches on reconnect anyway
+                pass
+
+    async def _listen(self):
+        conninfo, params = connection_args()
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True, **params) as conn:
+                    await conn.execute('LISTEN %s' % self.channel)
+                    self.listening.set()
+                    async for notify in conn.notifies():
+                        self.publish(notify.payload)
+            except Exception as e:
+                # The process's only listener: reconnect rather than let every stream go quiet
+                if not isinstance(e, psycopg.Error):
+                    logger.exception('Event listener failed; reconnecting')
+                self.listening.clear()
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+
+broker = AsyncEventBroker()
+
+
+async def warm_user(user_id):
+    # Fills the user cache as load_user would, so resolving current_user
+    # below never reaches the blocking repository
+    if user_id is None or user_cache.get(user_id) is not MISSING:
+        return
+    async with pool.connection() as conn:
+        cur = await conn.execute('SELECT id, name FROM users WHERE id = %s', (user_id,))
+        row = await cur.fetchone()
+    user_cache.set(user_id, {'id': row['id'], 'name': row['name']} if row else None)
+
+
+# The async twins of api.list_tasks, api.sync and app.events
+
+async def list_tasks():
+    fields, query, params, limit = list_tasks_args()
+    async with pool.connection() as conn:
+        cur = await conn.execute(DATA_VERSION_SQL, (current_user.id,))
+        version, changed_at = stamp_of(await cur.fetchone())
+        etag, fresh = not_modified(version, changed_at)
+        if fresh:
+            return conditional(Response(status=304), etag, changed_at)
+        cur = await conn.cursor(row_factory=task_row).execute(query, params)
+        rows = await cur.fetchall()
+    return task_list_response(rows, fields, limit, version, etag, changed_at)
+
+
+async def sync():
+    reset, since, issued, after = plan_changes(request.args.get('since'), app.config['SYNC_RETENTION_DAYS'])
+    async with pool.connection() as conn:
+        if since is None:
+            cur = await conn.execute(HORIZON_SQL)
+            since, issued = int((await cur.fetchone())['xmin']), int(time.time())
+        cur = await conn.execute(SYNC_SQL, changes_params(current_user.id, after, SYNC_PAGE_SIZE))
+        rows = await cur.fetchall()
+    return sync_response(changes_page(rows, since, issued, SYNC_PAGE_SIZE, reset))
+
+
+async def events():
+    if not current_user.is_authenticated:
+        return app.login_manager.unauthorized()
+    if not app.config['EVENT_STREAM']:
+        return Response(status=204)
+    user_id = current_user.id
+    heartbeat = app.config['EVENT_HEARTBEAT']
+
+    async def stream():
+        events = broker.subscribe(user_id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'event: task\ndata: %s\n\n' % json.dumps(event)
+        finally:
+            broker.unsubscribe(user_id, events)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# Endpoint -> async view; anything else goes to the Flask app
+ASYNC_VIEWS = {
+    'api.list_tasks': list_tasks,
+    'api_latest.list_tasks': list_tasks,
+    'api.sync': sync,
+    'api_latest.sync': sync,
+    'events': events,
+} if app.config['POSTGRES'] else {}
+
+
+def async_view(environ):
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+
+async def dispatch(view, environ):
+    # Flask's request handling (hooks, error handlers, session) around an
+    # async view
+    ctx = app.request_context(environ)
+    error = None
+    ctx.push()
+    try:
+        try:
+            await warm_user(session.get('_user_id'))
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await view()
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+    except Exception as e:
+        error = e
+        return app.make_response(app.handle_exception(e))
+    finally:
+        ctx.pop(error)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_response(response, send, receive):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.to_wsgi_list()],
+    })
+    if not hasattr(response.response, '__aiter__'):
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return
+
+    async def pump():
+        async for chunk in response.response:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body'})
+
+    # A stream ends when the client goes away
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_for_disconnect(receive))]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def lifespan(receive, send):
+    global pool
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if app.config['POSTGRES']:
+                pool = pool_from_env()
+                await pool.open()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await broker.close()
+            if pool is not None:
+                await pool.close()
+                pool = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError('Unsupported ASGI scope: %s' % scope['type'])
+    wsgi = WsgiRequest(app)
+    environ = wsgi.environ(scope)
+    view = async_view(environ)
+    if view is None:
+        return await wsgi(scope, receive, send)
+    await send_response(await dispatch(view, environ), send, receive)
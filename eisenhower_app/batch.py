@@ -0,0 +1,69 @@
+from datetime import date
+
+from board import QUADRANTS
+from cursors import MAX_INT
+
+
+# Bulk edits from the board (POST /tasks/batch): a list of operations, each
+# applied to many tasks with one statement, all in one transaction.
+#
+#   {"operations": [
+#       {"op": "complete", "ids": [1, 2, 3]},
+#       {"op": "move", "ids": [4], "versions": [7], "quadrant": "plan"},
+#       {"op": "reschedule", "ids": [5, 6], "due_date": "2025-04-14"},
+#       {"op": "delete", "ids": [8]}]}
+#
+# versions, when given, pairs each id with the version the client saw, and
+# the whole batch is refused if any of those tasks has changed since.
+
+OPERATIONS = ('complete', 'move', 'reschedule', 'delete')
+QUADRANT_COLUMNS = {key: (urgency, importance) for key, urgency, importance, _, _ in QUADRANTS}
+# Task ids across all operations of one batch
+MAX_IDS = 1000
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _ids(values, name):
+    # Ids and versions are int4 columns; bound them here rather than let the
+    # ::int[] cast fail in the database
+    if not isinstance(values, list) or not all(type(value) is int and 0 <= value <= MAX_INT for value in values):
+        raise BatchError('%s must be a list of integers from 0 to %d' % (name, MAX_INT))
+    return values
+
+
+def parse_operations(payload):
+    # Validates a request body; returns the operations with quadrant keys
+    # resolved to (urgency, importance) and dates parsed
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list')
+    parsed = []
+    total = 0
+    for n, operation in enumerate(operations, 1):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise BatchError('operation %d: op must be one of %s' % (n, ', '.join(OPERATIONS)))
+        ids = _ids(operation.get('ids'), 'operation %d: ids' % n)
+        versions = operation.get('versions')
+        if versions is not None and len(_ids(versions, 'operation %d: versions' % n)) != len(ids):
+            raise BatchError('operation %d: versions must match ids one to one' % n)
+        if len(set(ids)) != len(ids):
+            raise BatchError('operation %d: ids must be unique' % n)
+        total += len(ids)
+        item = {'op': operation['op'], 'ids': ids, 'versions': versions}
+        if item['op'] == 'move':
+            if operation.get('quadrant') not in QUADRANT_COLUMNS:
+                raise BatchError('operation %d: quadrant must be one of %s' % (n, ', '.join(QUADRANT_COLUMNS)))
+            item['urgency'], item['importance'] = QUADRANT_COLUMNS[operation['quadrant']]
+        elif item['op'] == 'reschedule':
+            due_date = operation.get('due_date')
+            try:
+                item['due_date'] = date.fromisoformat(due_date) if due_date is not None else None
+            except (TypeError, ValueError):
+                raise BatchError('operation %d: due_date must be YYYY-MM-DD or null' % n) from None
+        parsed.append(item)
+    if total > MAX_IDS:
+        raise BatchError('at most %d task ids per batch' % MAX_IDS)
+    return parsed
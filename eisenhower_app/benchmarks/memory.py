@@ -0,0 +1,99 @@
+import gc
+import json
+import time
+import tracemalloc
+
+import click
+
+from benchmarks.run import start_database
+
+
+# Memory held by task rows once fetched, per representation: dicts from the
+# default cursor (db.TimedCursor) for SELECT *, as the pages read tasks
+# before models.Task; dicts for the columns the pages now select; and
+# models.Task from db.TaskCursor. Each is fetched with fetchall() and measured
+# with tracemalloc while the list is alive, so the numbers are the Python
+# objects a board, report or suggestion list keeps per row. The fetch is also
+# timed, separately, since tracing slows it down.
+#
+#   cd eisenhower_app
+#   python -m benchmarks.memory --tasks 100000
+#
+# As with benchmarks.run, DATABASE_URL must point at a scratch database (or
+# pgserver is used).
+
+REPRESENTATIONS = ('dict_select_star', 'dict', 'task')
+
+
+def measure(conn, representation, user_id):
+    from db import TaskCursor
+    from models import COLUMNS_SQL
+
+    query = 'SELECT %s FROM tasks WHERE user_id = %%s ORDER BY id' % (
+        '*' if representation == 'dict_select_star' else COLUMNS_SQL)
+    cursor_factory = TaskCursor if representation == 'task' else None
+
+    def fetch():
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
+            cur.execute(query, (user_id,))
+            return cur.fetchall()
+
+    started = time.perf_counter()
+    fetch()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    try:
+        rows = fetch()
+        gc.collect()
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    conn.rollback()
+    return {
+        'rows': len(rows),
+        'held_mb': round(held / 2 ** 20, 2),
+        'peak_mb': round(peak / 2 ** 20, 2),
+        'bytes_per_row': round(held / len(rows)) if rows else 0,
+        'fetch_seconds': round(elapsed, 3),
+    }
+
+
+@click.command()
+@click.option('--tasks', default=100000, show_default=True, help='Tasks owned by the one synthetic user.')
+@click.option('--skip-seed', is_flag=True, help='Reuse data from an earlier run with the same scale.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the results as JSON.')
+def main(tasks, skip_seed, output):
+    """Compare the memory held per fetched task row by each row representation."""
+    database = start_database()
+    from benchmarks.seed import seed, user_id
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        if not skip_seed:
+            click.echo('Seeding 1 user x %d tasks...' % tasks)
+            seed(conn, 1, tasks)
+        results = {'tasks': tasks, 'representations': {}}
+        for representation in REPRESENTATIONS:
+            result = measure(conn, representation, user_id(0))
+            results['representations'][representation] = result
+            click.echo('%-17s %7d rows  %8.2f MB held  %8.2f MB peak  %5d bytes/row  %6.3f s'
+                       % (representation, result['rows'], result['held_mb'], result['peak_mb'],
+                          result['bytes_per_row'], result['fetch_seconds']))
+        before = results['representations']['dict_select_star']['bytes_per_row']
+        after = results['representations']['task']['bytes_per_row']
+        if before:
+            click.echo('models.Task holds %.0f%% less per row than SELECT * dicts' % (100 - after * 100 / before))
+    finally:
+        conn.close()
+        if database is not None:
+            database.cleanup()
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
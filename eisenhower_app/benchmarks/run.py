@@ -0,0 +1,242 @@
+import json
+import os
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+
+# Seeds a database, drives the main pages in-process (Flask test client) and
+# over HTTP (threaded server plus a load generator), and compares throughput
+# and p50/p99 latency with the JSON baseline committed beside this file. The
+# load generator is a pool of client threads in this one process, so at high
+# --workers counts it can be the bottleneck rather than the server; point
+# --url at a separate server to keep the two apart.
+#
+#   cd eisenhower_app
+#   python -m benchmarks.run --users 1000 --tasks-per-user 100 --update   # record
+#   python -m benchmarks.run --users 1000 --tasks-per-user 100            # compare
+#
+# DATABASE_URL must point at a scratch database: seeding empties every table.
+# Without it, a throwaway server is started with the optional `pgserver`
+# package (pip install pgserver), which needs no container or system install.
+
+SCENARIOS = [
+    ('tasks', '/tasks'),
+    ('tasks, next page', '/tasks?do_after=infinity.0'),
+    ('checkin', '/checkin'),
+    ('search', '/search?q=plan'),
+    ('report', '/report'),
+    ('report summary', '/report?view=summary'),
+]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def start_database():
+    if os.getenv('DATABASE_URL'):
+        return None
+    try:
+        import pgserver
+    except ImportError:
+        raise click.ClickException('Set DATABASE_URL to a scratch database or pip install pgserver')
+    server = pgserver.get_server(os.path.join(os.path.dirname(__file__), '.pgdata'))
+    os.environ['DATABASE_URL'] = server.get_uri()
+    return server
+
+
+def login(client, users, rng):
+    from benchmarks.seed import PASSWORD, user_id
+    response = client.post('/login', data={'user_id': user_id(rng.randrange(users)), 'password': PASSWORD})
+    assert response.status_code in (200, 302), response.status_code
+
+
+def run_in_process(app, path, requests, users, rng):
+    client = app.test_client()
+    login(client, users, rng)
+    client.get(path)  # warm up caches and connections
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = client.get(path)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 200, (path, response.status_code)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_http(base_url, path, requests, workers, users, seed):
+    import requests as http
+    from benchmarks.seed import PASSWORD, user_id
+
+    latencies = []
+    lock = threading.Lock()
+    # Logging in hashes a password, so the clock starts once every worker
+    # (and this thread) is past it
+    ready = threading.Barrier(workers + 1)
+
+    def worker(index):
+        # Each worker is a different user, as concurrent traffic would be
+        rng = random.Random(seed + index)
+        session = http.Session()
+        try:
+            response = session.post(base_url + '/login', data={'user_id': user_id(rng.randrange(users)), 'password': PASSWORD},
+                                    allow_redirects=False)
+            # A failed login redirects back to /login
+            assert response.headers.get('Location', '').endswith('/tasks'), ('/login', response.status_code)
+            session.get(base_url + path)
+        except BaseException:
+            ready.abort()
+            raise
+        ready.wait()
+        mine = []
+        for _ in range(requests // workers):
+            request_started = time.perf_counter()
+            response = session.get(base_url + path)
+            mine.append(time.perf_counter() - request_started)
+            assert response.status_code == 200, (path, response.status_code)
+        with lock:
+            latencies.extend(mine)
+
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(worker, index) for index in range(workers)]
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            pass  # a worker failed to log in; its exception is raised below
+        started = time.perf_counter()
+        for future in futures:
+            future.result()
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def serve(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def compare(results, baseline, tolerance):
+    # Returns human-readable regressions
+    regressions = []
+    for name, modes in results['scenarios'].items():
+        for mode, current in modes.items():
+            previous = baseline.get('scenarios', {}).get(name, {}).get(mode)
+            if not previous:
+                continue
+            if current['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+                regressions.append('%s (%s): p99 %.1f ms, baseline %.1f ms'
+                                   % (name, mode, current['p99_ms'], previous['p99_ms']))
+            if current['throughput'] < previous['throughput'] * (1 - tolerance):
+                regressions.append('%s (%s): %.1f req/s, baseline %.1f req/s'
+                                   % (name, mode, current['throughput'], previous['throughput']))
+    return regressions
+
+
+@click.command()
+@click.option('--users', default=100, show_default=True, help='Synthetic users to seed.')
+@click.option('--tasks-per-user', default=100, show_default=True, help='Tasks per user (users x tasks = table size).')
+@click.option('--requests', 'request_count', default=200, show_default=True, help='Requests per scenario and mode.')
+@click.option('--workers', default=8, show_default=True, help='Concurrent HTTP client threads.')
+@click.option('--url', default=None, help='Load-test this server (e.g. gunicorn) instead of an in-process one.')
+@click.option('--skip-seed', is_flag=True, help='Reuse data from an earlier run with the same scale.')
+@click.option('--baseline', 'baseline_path', default=DEFAULT_BASELINE, show_default=True, type=click.Path(dir_okay=False))
+@click.option('--update', is_flag=True, help='Write the results as the new baseline instead of comparing.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed slowdown before a scenario fails.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed for data and users.')
+def main(users, tasks_per_user, request_count, workers, url, skip_seed, baseline_path, update, tolerance, random_seed):
+    """Benchmark the main pages and fail on regressions against a baseline."""
+    database = start_database()
+    from app import create_app, create_recurring_tasks
+    from benchmarks.seed import seed
+    from db import get_db_connection
+
+    app = create_app()
+    rng = random.Random(random_seed)
+    if not skip_seed:
+        click.echo('Seeding %d users x %d tasks...' % (users, tasks_per_user))
+        started = time.perf_counter()
+        conn = get_db_connection()
+        try:
+            seed(conn, users, tasks_per_user, seed=random_seed)
+        finally:
+            conn.close()
+        click.echo('  %.1f s' % (time.perf_counter() - started))
+
+    results = {
+        'scale': {'users': users, 'tasks_per_user': tasks_per_user},
+        'machine': {'python': platform.python_version(), 'platform': platform.platform()},
+        'scenarios': {},
+    }
+    server = serve(app) if url is None else None
+    base_url = url or 'http://127.0.0.1:%d' % server.server_port
+    try:
+        for name, path in SCENARIOS:
+            results['scenarios'][name] = {
+                'in_process': run_in_process(app, path, request_count, users, rng),
+                'http': run_http(base_url, path, request_count, workers, users, random_seed),
+            }
+            for mode, result in results['scenarios'][name].items():
+                click.echo('%-18s %-10s %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms'
+                           % (name, mode, result['throughput'], result['p50_ms'], result['p99_ms']))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    # Last, since it changes the data: one daily rollover over the seeded backlog
+    started = time.perf_counter()
+    with app.app_context():
+        create_recurring_tasks()
+    results['scenarios']['create_recurring_tasks'] = {'job': summarize([time.perf_counter() - started], None)}
+    click.echo('%-18s %-10s %31.1f ms' % ('recurring rollover', 'job', results['scenarios']['create_recurring_tasks']['job']['p50_ms']))
+
+    if database is not None:
+        database.cleanup()
+
+    if update:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        click.echo('Baseline written to %s' % baseline_path)
+        return
+    if not os.path.exists(baseline_path):
+        raise click.ClickException('No baseline at %s; record one with --update' % baseline_path)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != results['scale']:
+        raise click.ClickException('Baseline was recorded at %s; rerun with that scale or --update' % baseline.get('scale'))
+    regressions = compare(results, baseline, tolerance)
+    for regression in regressions:
+        click.echo('REGRESSION ' + regression, err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo('No regressions beyond %d%%.' % (tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import random
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from board import QUADRANTS
+from migrations import reset_data
+from models import Frequency
+from transfer import CopySource
+
+
+# Synthetic users and tasks, loaded with COPY so 10M rows take minutes rather
+# than hours. Every user shares one password; hashing it per user would
+# dominate seeding time.
+
+PASSWORD = 'bench-password'
+WORDS = ('plan', 'review', 'report', 'call', 'email', 'write', 'fix', 'budget', 'meeting', 'draft',
+         'team', 'client', 'invoice', 'design', 'deploy', 'quarterly', 'weekly', 'doctor', 'garden', 'taxes')
+FREQUENCIES = (Frequency.NONE,) * 17 + (Frequency.DAILY, Frequency.WEEKLY, Frequency.MONTHLY)
+
+USERS_COPY = 'COPY users (id, name, password) FROM STDIN WITH (FORMAT csv)'
+TASKS_COPY = '''COPY tasks (user_id, title, urgency, importance, due_date, impact, frequency, completed,
+    completed_at, created_at) FROM STDIN WITH (FORMAT csv)'''
+
+
+def user_id(n):
+    return 'bench-%d' % n
+
+
+def task_rows(users, tasks_per_user, today, rng):
+    quadrants = [(urgency, importance) for _, urgency, importance, _, _ in QUADRANTS]
+    now = datetime.combine(today, datetime.min.time())
+    for n in range(users):
+        owner = user_id(n)
+        for _ in range(tasks_per_user):
+            created_at = now - timedelta(seconds=rng.randrange(365 * 86400))
+            completed = rng.random() < 0.4
+            completed_at = created_at + timedelta(seconds=rng.randrange(14 * 86400)) if completed else None
+            if completed_at and completed_at > now:
+                completed_at = now
+            due_date = today + timedelta(days=rng.randrange(-60, 60)) if rng.random() < 0.8 else None
+            urgency, importance = rng.choice(quadrants)
+            yield (owner, ' '.join(rng.sample(WORDS, 3)), urgency, importance, due_date, rng.randint(1, 10),
+                   rng.choice(FREQUENCIES), 't' if completed else 'f', completed_at, created_at)
+
+
+def seed(conn, users=100, tasks_per_user=100, today=None, seed=0):
+    # Replaces all data with `users` users owning `tasks_per_user` tasks each
+    today = today or date.today()
+    rng = random.Random(seed)
+    reset_data(conn)
+    password = generate_password_hash(PASSWORD)
+    cur = conn.cursor()
+    cur.copy_expert(USERS_COPY, CopySource((user_id(n), 'Bench user %d' % n, password) for n in range(users)))
+    cur.copy_expert(TASKS_COPY, CopySource(task_rows(users, tasks_per_user, today, rng)))
+    conn.commit()
+    # Fresh statistics, so plans match what a long-running database would use
+    conn.autocommit = True
+    cur.execute('ANALYZE')
+    conn.autocommit = False
+    cur.close()
@@ -0,0 +1,226 @@
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import click
+
+from benchmarks.run import percentile, start_database
+
+
+# Compares the two serving modes (SERVER_MODE=wsgi with sync workers and
+# SERVER_MODE=asgi, see gunicorn.conf.py) with the same number of gunicorn
+# workers, and reports each server's resident memory beside its numbers so the
+# comparison is at equal memory. Clients poll the JSON task list for
+# --duration seconds, first on their own and then while --streams pages hold
+# /events open, which is where a sync worker per connection runs out.
+#
+#   cd eisenhower_app
+#   python -m benchmarks.serving --users 1000 --tasks-per-user 100 --workers 2 --streams 50
+#
+# As with benchmarks.run, DATABASE_URL must point at a scratch database (or
+# pgserver is used). Memory is read from /proc, so this runs on Linux only.
+
+MODES = ('wsgi', 'asgi')
+PATH = '/api/tasks?limit=100'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, workers, port):
+    env = dict(os.environ, SERVER_MODE=mode, WEB_WORKER_CLASS='sync', SCHEDULER_MODE='off', EVENT_STREAM='1')
+    # A sync worker finishes the stream it is serving before it exits, so
+    # don't wait long for that at shutdown
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', '127.0.0.1:%d' % port, '--workers', str(workers),
+         '--graceful-timeout', '2', '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise click.ClickException('%s server exited with %s' % (mode, server.returncode))
+            time.sleep(0.2)
+    server.terminate()
+    raise click.ClickException('%s server did not start' % mode)
+
+
+def rss_mb(pid):
+    # Resident memory of a process and its children (the gunicorn workers)
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open('/proc/%d/status' % current) as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            with open('/proc/%d/task/%d/children' % (current, current)) as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+def logged_in_sessions(base_url, count, users, seed):
+    import requests as http
+    from benchmarks.seed import PASSWORD, user_id
+
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(count):
+        session = http.Session()
+        response = session.post(base_url + '/login', data={'user_id': user_id(rng.randrange(users)), 'password': PASSWORD},
+                                allow_redirects=False)
+        # A failed login redirects back to /login
+        assert response.headers.get('Location', '').endswith('/tasks'), ('/login', response.status_code)
+        sessions.append(session)
+    return sessions
+
+
+def open_streams(base_url, sessions, opened):
+    # Each stream is held open (and its worker or coroutine busy) until
+    # closed. With sync workers, once every worker holds one the rest queue
+    # behind them, so this runs in the background and gives up quietly.
+    import requests as http
+
+    for session in sessions:
+        try:
+            response = session.get(base_url + '/events', stream=True, timeout=60)
+        except http.RequestException:
+            return
+        assert response.status_code == 200, ('/events', response.status_code)
+        opened.append(response)
+
+
+def poll(base_url, sessions, duration, timeout):
+    import requests as http
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(session):
+        mine, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + PATH, timeout=timeout)
+                response.content
+                if response.status_code != 200:
+                    raise http.HTTPError(response.status_code)
+            except http.RequestException:
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(session,)) for session in sessions]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run_mode(mode, workers, clients, streams, duration, timeout, users, seed):
+    port = free_port()
+    server = start_server(mode, workers, port)
+    base_url = 'http://127.0.0.1:%d' % port
+    try:
+        # Everyone logs in first: with sync workers, open streams would leave
+        # no worker to log in with
+        sessions = logged_in_sessions(base_url, clients + streams, users, seed)
+        pollers, listeners = sessions[:clients], sessions[clients:]
+        result = {'workers': workers, 'idle_rss_mb': rss_mb(server.pid)}
+        result['polling'] = poll(base_url, pollers, duration, timeout)
+        result['polling']['rss_mb'] = rss_mb(server.pid)
+        if streams:
+            opened = []
+            threading.Thread(target=open_streams, args=(base_url, listeners, opened), daemon=True).start()
+            deadline = time.monotonic() + 5
+            while len(opened) < streams and time.monotonic() < deadline:
+                time.sleep(0.1)
+            try:
+                result['streams_opened'] = len(opened)
+                result['with_streams'] = poll(base_url, pollers, duration, timeout)
+                result['with_streams']['rss_mb'] = rss_mb(server.pid)
+            finally:
+                for response in opened:
+                    response.close()
+        return result
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+@click.command()
+@click.option('--users', default=100, show_default=True, help='Synthetic users to seed.')
+@click.option('--tasks-per-user', default=100, show_default=True, help='Tasks per user.')
+@click.option('--skip-seed', is_flag=True, help='Reuse data from an earlier run with the same scale.')
+@click.option('--workers', default=2, show_default=True, help='Gunicorn worker processes, the same for both modes.')
+@click.option('--clients', default=32, show_default=True, help='Concurrent polling clients.')
+@click.option('--streams', default=50, show_default=True, help='Event streams held open during the second run.')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds each run lasts.')
+@click.option('--timeout', default=5.0, show_default=True, help='Seconds before a request counts as an error.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the results here as JSON.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed for data and users.')
+def main(users, tasks_per_user, skip_seed, workers, clients, streams, duration, timeout, output, random_seed):
+    """Compare throughput and concurrency of the WSGI and ASGI serving modes."""
+    database = start_database()
+    from benchmarks.seed import seed
+    from db import get_db_connection
+
+    if not skip_seed:
+        click.echo('Seeding %d users x %d tasks...' % (users, tasks_per_user))
+        conn = get_db_connection()
+        try:
+            seed(conn, users, tasks_per_user, seed=random_seed)
+        finally:
+            conn.close()
+
+    results = {'scale': {'users': users, 'tasks_per_user': tasks_per_user}, 'modes': {}}
+    try:
+        for mode in MODES:
+            result = run_mode(mode, workers, clients, streams, duration, timeout, users, random_seed)
+            results['modes'][mode] = result
+            for run in ('polling', 'with_streams'):
+                if run in result:
+                    stats = result[run]
+                    click.echo('%-5s %-13s %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms  %5d errors  %6.1f MB'
+                               % (mode, run, stats['throughput'], stats['p50_ms'], stats['p99_ms'],
+                                  stats['errors'], stats['rss_mb']))
+            if streams:
+                click.echo('%-5s %d of %d event streams open' % (mode, result['streams_opened'], streams))
+    finally:
+        if database is not None:
+            database.cleanup()
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+
+# Cold-start cost, measured in fresh interpreters: importing app.py (broken
+# down per module with `python -X importtime`), create_app() and the first
+# request, which compiles its templates. Compared with startup_baseline.json
+# like benchmarks.run, failing when a step is more than --tolerance slower:
+#
+#   cd eisenhower_app
+#   python -m benchmarks.startup --update   # record
+#   python -m benchmarks.startup            # compare
+#
+# No database is needed: nothing here connects.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'startup_baseline.json')
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({'SCHEDULER_MODE': 'off'})
+created = time.perf_counter()
+response = application.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+answered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+}))
+'''
+
+
+def parse_importtime(stderr, module='app'):
+    # {imported module: cumulative ms} for the direct imports of module
+    children, found = {}, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == module:
+                found = children
+            children = {}
+    return found
+
+
+def probe():
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=APP_DIR,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+    timings = json.loads(result.stdout)
+    timings['process_ms'] = elapsed * 1000
+    return timings, parse_importtime(result.stderr)
+
+
+def compare(results, baseline, tolerance):
+    # Human-readable regressions of the median of each step
+    regressions = []
+    for step, ms in results['steps'].items():
+        previous = baseline.get('steps', {}).get(step)
+        if previous and ms > previous * (1 + tolerance):
+            regressions.append('%s: %.1f ms, baseline %.1f ms' % (step, ms, previous))
+    return regressions
+
+
+@click.command()
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters to start.')
+@click.option('--top', default=10, show_default=True, help='Heaviest imports of app.py to list.')
+@click.option('--baseline', 'baseline_path', default=DEFAULT_BASELINE, show_default=True, type=click.Path(dir_okay=False))
+@click.option('--update', is_flag=True, help='Write the results as the new baseline instead of comparing.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed slowdown before a step fails.')
+def main(runs, top, baseline_path, update, tolerance):
+    """Measure cold import, app creation and first-request latency."""
+    probe()  # warm the filesystem and bytecode caches
+    samples, imports = [], {}
+    for _ in range(runs):
+        timings, modules = probe()
+        samples.append(timings)
+        for name, ms in modules.items():
+            imports.setdefault(name, []).append(ms)
+
+    steps = {}
+    for step in ('process_ms', 'import_ms', 'create_app_ms', 'first_request_ms'):
+        times = [sample[step] for sample in samples]
+        steps[step] = round(statistics.median(times), 1)
+        click.echo('%-18s median %8.1f ms  max %8.1f ms' % (step, steps[step], max(times)))
+    click.echo('Heaviest imports of app.py (cumulative, median):')
+    heaviest = sorted(((statistics.median(ms), name) for name, ms in imports.items()), reverse=True)[:top]
+    for ms, name in heaviest:
+        click.echo('  %-24s %8.1f ms' % (name, ms))
+
+    results = {
+        'machine': {'python': sys.version.split()[0]},
+        'runs': runs,
+        'steps': steps,
+        'imports': {name: round(ms, 1) for ms, name in heaviest},
+    }
+    if update:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        click.echo('Baseline written to %s' % baseline_path)
+        return
+    if not os.path.exists(baseline_path):
+        raise click.ClickException('No baseline at %s; record one with --update' % baseline_path)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, tolerance)
+    for regression in regressions:
+        click.echo('REGRESSION ' + regression, err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo('No regressions beyond %d%%.' % (tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
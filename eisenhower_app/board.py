@@ -0,0 +1,102 @@
+import re
+from datetime import date
+
+from cursors import InvalidCursor, check_id
+from models import COLUMNS_SQL, Importance, Urgency, row_maker
+
+
+# (key, urgency, importance, heading, border class), in board order
+QUADRANTS = [
+    ('do', Urgency.URGENT, Importance.IMPORTANT, 'Urgent & Important', 'border-danger'),
+    ('plan', Urgency.NOT_URGENT, Importance.IMPORTANT, 'Important, Not Urgent', 'border-success'),
+    ('delegate', Urgency.URGENT, Importance.NOT_IMPORTANT, 'Urgent, Not Important', 'border-warning'),
+    ('eliminate', Urgency.NOT_URGENT, Importance.NOT_IMPORTANT, 'Not Urgent, Not Important', 'border-secondary'),
+]
+
+# Tasks without a due date sort last, as with ORDER BY due_date
+SORT_KEY_SQL = "COALESCE(due_date, 'infinity'::date)"
+
+# One roundtrip for the whole board: per quadrant, the total count and the next
+# page after that quadrant's cursor. Each LATERAL branch is an ordered,
+# limited range scan, so the cost follows the page size, not the history.
+BOARD_SQL = '''
+    SELECT q.key, c.total, t.*
+    FROM (VALUES {values}) AS q(key, urgency, importance, after_due, after_id)
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS total FROM tasks
+        WHERE user_id = %(user_id)s AND urgency = q.urgency AND importance = q.importance{filter}
+    ) c
+    LEFT JOIN LATERAL (
+        SELECT {columns} FROM tasks
+        WHERE user_id = %(user_id)s AND urgency = q.urgency AND importance = q.importance{filter}
+            AND (q.after_id IS NULL OR ({sort_key}, id) > (q.after_due, q.after_id))
+        ORDER BY {sort_key}, id
+        LIMIT %(limit)s
+    ) t ON TRUE
+'''
+
+CURSOR_RE = re.compile(r'^(\d{4}-\d{2}-\d{2}|infinity)\.(\d+)$')
+
+
+def encode_cursor(task):
+    due = task.due_date.isoformat() if task.due_date else 'infinity'
+    return '%s.%d' % (due, task.id)
+
+
+def decode_cursor(value):
+    # Returns (due, id), or (None, None) for the first page; raises
+    # InvalidCursor for a malformed one
+    if not value:
+        return None, None
+    match = CURSOR_RE.match(value)
+    if not match:
+        raise InvalidCursor(value)
+    due = match.group(1)
+    if due != 'infinity':
+        try:
+            date.fromisoformat(due)
+        except ValueError:
+            raise InvalidCursor(value) from None
+    return due, check_id(match.group(2))
+
+
+def board_query(user_id, cursors, hide_completed, page_size):
+    values = []
+    params = {'user_id': user_id, 'limit': page_size + 1}
+    for i, (key, urgency, importance, _, _) in enumerate(QUADRANTS):
+        values.append('(%%(key%d)s, %%(urgency%d)s, %%(importance%d)s, %%(after_due%d)s::date, %%(after_id%d)s::int)' % ((i,) * 5))
+        params['after_due%d' % i], params['after_id%d' % i] = decode_cursor(cursors.get(key))
+        params.update({'key%d' % i: key, 'urgency%d' % i: urgency, 'importance%d' % i: importance})
+    query = BOARD_SQL.format(
+        values=', '.join(values),
+        filter=' AND completed = FALSE' if hide_completed else '',
+        sort_key=SORT_KEY_SQL,
+        columns=COLUMNS_SQL,
+    )
+    return query, params
+
+
+def load_board(cur, user_id, cursors=None, hide_completed=False, page_size=25):
+    # cursors maps quadrant keys to the cursor of the last task already shown.
+    # cur must return tuples (db.TupleCursor): each row is a quadrant's key and
+    # total followed by one of its tasks, or NULLs when it has none.
+    cursors = cursors or {}
+    cur.execute(*board_query(user_id, cursors, hide_completed, page_size))
+
+    board = {}
+    for key, urgency, importance, label, css in QUADRANTS:
+        board[key] = {
+            'key': key, 'urgency': urgency, 'importance': importance, 'label': label, 'css': css,
+            'tasks': [], 'total': 0, 'next_cursor': None, 'paged': bool(cursors.get(key)),
+        }
+    make = row_maker(tuple(column.name for column in cur.description[2:]))
+    for key, total, *values in cur.fetchall():
+        quadrant = board[key]
+        quadrant['total'] = total
+        if values[0] is not None:
+            quadrant['tasks'].append(make(values))
+    for quadrant in board.values():
+        if len(quadrant['tasks']) > page_size:
+            del quadrant['tasks'][page_size:]
+            quadrant['next_cursor'] = encode_cursor(quadrant['tasks'][-1])
+    return [board[key] for key, *_ in QUADRANTS]
@@ -0,0 +1,132 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+# Returned by get() when nothing is cached, since None is a valid cached value
+MISSING = object()
+
+
+class TTLCache:
+    # Per-process LRU cache whose entries also expire after ttl seconds. With
+    # maxbytes, values must support len() (e.g. rendered strings) and the
+    # total length is bounded as well as the entry count.
+    def __init__(self, maxsize=1024, ttl=300.0, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _weight(self, value):
+        return len(value) if self.maxbytes else 0
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._weight(entry[1])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += self._weight(value)
+            while len(self._data) > self.maxsize or (self.maxbytes and self._bytes > self.maxbytes and len(self._data) > 1):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "local",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes if self.maxbytes else None,
+                "maxbytes": self.maxbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class RedisCache:
+    # Shared by every worker that points at the same Redis, which must be a
+    # trusted, private instance since values are pickled. Redis' maxmemory
+    # policy bounds the size.
+    def __init__(self, url, prefix, ttl=300.0):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return "%s:%s" % (self.prefix, key)
+
+    def get(self, key):
+        raw = self._client.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        self._client.setex(self._key(key), max(int(self.ttl), 1), pickle.dumps(value))
+
+    def delete(self, key):
+        self._client.delete(self._key(key))
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self._key("*")))
+        if keys:
+            self._client.delete(*keys)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def cache_from_env(name, maxsize=1024, ttl=300.0, maxbytes=None):
+    # <NAME>_SIZE, <NAME>_TTL and <NAME>_BYTES tune the cache; CACHE_URL=redis://...
+    # shares it between workers instead of keeping one copy per process.
+    maxsize = int(os.getenv(name + "_SIZE", maxsize))
+    ttl = float(os.getenv(name + "_TTL", ttl))
+    maxbytes = os.getenv(name + "_BYTES", maxbytes)
+    url = os.getenv("CACHE_URL")
+    if url:
+        return RedisCache(url, prefix=name.lower(), ttl=ttl)
+    return TTLCache(maxsize=maxsize, ttl=ttl, maxbytes=int(maxbytes) if maxbytes else None)
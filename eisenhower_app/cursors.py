@@ -0,0 +1,15 @@
+# Page cursors arrive in URLs, so they are checked before they reach SQL: a
+# value that doesn't parse, or an id past the int4 columns it is compared
+# with, is refused as malformed (400) instead of failing in the database.
+MAX_INT = 2 ** 31 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def check_id(value):
+    value = int(value)
+    if not 0 <= value <= MAX_INT:
+        raise InvalidCursor('id out of range')
+    return value
@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import cache
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+
+from models import row_maker
+
+
+# Called with (statement, seconds) after every statement once anything is
+# registered (see metrics.py); with no listeners cursors are not timed.
+query_listeners = []
+
+
+def _statement(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return ' '.join(str(query).split())
+
+
+class Timed:
+    # Statements are reported as their SQL text before parameters are bound,
+    # so one query run for different ids counts as the same statement
+    def _timed(self, method, query, *args):
+        if not query_listeners:
+            return method(query, *args)
+        started = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in query_listeners:
+                listener(_statement(query), elapsed)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+
+class TimedCursor(Timed, RealDictCursor):
+    # The default: rows as dicts
+    pass
+
+
+class TupleCursor(Timed, extensions.cursor):
+    pass
+
+
+class TaskCursor(TupleCursor):
+    # Rows of task columns as models.Task, for conn.cursor(cursor_factory=TaskCursor)
+    def _maker(self):
+        return row_maker(tuple(column.name for column in self.description))
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._maker()(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def __iter__(self):
+        # super().__iter__() is the cursor itself, so step it with next(); a
+        # named cursor only has a description once the first batch arrives
+        rows = super().__iter__()
+        try:
+            first = next(rows)
+        except StopIteration:
+            return
+        make = self._maker()
+        yield make(first)
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            yield make(row)
+
+
+# Reads .env into the environment, once and only when something connects
+load_env = cache(load_dotenv)
+
+
+def connection_args():
+    # (conninfo, keywords) from DATABASE_URL or the DB_* settings; psycopg2 and
+    # psycopg 3 (asgi.py) both connect with them and ignore unset keywords
+    load_env()
+    if 'DATABASE_URL' in os.environ:
+        return os.environ['DATABASE_URL'], {}
+    return '', {
+        'dbname': os.getenv("DB_NAME"),
+        'user': os.getenv("DB_USER"),
+        'password': os.getenv("DB_PASSWORD"),
+        'host': os.getenv("DB_HOST"),
+        'port': os.getenv("DB_PORT", "5432"),
+    }
+
+
+# Database connection
+def get_db_connection():
+    conninfo, params = connection_args()
+    return psycopg2.connect(conninfo, cursor_factory=TimedCursor, **params)
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    # A blocking, thread-safe pool that belongs to a single process. Connections
+    # inherited through fork() are never reused by the child: gunicorn workers
+    # each build their own set on first checkout.
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0, max_idle=300.0, check_interval=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (minconn, maxconn))
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []  # (conn, returned_at), most recently used last
+        self._in_use = set()
+        self._orphans = []
+        self._metrics = dict.fromkeys((
+            'checkouts', 'wait_seconds', 'max_wait_seconds', 'exhausted', 'timeouts',
+            'opened', 'closed', 'recycled', 'failed_checks'
+        ), 0)
+
+    def _check_process(self):
+        if self._pid == os.getpid():
+            return
+        # Forked: the parent still owns these sockets, so keep references
+        # (closing them here would terminate the parent's sessions).
+        orphans = [conn for conn, _ in self._idle] + list(self._in_use)
+        self._reset()
+        self._orphans = orphans
+
+    def _open(self):
+        conn = self._connect()
+        self._metrics['opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._metrics['closed'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _recycle_idle(self, now):
+        # Drop connections that sat unused for too long, but keep minconn around.
+        keep = []
+        size = len(self._in_use) + len(self._idle)
+        for conn, returned_at in self._idle:
+            if now - returned_at > self.max_idle and size > self.minconn:
+                self._metrics['recycled'] += 1
+                self._discard(conn)
+                size -= 1
+            else:
+                keep.append((conn, returned_at))
+        self._idle = keep
+
+    def getconn(self):
+        with self._cond:
+            self._check_process()
+            started = time.monotonic()
+            waited = False
+            while True:
+                self._recycle_idle(time.time())
+                while self._idle:
+                    conn, returned_at = self._idle.pop()
+                    if self._healthy(conn, time.time() - returned_at):
+                        return self._checked_out(conn, started, waited)
+                    self._metrics['failed_checks'] += 1
+                    self._discard(conn)
+                if len(self._in_use) < self.maxconn:
+                    # Reserve the slot before releasing the lock to connect.
+                    placeholder = object()
+                    self._in_use.add(placeholder)
+                    break
+                if not waited:
+                    waited = True
+                    self._metrics['exhausted'] += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout("No database connection available after %.1fs" % self.timeout)
+                self._cond.wait(remaining)
+        try:
+            conn = self._open()
+        except Exception:
+            with self._cond:
+                self._in_use.discard(placeholder)
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._in_use.discard(placeholder)
+            return self._checked_out(conn, started, waited)
+
+    def _checked_out(self, conn, started, waited):
+        self._in_use.add(conn)
+        self._metrics['checkouts'] += 1
+        if waited:
+            wait = time.monotonic() - started
+            self._metrics['wait_seconds'] += wait
+            self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], wait)
+        return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            if conn not in self._in_use:
+                # Checked out before a fork, or returned twice.
+                return
+            self._in_use.discard(conn)
+            if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            if conn.closed or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._check_process()
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            self._check_process()
+            stats = dict(self._metrics)
+            stats.update(
+                pid=self._pid,
+                size=len(self._idle) + len(self._in_use),
+                idle=len(self._idle),
+                in_use=len(self._in_use),
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
+            return stats
+
+
+def pool_from_env():
+    return ConnectionPool(
+        get_db_connection,
+        minconn=int(os.getenv("DB_POOL_MIN", "1")),
+        maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", "30")),
+    )
+
+
+# Built on first use, with sizes that may come from .env; connections are
+# opened lazily too, so importing this module touches nothing
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                load_env()
+                _pool = pool_from_env()
+    return _pool
+
+
+def db_connection():
+    return get_pool().connection()
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+
+from db import get_db_connection
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'task_events'
+
+
+def notify_task_event(cur, user_id, event, task_id):
+    # Delivered to listeners when the surrounding transaction commits, and
+    # dropped if it rolls back.
+    payload = json.dumps({'user_id': user_id, 'event': event, 'task_id': task_id})
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, payload))
+
+
+def notify_task_events(cur, user_id, event, task_ids):
+    # notify_task_event for many tasks in one round trip
+    if not task_ids:
+        return
+    cur.execute(
+        "SELECT pg_notify(%s, json_build_object('user_id', %s::text, 'event', %s::text, 'task_id', id)::text) "
+        "FROM unnest(%s::int[]) AS id",
+        (CHANNEL, user_id, event, list(task_ids))
+    )
+
+
+class EventBroker:
+    # One LISTEN connection per process fans notifications out to the queues of
+    # that user's open streams. Under gevent the listener and every stream are
+    # greenlets, so idle streams cost a queue each rather than a worker.
+    def __init__(self, connect=get_db_connection, channel=CHANNEL, max_queue=100, poll_interval=5.0):
+        self._connect = connect
+        self.channel = channel
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._subscribers = {}
+        self._listening = threading.Event()
+
+    def subscribe(self, user_id):
+        events = queue.Queue(self.max_queue)
+        with self._lock:
+            if self._pid != os.getpid():
+                # First use in this process (or after a fork): start our own listener
+                self._pid = os.getpid()
+                self._subscribers = {}
+                self._listening = threading.Event()
+                threading.Thread(target=self._listen, args=(self._listening,), name='event-listener', daemon=True).start()
+            self._subscribers.setdefault(user_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            streams = self._subscribers.get(user_id, set())
+            streams.discard(events)
+            if not streams:
+                self._subscribers.pop(user_id, None)
+
+    def wait_until_listening(self, timeout=None):
+        return self._listening.wait(timeout)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(streams) for streams in self._subscribers.values())
+
+    def publish(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        with self._lock:
+            streams = list(self._subscribers.get(message.get('user_id'), ()))
+        for events in streams:
+            try:
+                events.put_nowait(message)
+            except queue.Full:
+                # A stalled client only loses events; it refetches on reconnect anyway
+                pass
+
+    def _listen(self, listening):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute('LISTEN %s' % self.channel)
+                cur.close()
+                listening.set()
+                while True:
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.publish(conn.notifies.pop(0).payload)
+            except Exception as e:
+                # Whatever broke, this thread is the process's only listener:
+                # reconnect rather than let every stream go quiet
+                if not isinstance(e, psycopg2.Error):
+                    logger.exception('Event listener failed; reconnecting')
+                listening.clear()
+                time.sleep(1)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+broker = EventBroker()
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from cache import MISSING
+
+
+class FragmentCache:
+    # Rendered HTML fragments in front of any cache from cache.py. Keys embed
+    # the user's data version, so writes (which bump it) invalidate without
+    # the write routes doing anything and stale entries simply age out.
+    # Render times of misses are recorded to estimate what hits save.
+    def __init__(self, cache):
+        self.cache = cache
+        self.renders = 0
+        self.render_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def render(self, key, render):
+        started = time.perf_counter()
+        fragment = render()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.renders += 1
+            self.render_seconds += elapsed
+        self.cache.set(key, fragment)
+        return fragment
+
+    def get_or_render(self, key, render):
+        fragment = self.get(key)
+        if fragment is MISSING:
+            fragment = self.render(key, render)
+        return fragment
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            average = self.render_seconds / self.renders if self.renders else 0.0
+            stats.update({
+                "renders": self.renders,
+                "render_seconds": self.render_seconds,
+                "average_render_ms": average * 1000,
+                # Each hit skipped a render of about the average cost
+                "saved_seconds": stats["hits"] * average,
+            })
+        return stats
+
+
+def quadrant_key(user_id, key, version, today, page_size, query_string):
+    # The query string carries hide_completed and every quadrant's cursor,
+    # which all appear in the panel (its own page, and its paging links)
+    return '%s:%s:%s:%s:%s:%s' % (user_id, key, version, today.isoformat(), page_size, query_string)
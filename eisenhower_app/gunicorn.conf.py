@@ -0,0 +1,58 @@
+# Picked up automatically by `gunicorn` when run from this directory
+import os
+
+# SERVER_MODE=asgi serves asgi.py from uvicorn workers: the JSON task list,
+# /api/sync and /events run on an event loop with psycopg 3's async pool, and
+# the other pages in a thread pool. The default, wsgi, is the Flask app on
+# WEB_WORKER_CLASS workers. An app given on the command line overrides this.
+server_mode = os.getenv("SERVER_MODE", "wsgi")
+if server_mode not in ("wsgi", "asgi"):
+    raise RuntimeError("SERVER_MODE must be wsgi or asgi, not %r" % server_mode)
+wsgi_app = "asgi:application" if server_mode == "asgi" else "app:create_app()"
+
+
+def on_starting(server):
+    # Runs once in the master before any worker imports the app. Replicas
+    # starting together are serialised by the migration advisory lock.
+    if os.getenv("MIGRATE_ON_START", "1") != "1":
+        return
+    from repository import repository_from_env
+
+    applied = repository_from_env().migrate()
+    if applied:
+        server.log.info("Applied migrations: %s", ", ".join(map(str, applied)))
+
+
+# /events streams hold a connection open for as long as the page is; with the
+# default sync workers each one pins a whole worker. WEB_WORKER_CLASS=gevent
+# serves them as greenlets instead (pip install gevent psycogreen); with
+# SERVER_MODE=asgi they are coroutines.
+worker_class = "uvicorn_worker.UvicornWorker" if server_mode == "asgi" else os.getenv("WEB_WORKER_CLASS", "sync")
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "1000"))
+
+
+def post_worker_init(worker):
+    # Workers are where scheduled jobs run (see SCHEDULER_MODE). With
+    # RUN_JOBS=0 they only serve requests, and `flask --app app jobs run`
+    # runs the jobs in a process of its own.
+    if os.getenv("RUN_JOBS", "1") != "1":
+        return
+    from app import start_scheduler
+
+    if server_mode == "asgi":
+        from asgi import app
+    else:
+        app = worker.wsgi
+    start_scheduler(app)
+
+
+def post_fork(server, worker):
+    if worker_class != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed; database calls will block the gevent worker")
+        return
+    # Makes psycopg2 yield to other greenlets while waiting on the server
+    patch_psycopg()
@@ -0,0 +1,144 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+import metrics
+from db import db_connection
+
+
+# Scheduled jobs shared by every worker and replica. Each process polls the
+# job_runs table; a due job is leased by exactly one of them with
+# FOR UPDATE SKIP LOCKED, so pollers never wait on each other. The schedule
+# lives in the table, so after a restart or an outage a job that missed its
+# time runs once as soon as anyone polls (missed runs are coalesced, not
+# replayed). A lease that outlives its holder (a killed process) expires and
+# the job is picked up again.
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = '''
+    INSERT INTO job_runs (name, interval_seconds, next_run_at) VALUES (%(name)s, %(interval)s, now())
+    ON CONFLICT (name) DO UPDATE SET interval_seconds = EXCLUDED.interval_seconds
+'''
+
+CLAIM_SQL = '''
+    UPDATE job_runs
+    SET lease_owner = %(owner)s, lease_expires_at = now() + make_interval(secs => %(lease)s), last_started_at = now()
+    WHERE name IN (
+        SELECT name FROM job_runs
+        WHERE name = ANY(%(names)s) AND next_run_at <= now()
+            AND (lease_expires_at IS NULL OR lease_expires_at < now())
+        ORDER BY next_run_at
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING name, next_run_at, now() AS started_at
+'''
+
+# Only the lease holder may finish a run, so a run that overran its lease
+# can't overwrite the bookkeeping of the process that took over
+FINISH_SQL = '''
+    UPDATE job_runs
+    SET lease_owner = NULL, lease_expires_at = NULL, last_finished_at = now(), next_run_at = %(next_run_at)s,
+        last_duration_seconds = %(duration)s, last_error = %(error)s,
+        runs = runs + 1, failures = failures + %(failed)s
+    WHERE name = %(name)s AND lease_owner = %(owner)s
+'''
+
+STATUS_SQL = '''
+    SELECT name, interval_seconds, next_run_at, last_started_at, last_finished_at, last_duration_seconds,
+        last_error, runs, failures, lease_owner, lease_expires_at
+    FROM job_runs ORDER BY name
+'''
+
+
+def next_run(scheduled, now, interval):
+    # The first slot on the job's cadence after now
+    missed = int((now - scheduled).total_seconds() // interval) + 1
+    return scheduled + timedelta(seconds=interval * max(missed, 1))
+
+
+class JobRunner:
+    def __init__(self, connection=db_connection, owner=None, lease_seconds=3600, retry_seconds=300):
+        self._connection = connection
+        self._owner = owner
+        self.lease_seconds = lease_seconds
+        self.retry_seconds = retry_seconds
+        # name -> (interval seconds, function)
+        self.jobs = {}
+        self._synced = False
+
+    @property
+    def owner(self):
+        # Read per call, since gunicorn may fork workers after this was built
+        return self._owner or '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def job(self, name, seconds):
+        # Decorator registering a job every `seconds`; the function is returned unchanged
+        def decorator(func):
+            self.jobs[name] = (seconds, func)
+            self._synced = False
+            return func
+        return decorator
+
+    def _sync(self, cur):
+        for name, (interval, _) in self.jobs.items():
+            cur.execute(UPSERT_SQL, {'name': name, 'interval': interval})
+
+    def run_due(self):
+        # Runs every registered job that is due and not leased elsewhere;
+        # returns the names run by this process
+        if not self.jobs:
+            return []
+        with self._connection() as conn:
+            cur = conn.cursor()
+            if not self._synced:
+                self._sync(cur)
+                conn.commit()
+                self._synced = True
+            cur.execute(CLAIM_SQL, {'owner': self.owner, 'lease': self.lease_seconds, 'names': list(self.jobs)})
+            claimed = cur.fetchall()
+            conn.commit()
+            cur.close()
+        for row in claimed:
+            self._run(row)
+        return [row['name'] for row in claimed]
+
+    def _run(self, row):
+        name = row['name']
+        interval, func = self.jobs[name]
+        metrics.JOB_DELAY.observe(max((row['started_at'] - row['next_run_at']).total_seconds(), 0.0), name)
+        started = time.perf_counter()
+        error = None
+        try:
+            func()
+        except Exception:
+            error = traceback.format_exc(limit=5)
+            logger.exception('Job %s failed', name)
+        duration = time.perf_counter() - started
+        now = datetime.now(timezone.utc)
+        if error is None:
+            metrics.JOB_LAST_SUCCESS.set(now.timestamp(), name)
+            next_run_at = next_run(row['next_run_at'], now, interval)
+        else:
+            # Failed runs are retried sooner than the next regular slot
+            next_run_at = now + timedelta(seconds=min(interval, self.retry_seconds))
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(FINISH_SQL, {
+                'name': name, 'owner': self.owner, 'next_run_at': next_run_at, 'duration': duration,
+                'error': error, 'failed': int(error is not None),
+            })
+            conn.commit()
+            cur.close()
+
+    def status(self):
+        # The persistent job store, as every process sees it
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(STATUS_SQL)
+            rows = cur.fetchall()
+            cur.close()
+        return rows
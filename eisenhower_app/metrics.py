@@ -0,0 +1,210 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+
+from db import query_listeners
+
+
+# Opt-in instrumentation (METRICS_ENABLED=1): statements timed by
+# db.TimedCursor are counted per request, responses get a Server-Timing
+# header, and counters are served in the Prometheus text format from /metrics.
+# Metrics are per process; under gunicorn each worker reports its own.
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+# The same statement this many times in one request is probably a loop of
+# single-row queries that one set-based query could replace
+N_PLUS_ONE_THRESHOLD = 5
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append('%s%s %s' % (self.name, _labels(self.labels, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def count(self, *labels):
+        counts = self._values.get(labels)
+        return sum(counts[0]) if counts else 0
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (self.name, _labels(self.labels + ('le',), labels + (bound,)), cumulative))
+                lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, labels), total))
+                lines.append('%s_count%s %d' % (self.name, _labels(self.labels, labels), cumulative))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s gauge' % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append('%s%s %s' % (self.name, _labels(self.labels, labels), value))
+        return lines
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route.', ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'Requests by route and status.', ('endpoint', 'method', 'status'))
+QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Time spent in each database statement.')
+REQUEST_QUERIES = Histogram('db_queries_per_request', 'Statements executed per request.', ('endpoint',), COUNT_BUCKETS)
+N_PLUS_ONE = Counter('db_n_plus_one_total', 'Requests repeating one statement at least %d times.' % N_PLUS_ONE_THRESHOLD,
+                     ('endpoint',))
+JOB_SECONDS = Histogram('job_duration_seconds', 'Scheduled job run time.', ('job',), DEFAULT_BUCKETS + (30.0, 60.0, 300.0))
+JOB_FAILURES = Counter('job_failures_total', 'Scheduled job runs that raised.', ('job',))
+JOB_DELAY = Histogram('job_start_delay_seconds', 'How long after its scheduled time a leased job started.', ('job',),
+                      DEFAULT_BUCKETS + (30.0, 60.0, 300.0, 3600.0, 86400.0))
+JOB_LAST_SUCCESS = Gauge('job_last_success_timestamp_seconds', 'When this process last completed the job.', ('job',))
+REGISTRY = [REQUEST_SECONDS, REQUESTS, QUERY_SECONDS, REQUEST_QUERIES, N_PLUS_ONE, JOB_SECONDS, JOB_FAILURES,
+            JOB_DELAY, JOB_LAST_SUCCESS]
+
+
+class QueryStats:
+    # Statements run while handling one request
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = (0.0, None)
+        self.statements = {}
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+
+def record_query(statement, seconds):
+    QUERY_SECONDS.observe(seconds)
+    if has_request_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.record(statement, seconds)
+
+
+def init_app(app, logger=None):
+    logger = logger or app.logger
+
+    @app.before_request
+    def start_timer():
+        if app.config['METRICS_ENABLED']:
+            if record_query not in query_listeners:
+                query_listeners.append(record_query)
+            g.request_started = time.perf_counter()
+            g.query_stats = QueryStats()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        stats = g.query_stats
+        REQUEST_SECONDS.observe(elapsed, endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, response.status_code)
+        REQUEST_QUERIES.observe(stats.count, endpoint)
+        # Streamed bodies (reports, exports, events) are still being produced,
+        # so their timings only cover the work done before the first byte
+        response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"' % (stats.seconds * 1000, stats.count))
+        if stats.slowest[1]:
+            response.headers.add('Server-Timing', 'db-slowest;dur=%.1f' % (stats.slowest[0] * 1000))
+        response.headers.add('Server-Timing', 'app;dur=%.1f' % (elapsed * 1000))
+        repeated = stats.repeated()
+        if repeated:
+            N_PLUS_ONE.inc(endpoint)
+            for statement, count in repeated.items():
+                logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, statement[:200])
+        return response
+
+
+def timed_job(name):
+    # Records a scheduled job's duration and failures
+    def decorator(job):
+        @functools.wraps(job)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return job(*args, **kwargs)
+            except Exception:
+                JOB_FAILURES.inc(name)
+                raise
+            finally:
+                JOB_SECONDS.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,604 @@
+import json
+from datetime import date, datetime
+
+import click
+
+from db import get_db_connection
+
+
+# Serialises migration runs across workers, replicas and release jobs
+MIGRATION_LOCK_ID = 724_253_001
+
+# Ordered schema versions: (version, description, upgrade statements, downgrade statements).
+# Never edit a released step; add a new one instead.
+MIGRATIONS = [
+    (1, 'create users and tasks', [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            password TEXT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            urgency TEXT NOT NULL,
+            importance TEXT NOT NULL,
+            due_date DATE,
+            impact INTEGER DEFAULT 5,
+            frequency TEXT DEFAULT 'none',
+            completed BOOLEAN DEFAULT FALSE,
+            user_id TEXT NOT NULL REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ], [
+        'DROP TABLE IF EXISTS tasks',
+        'DROP TABLE IF EXISTS users',
+    ]),
+    (2, 'track recurring task rollover', [
+        # Databases created by app.py before migrations existed may already have it
+        '''DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_name = 'tasks' AND column_name = 'rolled_over') THEN
+                ALTER TABLE tasks ADD COLUMN rolled_over BOOLEAN NOT NULL DEFAULT FALSE;
+                -- Completed recurring tasks from before this column were already duplicated
+                UPDATE tasks SET rolled_over = TRUE WHERE completed = TRUE AND frequency <> 'none';
+            END IF;
+        END $$''',
+    ], [
+        'ALTER TABLE tasks DROP COLUMN IF EXISTS rolled_over',
+    ]),
+    (3, 'create subscriptions', [
+        '''CREATE TABLE IF NOT EXISTS subscriptions (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            subscription TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS subscriptions_user_idx ON subscriptions (user_id)',
+    ], [
+        'DROP TABLE IF EXISTS subscriptions',
+    ]),
+    (4, 'index tasks for route queries', [
+        # /checkin overdue and upcoming, open-task suggestions
+        'CREATE INDEX IF NOT EXISTS tasks_user_completed_due_idx ON tasks (user_id, completed, due_date)',
+        # /report and completed-this-week on /checkin
+        'CREATE INDEX IF NOT EXISTS tasks_user_completed_created_idx ON tasks (user_id, completed, created_at)',
+        # /tasks board pages, in the board's sort order
+        '''CREATE INDEX IF NOT EXISTS tasks_user_quadrant_idx
+            ON tasks (user_id, urgency, importance, (COALESCE(due_date, 'infinity'::date)), id)''',
+        # Recurring rollover only ever looks at the small set of pending rows
+        '''CREATE INDEX IF NOT EXISTS tasks_recurring_pending_idx ON tasks (user_id, frequency)
+            WHERE frequency <> 'none' AND completed = TRUE AND rolled_over = FALSE''',
+    ], [
+        'DROP INDEX IF EXISTS tasks_recurring_pending_idx',
+        'DROP INDEX IF EXISTS tasks_user_quadrant_idx',
+        'DROP INDEX IF EXISTS tasks_user_completed_created_idx',
+        'DROP INDEX IF EXISTS tasks_user_completed_due_idx',
+    ]),
+    (5, 'full-text search on task titles', [
+        'ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search_vector tsvector',
+        '''CREATE OR REPLACE FUNCTION tasks_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('simple', COALESCE(NEW.title, ''));
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_search_vector_trigger BEFORE INSERT OR UPDATE OF title ON tasks
+            FOR EACH ROW EXECUTE FUNCTION tasks_search_vector_update()''',
+        "UPDATE tasks SET search_vector = to_tsvector('simple', title)",
+        'CREATE INDEX IF NOT EXISTS tasks_search_idx ON tasks USING GIN (search_vector)',
+    ], [
+        'DROP INDEX IF EXISTS tasks_search_idx',
+        'DROP TRIGGER IF EXISTS tasks_search_vector_trigger ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_search_vector_update()',
+        'ALTER TABLE tasks DROP COLUMN IF EXISTS search_vector',
+    ]),
+    (6, 'per-user data version', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0',
+        # Statement-level, so bulk writes bump each affected user once
+        '''CREATE OR REPLACE FUNCTION tasks_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE users SET data_version = data_version + 1 WHERE id IN (SELECT user_id FROM old_rows);
+            ELSE
+                UPDATE users SET data_version = data_version + 1 WHERE id IN (SELECT user_id FROM new_rows);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_data_version_insert AFTER INSERT ON tasks REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_bump_data_version()''',
+        '''CREATE TRIGGER tasks_data_version_update AFTER UPDATE ON tasks REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_bump_data_version()''',
+        '''CREATE TRIGGER tasks_data_version_delete AFTER DELETE ON tasks REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_bump_data_version()''',
+    ], [
+        'DROP TRIGGER IF EXISTS tasks_data_version_delete ON tasks',
+        'DROP TRIGGER IF EXISTS tasks_data_version_update ON tasks',
+        'DROP TRIGGER IF EXISTS tasks_data_version_insert ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_bump_data_version()',
+        'ALTER TABLE users DROP COLUMN IF EXISTS data_version',
+    ]),
+    (7, 'per-user last change time', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS data_changed_at TIMESTAMPTZ',
+        '''CREATE OR REPLACE FUNCTION tasks_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE users SET data_version = data_version + 1, data_changed_at = now()
+                WHERE id IN (SELECT user_id FROM old_rows);
+            ELSE
+                UPDATE users SET data_version = data_version + 1, data_changed_at = now()
+                WHERE id IN (SELECT user_id FROM new_rows);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql''',
+    ], [
+        '''CREATE OR REPLACE FUNCTION tasks_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE users SET data_version = data_version + 1 WHERE id IN (SELECT user_id FROM old_rows);
+            ELSE
+                UPDATE users SET data_version = data_version + 1 WHERE id IN (SELECT user_id FROM new_rows);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql''',
+        'ALTER TABLE users DROP COLUMN IF EXISTS data_changed_at',
+    ]),
+    (8, 'due-task reminders', [
+        'ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS last_notified_at TIMESTAMPTZ',
+        # The reminder sweep reads open, dated tasks across all users
+        'CREATE INDEX IF NOT EXISTS tasks_open_due_idx ON tasks (due_date) WHERE completed = FALSE',
+    ], [
+        'DROP INDEX IF EXISTS tasks_open_due_idx',
+        'ALTER TABLE subscriptions DROP COLUMN IF EXISTS last_notified_at',
+    ]),
+    (9, 'completion times and daily statistics', [
+        'ALTER TABLE tasks ADD COLUMN IF NOT EXISTS completed_at TIMESTAMP',
+        # The best guess for tasks completed before the column existed
+        'UPDATE tasks SET completed_at = created_at WHERE completed AND completed_at IS NULL',
+        '''CREATE OR REPLACE FUNCTION tasks_completed_at_update() RETURNS trigger AS $$
+        BEGIN
+            IF COALESCE(NEW.completed, FALSE) THEN
+                IF TG_OP = 'INSERT' OR NOT COALESCE(OLD.completed, FALSE) THEN
+                    NEW.completed_at := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+                END IF;
+            ELSE
+                NEW.completed_at := NULL;
+            END IF;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_completed_at_trigger BEFORE INSERT OR UPDATE OF completed ON tasks
+            FOR EACH ROW EXECUTE FUNCTION tasks_completed_at_update()''',
+        # Completions per user, day and quadrant, kept current by the triggers
+        # below so analytics read O(days) rows instead of every task
+        '''CREATE TABLE IF NOT EXISTS task_stats (
+            user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            urgency TEXT NOT NULL,
+            importance TEXT NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            lead_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, urgency, importance)
+        )''',
+        '''INSERT INTO task_stats (user_id, day, urgency, importance, completed, lead_seconds)
+            SELECT user_id, completed_at::date, urgency, importance, count(*),
+                COALESCE(sum(extract(epoch FROM completed_at - created_at)), 0)
+            FROM tasks WHERE completed AND completed_at IS NOT NULL
+            GROUP BY 1, 2, 3, 4''',
+        # Completed rows entering the table count +1, completed rows leaving -1;
+        # an UPDATE nets both sides so unrelated edits change nothing
+        '''CREATE OR REPLACE FUNCTION tasks_stats_update() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO task_stats AS s (user_id, day, urgency, importance, completed, lead_seconds)
+                SELECT user_id, completed_at::date, urgency, importance, count(*),
+                    COALESCE(sum(extract(epoch FROM completed_at - created_at)), 0)
+                FROM new_rows WHERE completed AND completed_at IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (user_id, day, urgency, importance) DO UPDATE
+                SET completed = s.completed + EXCLUDED.completed, lead_seconds = s.lead_seconds + EXCLUDED.lead_seconds;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE task_stats s
+                SET completed = s.completed - d.completed, lead_seconds = s.lead_seconds - d.lead_seconds
+                FROM (
+                    SELECT user_id, completed_at::date AS day, urgency, importance, count(*) AS completed,
+                        COALESCE(sum(extract(epoch FROM completed_at - created_at)), 0) AS lead_seconds
+                    FROM old_rows WHERE completed AND completed_at IS NOT NULL
+                    GROUP BY 1, 2, 3, 4
+                ) d
+                WHERE (s.user_id, s.day, s.urgency, s.importance) = (d.user_id, d.day, d.urgency, d.importance);
+            ELSE
+                INSERT INTO task_stats AS s (user_id, day, urgency, importance, completed, lead_seconds)
+                SELECT user_id, completed_at::date, urgency, importance, sum(sign),
+                    COALESCE(sum(sign * extract(epoch FROM completed_at - created_at)), 0)
+                FROM (
+                    SELECT *, 1 AS sign FROM new_rows WHERE completed AND completed_at IS NOT NULL
+                    UNION ALL
+                    SELECT *, -1 AS sign FROM old_rows WHERE completed AND completed_at IS NOT NULL
+                ) delta
+                GROUP BY 1, 2, 3, 4
+                HAVING sum(sign) <> 0
+                ON CONFLICT (user_id, day, urgency, importance) DO UPDATE
+                SET completed = s.completed + EXCLUDED.completed, lead_seconds = s.lead_seconds + EXCLUDED.lead_seconds;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_stats_insert AFTER INSERT ON tasks REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_stats_update()''',
+        '''CREATE TRIGGER tasks_stats_update AFTER UPDATE ON tasks
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_stats_update()''',
+        '''CREATE TRIGGER tasks_stats_delete AFTER DELETE ON tasks REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_stats_update()''',
+    ], [
+        'DROP TRIGGER IF EXISTS tasks_stats_delete ON tasks',
+        'DROP TRIGGER IF EXISTS tasks_stats_update ON tasks',
+        'DROP TRIGGER IF EXISTS tasks_stats_insert ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_stats_update()',
+        'DROP TABLE IF EXISTS task_stats',
+        'DROP TRIGGER IF EXISTS tasks_completed_at_trigger ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_completed_at_update()',
+        'ALTER TABLE tasks DROP COLUMN IF EXISTS completed_at',
+    ]),
+    (10, 'task row versions', [
+        'ALTER TABLE tasks ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1',
+        # Every write moves the version on, whichever code path makes it
+        '''CREATE OR REPLACE FUNCTION tasks_version_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_version_trigger BEFORE UPDATE ON tasks
+            FOR EACH ROW EXECUTE FUNCTION tasks_version_update()''',
+    ], [
+        'DROP TRIGGER IF EXISTS tasks_version_trigger ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_version_update()',
+        'ALTER TABLE tasks DROP COLUMN IF EXISTS version',
+    ]),
+    (11, 'scheduled job leases', [
+        # One row per job: its schedule, the current lease and the last run
+        '''CREATE TABLE IF NOT EXISTS job_runs (
+            name TEXT PRIMARY KEY,
+            interval_seconds INTEGER NOT NULL,
+            next_run_at TIMESTAMPTZ NOT NULL,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMPTZ,
+            last_started_at TIMESTAMPTZ,
+            last_finished_at TIMESTAMPTZ,
+            last_duration_seconds DOUBLE PRECISION,
+            last_error TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0
+        )''',
+    ], [
+        'DROP TABLE IF EXISTS job_runs',
+    ]),
+    (12, 'delta sync change log', [
+        # The transaction that last wrote each task. Sync clients keep the
+        # oldest transaction still running when they last synced (see sync.py),
+        # so a write that commits late is still picked up.
+        "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT '0'",
+        '''CREATE OR REPLACE FUNCTION tasks_change_xid_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_xid := pg_current_xact_id();
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_change_xid_trigger BEFORE INSERT OR UPDATE ON tasks
+            FOR EACH ROW EXECUTE FUNCTION tasks_change_xid_update()''',
+        'CREATE INDEX IF NOT EXISTS tasks_user_change_idx ON tasks (user_id, change_xid, id)',
+        # Tombstones, so deletions reach clients too; pruned after SYNC_RETENTION_DAYS
+        '''CREATE TABLE IF NOT EXISTS task_deletions (
+            task_id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            change_xid xid8 NOT NULL,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )''',
+        'CREATE INDEX IF NOT EXISTS task_deletions_user_change_idx ON task_deletions (user_id, change_xid, task_id)',
+        'CREATE INDEX IF NOT EXISTS task_deletions_deleted_at_idx ON task_deletions (deleted_at)',
+        '''CREATE OR REPLACE FUNCTION tasks_record_deletions() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO task_deletions (task_id, user_id, change_xid)
+            SELECT id, user_id, pg_current_xact_id() FROM old_rows
+            ON CONFLICT (task_id) DO NOTHING;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER tasks_deletions_trigger AFTER DELETE ON tasks REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION tasks_record_deletions()''',
+    ], [
+        'DROP TRIGGER IF EXISTS tasks_deletions_trigger ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_record_deletions()',
+        'DROP TABLE IF EXISTS task_deletions',
+        'DROP TRIGGER IF EXISTS tasks_change_xid_trigger ON tasks',
+        'DROP FUNCTION IF EXISTS tasks_change_xid_update()',
+        'DROP INDEX IF EXISTS tasks_user_change_idx',
+        'ALTER TABLE tasks DROP COLUMN IF EXISTS change_xid',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def current_version(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS present")
+    version = 0
+    if cur.fetchone()['present']:
+        cur.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations')
+        version = cur.fetchone()['version']
+    cur.close()
+    conn.rollback()
+    return version
+
+
+def _step(conn, apply):
+    # Each step runs in its own transaction under the advisory lock and re-reads
+    # the version once it holds the lock, so concurrent runners never apply a
+    # step twice. apply(cur, version) returns False when there is nothing to do.
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+        _ensure_version_table(cur)
+        cur.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations')
+        done = apply(cur, cur.fetchone()['version'])
+        conn.commit()
+        return done
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def upgrade(conn, target=None):
+    target = LATEST_VERSION if target is None else target
+    applied = []
+
+    def apply_next(cur, version):
+        pending = [m for m in MIGRATIONS if version < m[0] <= target]
+        if not pending:
+            return False
+        number, description, up, _ = pending[0]
+        for statement in up:
+            cur.execute(statement)
+        cur.execute('INSERT INTO schema_migrations (version, description) VALUES (%s, %s)', (number, description))
+        applied.append(number)
+        return True
+
+    while _step(conn, apply_next):
+        pass
+    return applied
+
+
+def downgrade(conn, target):
+    reverted = []
+
+    def revert_last(cur, version):
+        if version <= target:
+            return False
+        number, _, _, down = next(m for m in MIGRATIONS if m[0] == version)
+        for statement in down:
+            cur.execute(statement)
+        cur.execute('DELETE FROM schema_migrations WHERE version = %s', (number,))
+        reverted.append(number)
+        return True
+
+    while _step(conn, revert_last):
+        pass
+    return reverted
+
+
+def reset_data(conn):
+    # Migrates to the latest version and empties every table, which is much
+    # cheaper than recreating the schema (tests, benchmark seeding)
+    upgrade(conn)
+    cur = conn.cursor()
+    cur.execute('TRUNCATE users, tasks, subscriptions, task_stats, job_runs, task_deletions RESTART IDENTITY CASCADE')
+    cur.close()
+    conn.commit()
+
+
+# Secondary indexes on a table other than the given ones; constraint indexes
+# (primary keys) stay
+OTHER_INDEXES_SQL = '''
+    SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname) AS name
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE i.indrelid = to_regclass(%s) AND NOT c.relname = ANY(%s)
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)
+'''
+
+
+def plan_scans(conn, query, params=None, expected=None):
+    # [(table, index or None)] for every table a query reads. expected maps
+    # tables to the indexes meant to serve the query; every other secondary
+    # index on them is dropped for the EXPLAIN and restored by the rollback, so
+    # an index that merely starts with the right column can't stand in for a
+    # missing one. Sequential scans are turned off, so None means no index
+    # could serve the table at all.
+    cur = conn.cursor()
+    try:
+        cur.execute('SET LOCAL enable_seqscan = off')
+        # DROP INDEX locks the table until the rollback; don't queue behind traffic
+        cur.execute("SET LOCAL lock_timeout = '2s'")
+        for table, indexes in (expected or {}).items():
+            cur.execute(OTHER_INDEXES_SQL, (table, list(indexes)))
+            for row in cur.fetchall():
+                cur.execute('DROP INDEX ' + row['name'])
+        cur.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+        plan = cur.fetchone()['QUERY PLAN']
+    finally:
+        cur.close()
+        conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        children = node.get('Plans', [])
+        if node['Node Type'] == 'Seq Scan':
+            found.append((node['Relation Name'], None))
+        elif node['Node Type'] in ('Index Scan', 'Index Only Scan'):
+            found.append((node['Relation Name'], node['Index Name']))
+        elif node['Node Type'] == 'Bitmap Heap Scan':
+            # The index names are on the Bitmap Index Scans below (through any BitmapOr/And)
+            bitmaps = list(children)
+            while bitmaps:
+                bitmap = bitmaps.pop()
+                if 'Index Name' in bitmap:
+                    found.append((node['Relation Name'], bitmap['Index Name']))
+                bitmaps.extend(bitmap.get('Plans', []))
+            children = []
+        nodes.extend(children)
+    return found
+
+
+def on_tasks(*indexes):
+    return {'tasks': indexes}
+
+
+def route_queries(user_id='plan-check', today=None):
+    # The queries the routes and scheduler run on every request or job, with
+    # representative parameters and the indexes meant to serve them. Each must
+    # be answerable from those indexes alone.
+    from api import TASK_FIELDS, task_list_query
+    from board import QUADRANTS, board_query
+    from analytics import DAILY_SQL, OVERDUE_SQL, STREAKS_SQL
+    from notifications import DUE_SUBSCRIPTIONS_SQL
+    from priority import suggested_query
+    from recurrence import PENDING_USERS_SQL, ROLLOVER_SQL, SPAWN_SQL
+    from repository import BATCH_SQL, TOGGLE_SQL
+    from reports import CHECKIN_SQL, report_query, summary_query
+    from search import SEARCH_SQL
+    from sync import PRUNE_SQL, SYNC_SQL
+
+    today = today or date.today()
+    first_page = {key: None for key, *_ in QUADRANTS}
+    next_page = {key: '2025-01-01.1' for key, *_ in QUADRANTS}
+    return [
+        ('tasks board', *board_query(user_id, first_page, False, 25), on_tasks('tasks_user_quadrant_idx')),
+        ('tasks board, next page, open only', *board_query(user_id, next_page, True, 25),
+         on_tasks('tasks_user_quadrant_idx')),
+        ('suggested tasks', *suggested_query(user_id, today), on_tasks('tasks_user_completed_due_idx')),
+        ('suggested open tasks', *suggested_query(user_id, today, open_only=True), on_tasks('tasks_user_completed_due_idx')),
+        ('report', *report_query(user_id, '2025-01-01', '2025-12-31', limit=201),
+         on_tasks('tasks_user_completed_created_idx')),
+        ('report, next page', *report_query(user_id, after=(datetime(2025, 1, 1), 1), limit=201),
+         on_tasks('tasks_user_completed_created_idx')),
+        ('report summary', *summary_query(user_id, '2025-01-01', '2025-12-31'),
+         on_tasks('tasks_user_completed_created_idx')),
+        ('checkin', CHECKIN_SQL, {'user_id': user_id, 'today': today, 'week_ago': today},
+         on_tasks('tasks_user_completed_due_idx', 'tasks_user_completed_created_idx')),
+        ('rollover pending users', PENDING_USERS_SQL, ('', 500), on_tasks('tasks_recurring_pending_idx')),
+        ('rollover', ROLLOVER_SQL, {'user_ids': [user_id], 'frequency': 'daily', 'today': today, 'days': 1},
+         on_tasks('tasks_recurring_pending_idx')),
+        ('toggle', TOGGLE_SQL, {'id': 1, 'user_id': user_id, 'version': 1}, on_tasks('tasks_pkey')),
+        ('toggle, next instance', SPAWN_SQL, {'ids': [1], 'today': today}, on_tasks('tasks_pkey')),
+        ('batch move', BATCH_SQL['move'], {
+            'ids': [1, 2], 'versions': [1, None], 'user_id': user_id, 'urgency': 'urgent', 'importance': 'important'},
+         on_tasks('tasks_pkey')),
+        ('batch delete', BATCH_SQL['delete'], {'ids': [1, 2], 'versions': [None, None], 'user_id': user_id},
+         on_tasks('tasks_pkey')),
+        ('search', SEARCH_SQL, {'user_id': user_id, 'query': 'plan:*', 'after_rank': None, 'after_id': None, 'limit': 21},
+         on_tasks('tasks_search_idx')),
+        ('api tasks', *task_list_query(user_id, TASK_FIELDS), on_tasks('tasks_pkey')),
+        ('api tasks, one quadrant, open only', *task_list_query(user_id, ['id', 'title'], 'do', 'false', 10),
+         on_tasks('tasks_user_quadrant_idx', 'tasks_pkey')),
+        ('task by id', 'SELECT * FROM tasks WHERE id = %s AND user_id = %s', (1, user_id), on_tasks('tasks_pkey')),
+        ('user by id', 'SELECT id, name FROM users WHERE id = %s', (user_id,), {'users': ('users_pkey',)}),
+        ('subscriptions', 'SELECT id, subscription FROM subscriptions WHERE user_id = %s', (user_id,),
+         {'subscriptions': ('subscriptions_user_idx',)}),
+        ('analytics daily', DAILY_SQL, {'user_id': user_id, 'today': today, 'since': today},
+         {'task_stats': ('task_stats_pkey',)}),
+        ('analytics streaks', STREAKS_SQL, {'user_id': user_id, 'today': today}, {'task_stats': ('task_stats_pkey',)}),
+        ('analytics overdue', OVERDUE_SQL, (user_id, today), on_tasks('tasks_user_completed_due_idx')),
+        ('due-task reminders', DUE_SUBSCRIPTIONS_SQL, {
+            'today': today, 'soon': today, 'quiet_since': today, 'after': 0, 'limit': 500},
+         {'tasks': ('tasks_open_due_idx',), 'subscriptions': ('subscriptions_pkey', 'subscriptions_user_idx')}),
+        ('sync', SYNC_SQL, {'user_id': user_id, 'after_xid': '0', 'after_id': 0, 'limit': 501},
+         {'tasks': ('tasks_user_change_idx',), 'task_deletions': ('task_deletions_user_change_idx',)}),
+        ('sync tombstone pruning', PRUNE_SQL, (30,), {'task_deletions': ('task_deletions_deleted_at_idx',)}),
+    ]
+
+
+def check_query_plans(conn):
+    # Returns [(query name, [tables not read through their intended index])]
+    # for failing queries
+    failures = []
+    for name, query, params, expected in route_queries():
+        tables = []
+        for table, index in plan_scans(conn, query, params, expected):
+            if (index is None or index not in expected.get(table, (index,))) and table not in tables:
+                tables.append(table)
+        if tables:
+            failures.append((name, tables))
+    return failures
+
+
+@click.group('db')
+def db_cli():
+    """Manage the database schema."""
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Version to upgrade to (default: latest).')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    conn = get_db_connection()
+    try:
+        applied = upgrade(conn, target)
+    finally:
+        conn.close()
+    click.echo('Applied: %s' % (', '.join(map(str, applied)) or 'nothing, already up to date'))
+
+
+@db_cli.command('downgrade')
+@click.option('--to', 'target', type=int, required=True, help='Version to downgrade to (0 drops everything).')
+def downgrade_command(target):
+    """Revert migrations above a version."""
+    conn = get_db_connection()
+    try:
+        reverted = downgrade(conn, target)
+    finally:
+        conn.close()
+    click.echo('Reverted: %s' % (', '.join(map(str, reverted)) or 'nothing'))
+
+
+@db_cli.command('status')
+def status_command():
+    """Show the current and latest schema versions."""
+    conn = get_db_connection()
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    click.echo('Schema version %d of %d' % (version, LATEST_VERSION))
+    for number, description, _, _ in MIGRATIONS:
+        click.echo('  [%s] %d %s' % ('x' if number <= version else ' ', number, description))
+
+
+@db_cli.command('check-plans')
+def check_plans_command():
+    """Fail if a route query is not served by its intended index."""
+    conn = get_db_connection()
+    try:
+        failures = check_query_plans(conn)
+    finally:
+        conn.close()
+    for name, tables in failures:
+        click.echo('Sequential scan in %s: %s' % (name, ', '.join(tables)), err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo('All route queries use indexes.')
+
+
+if __name__ == '__main__':
+    # python migrations.py upgrade, without importing (and starting) the app
+    db_cli()
@@ -0,0 +1,89 @@
+from enum import StrEnum
+from functools import cache
+
+
+# Task rows as read by the repositories and the API. A board or report can
+# hold thousands of them, so a task is a slotted object rather than a dict
+# keyed by column names, and its urgency, importance and frequency are shared
+# enum members rather than a fresh string per row. The enums are str
+# subclasses: they compare equal to, bind and serialise as their stored text.
+
+
+class Urgency(StrEnum):
+    URGENT = 'urgent'
+    NOT_URGENT = 'not urgent'
+
+    @property
+    def label(self):
+        return self.value.title()
+
+
+class Importance(StrEnum):
+    IMPORTANT = 'important'
+    NOT_IMPORTANT = 'not important'
+
+    @property
+    def label(self):
+        return self.value.title()
+
+
+class Frequency(StrEnum):
+    NONE = 'none'
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+
+    @property
+    def label(self):
+        return self.value.title()
+
+
+# Stored columns, in table order; queries select these instead of *, which
+# would also read tasks.search_vector and tasks.change_xid
+COLUMNS = ('id', 'title', 'urgency', 'importance', 'due_date', 'impact', 'frequency', 'completed',
+           'rolled_over', 'user_id', 'created_at', 'completed_at', 'version')
+COLUMNS_SQL = ', '.join(COLUMNS)
+
+# Text columns read back as enum members. A value that isn't one (written
+# before the forms were checked) is kept as text so the task still shows.
+CODES = {
+    'urgency': {member.value: member for member in Urgency},
+    'importance': {member.value: member for member in Importance},
+    'frequency': {member.value: member for member in Frequency},
+}
+
+
+class Task:
+    # priority and rank are scores some queries add (priority.PRIORITY_SQL,
+    # search ranking); fields a query didn't select are None
+    __slots__ = COLUMNS + ('priority', 'rank')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError('Unknown task fields: %s' % ', '.join(sorted(fields)))
+
+    def __repr__(self):
+        return '<Task %s %r>' % (self.id, self.title)
+
+
+@cache
+def row_maker(names):
+    # A function building a Task from a row's values, for a result with
+    # these column names; columns Task has no slot for are skipped
+    plan = [(name, index, CODES.get(name)) for index, name in enumerate(names) if name in Task.__slots__]
+    unset = [name for name in Task.__slots__ if name not in names]
+    new = Task.__new__
+
+    def make(values):
+        task = new(Task)
+        for name, index, codes in plan:
+            value = values[index]
+            if codes is not None:
+                value = codes.get(value, value)
+            setattr(task, name, value)
+        for name in unset:
+            setattr(task, name, None)
+        return task
+    return make
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+
+# One row per subscription whose user has open tasks that are overdue or due
+# by %(soon)s, skipping subscriptions reminded since %(quiet_since)s. The
+# task side comes from a partial index over open, dated tasks for all users.
+DUE_SUBSCRIPTIONS_SQL = '''
+    SELECT s.id, s.subscription, due.overdue, due.due_soon
+    FROM (
+        SELECT user_id,
+            count(*) FILTER (WHERE due_date < %(today)s) AS overdue,
+            count(*) FILTER (WHERE due_date >= %(today)s) AS due_soon
+        FROM tasks
+        WHERE completed = FALSE AND due_date <= %(soon)s
+        GROUP BY user_id
+    ) due
+    JOIN subscriptions s ON s.user_id = due.user_id
+    WHERE s.id > %(after)s
+        AND (s.last_notified_at IS NULL OR s.last_notified_at < %(quiet_since)s)
+    ORDER BY s.id
+    LIMIT %(limit)s
+'''
+
+# Push services answer 404/410 once the browser has unsubscribed
+GONE = (404, 410)
+RETRY = (429, 500, 502, 503, 504)
+
+
+def webpush(**kwargs):
+    # pywebpush and the stack under it take longer to import than the rest of
+    # the app, so they are loaded with the first push rather than at startup
+    from pywebpush import webpush
+    return webpush(**kwargs)
+
+
+def reminder(overdue, due_soon):
+    parts = []
+    if overdue:
+        parts.append('%d overdue' % overdue)
+    if due_soon:
+        parts.append('%d due soon' % due_soon)
+    return {"title": "Task Reminder", "body": "You have %s task%s." % (
+        ' and '.join(parts), '' if overdue + due_soon == 1 else 's')}
+
+
+class PushDispatcher:
+    # Sends web pushes from a thread pool. Each push service host gets at most
+    # per_host sends in flight, 429/5xx answers are retried with backoff (or
+    # the Retry-After the service asked for, up to max_delay; a longer wait
+    # counts as failed), and endpoints that are gone are reported so the
+    # caller can delete them in one statement.
+    def __init__(self, vapid_private_key, vapid_claims, send=webpush, max_workers=8,
+                 per_host=4, max_retries=3, backoff=0.5, timeout=10.0, max_delay=30.0):
+        self.vapid_private_key = vapid_private_key
+        self.vapid_claims = vapid_claims
+        self._send = send
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _host_slot(self, endpoint):
+        host = urlsplit(endpoint).netloc
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+        with slot:
+            yield
+
+    def _push(self, subscription, payload, max_retries):
+        # Returns 'sent', 'gone' or 'failed'
+        import requests
+        from pywebpush import WebPushException
+
+        for attempt in range(max_retries + 1):
+            try:
+                with self._host_slot(subscription.get('endpoint', '')):
+                    self._send(
+                        subscription_info=subscription,
+                        data=payload,
+                        vapid_private_key=self.vapid_private_key,
+                        # pywebpush fills in aud/exp, so every send needs its own copy
+                        vapid_claims=dict(self.vapid_claims),
+                        timeout=self.timeout,
+                    )
+                return 'sent'
+            except WebPushException as e:
+                status = e.response.status_code if e.response is not None else None
+                if status in GONE:
+                    return 'gone'
+                if status not in RETRY:
+                    return 'failed'
+                retry_after = e.response.headers.get('Retry-After', '')
+            except requests.RequestException:
+                # Connection errors and timeouts are worth another try
+                retry_after = ''
+            except (ValueError, TypeError, KeyError):
+                # Malformed subscription JSON; retrying won't help
+                return 'failed'
+            if attempt == max_retries:
+                break
+            delay = self.backoff * 2 ** attempt
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if delay > self.max_delay:
+                break
+            time.sleep(delay)
+        return 'failed'
+
+    def dispatch(self, messages, max_retries=None):
+        # messages: [(subscription id, subscription dict, payload dict)].
+        # Returns {'sent': [ids], 'gone': [ids], 'failed': [ids]}. Callers
+        # answering a request pass max_retries=0 so nothing sleeps in it.
+        if max_retries is None:
+            max_retries = self.max_retries
+        by_endpoint = {}
+        for sub_id, subscription, payload in messages:
+            # Browsers re-subscribe on every page load, so one endpoint can
+            # have several rows; push to it once and apply the result to all.
+            key = (subscription.get('endpoint'), json.dumps(payload, sort_keys=True))
+            entry = by_endpoint.setdefault(key, [subscription, payload, []])
+            entry[2].append(sub_id)
+
+        results = {'sent': [], 'gone': [], 'failed': []}
+        if not by_endpoint:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(by_endpoint))) as pool:
+            futures = [(pool.submit(self._push, subscription, json.dumps(payload), max_retries), ids)
+                       for subscription, payload, ids in by_endpoint.values()]
+            for future, ids in futures:
+                results[future.result()].extend(ids)
+        return results
+
+
+def record_results(cur, results):
+    if results['gone']:
+        cur.execute('DELETE FROM subscriptions WHERE id = ANY(%s)', (results['gone'],))
+    if results['sent']:
+        cur.execute('UPDATE subscriptions SET last_notified_at = now() WHERE id = ANY(%s)', (results['sent'],))
+
+
+def notify_due_tasks(conn, dispatcher, today=None, due_within=1, quiet_hours=12, chunk_size=500):
+    # Reminds every subscribed user with overdue or soon-due tasks, one chunk
+    # of subscriptions per transaction. Returns the combined results.
+    today = today or date.today()
+    quiet_since = datetime.now(timezone.utc) - timedelta(hours=quiet_hours)
+    totals = {'sent': [], 'gone': [], 'failed': []}
+    after = 0
+    while True:
+        cur = conn.cursor()
+        cur.execute(DUE_SUBSCRIPTIONS_SQL, {
+            'today': today,
+            'soon': today + timedelta(days=due_within),
+            'quiet_since': quiet_since,
+            'after': after,
+            'limit': chunk_size,
+        })
+        rows = cur.fetchall()
+        # Don't hold the transaction open while waiting on push services
+        conn.commit()
+        if not rows:
+            cur.close()
+            return totals
+        messages = []
+        for row in rows:
+            try:
+                subscription = json.loads(row['subscription'])
+            except ValueError:
+                totals['failed'].append(row['id'])
+                continue
+            messages.append((row['id'], subscription, reminder(row['overdue'], row['due_soon'])))
+        results = dispatcher.dispatch(messages)
+        record_results(cur, results)
+        conn.commit()
+        cur.close()
+        for key in totals:
+            totals[key].extend(results[key])
+        after = rows[-1]['id']
@@ -0,0 +1,47 @@
+import heapq
+from datetime import date
+
+from models import COLUMNS_SQL
+
+
+# Suggested-task score, the single definition shared by every page: impact,
+# halved for unimportant tasks, divided by the days left until the due date
+# (30 when there is none, never less than 1).
+PRIORITY_SQL = '''(
+    COALESCE(impact, 5) * CASE WHEN importance = 'important' THEN 1.0 ELSE 0.5 END
+    / GREATEST(COALESCE(due_date - %(today)s::date, 30), 1)
+)::float8'''
+
+# Share of a user's tasks that gets suggested (at least one)
+SUGGESTED_DIVISOR = 5
+
+# The score depends on today's date so it can't be indexed, but ORDER BY ...
+# LIMIT lets Postgres keep only the top rows (a bounded heap) instead of
+# sorting everything.
+SUGGESTED_SQL = '''
+    SELECT {columns}, {priority} AS priority FROM tasks
+    WHERE user_id = %(user_id)s{filter}
+    ORDER BY priority DESC, due_date ASC, id ASC
+    LIMIT (SELECT GREATEST(COUNT(*) / {divisor}, 1) FROM tasks WHERE user_id = %(user_id)s{filter})
+'''
+
+
+def suggested_query(user_id, today, open_only=False):
+    query = SUGGESTED_SQL.format(
+        columns=COLUMNS_SQL,
+        priority=PRIORITY_SQL,
+        divisor=SUGGESTED_DIVISOR,
+        filter=' AND completed = FALSE' if open_only else '',
+    )
+    return query, {'user_id': user_id, 'today': today}
+
+
+def suggested_tasks(cur, user_id, today, open_only=False):
+    cur.execute(*suggested_query(user_id, today, open_only))
+    return cur.fetchall()
+
+
+def top_suggested(tasks):
+    # The same selection as SUGGESTED_SQL, for rows already scored with PRIORITY_SQL
+    count = max(len(tasks) // SUGGESTED_DIVISOR, 1)
+    return heapq.nsmallest(count, tasks, key=lambda t: (-t.priority, t.due_date or date.max, t.id))
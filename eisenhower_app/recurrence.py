@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+from models import Frequency
+
+
+# Days between two instances of a recurring task
+FREQUENCY_DAYS = {Frequency.DAILY: 1, Frequency.WEEKLY: 7, Frequency.MONTHLY: 30}
+
+
+def next_due_date(frequency, due_date, today=None):
+    days = FREQUENCY_DAYS.get(frequency)
+    if days is None:
+        return None
+    return (due_date or today or date.today()) + timedelta(days=days)
+
+
+# Users that still have completed recurring tasks waiting for their next instance
+PENDING_USERS_SQL = '''
+    SELECT DISTINCT user_id FROM tasks
+    WHERE frequency <> 'none' AND completed = TRUE AND rolled_over = FALSE AND user_id > %s
+    ORDER BY user_id
+    LIMIT %s
+'''
+
+# Marks the source rows and creates their successors in a single statement, so a
+# task can never be rolled over twice, even by concurrent runs.
+ROLLOVER_SQL = '''
+    WITH source AS (
+        UPDATE tasks SET rolled_over = TRUE
+        WHERE user_id = ANY(%(user_ids)s) AND frequency = %(frequency)s
+            AND completed = TRUE AND rolled_over = FALSE
+        RETURNING title, urgency, importance, due_date, impact, frequency, user_id
+    )
+    INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id, completed)
+    SELECT title, urgency, importance, COALESCE(due_date, %(today)s) + %(days)s, impact, frequency, user_id, FALSE
+    FROM source
+'''
+
+
+# The same for tasks that were just completed (one toggle, or a batch): flipping
+# rolled_over is the claim, so however many requests race only one creates the
+# next instance
+FREQUENCY_VALUES = ', '.join("('%s', %d)" % item for item in FREQUENCY_DAYS.items())
+
+SPAWN_SQL = '''
+    WITH source AS (
+        UPDATE tasks SET rolled_over = TRUE
+        FROM (VALUES {frequencies}) AS f(frequency, days)
+        WHERE tasks.id = ANY(%(ids)s) AND tasks.frequency = f.frequency
+            AND tasks.completed = TRUE AND tasks.rolled_over = FALSE
+        RETURNING tasks.id AS source_id, title, urgency, importance, due_date, impact, tasks.frequency, user_id, days
+    )
+    INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id, completed)
+    SELECT title, urgency, importance, COALESCE(due_date, %(today)s) + days, impact, frequency, user_id, FALSE
+    FROM source
+    ORDER BY source_id
+    RETURNING id
+'''.format(frequencies=FREQUENCY_VALUES)
+
+
+def rollover_recurring_tasks(conn, today=None, chunk_size=500):
+    # Walks users in keyset order and commits after each chunk, so a run holds
+    # at most chunk_size users' locks and never loads task rows into Python.
+    today = today or date.today()
+    cur = conn.cursor()
+    created = 0
+    last_user_id = ''
+    while True:
+        cur.execute(PENDING_USERS_SQL, (last_user_id, chunk_size))
+        user_ids = [row['user_id'] for row in cur.fetchall()]
+        if not user_ids:
+            break
+        for frequency, days in FREQUENCY_DAYS.items():
+            cur.execute(ROLLOVER_SQL, {'user_ids': user_ids, 'frequency': frequency, 'today': today, 'days': days})
+            created += cur.rowcount
+        conn.commit()
+        last_user_id = user_ids[-1]
+    cur.close()
+    return created
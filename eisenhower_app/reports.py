@@ -0,0 +1,165 @@
+import re
+from datetime import datetime, timedelta
+
+from board import QUADRANTS
+from cursors import InvalidCursor, check_id
+from db import TaskCursor
+from models import COLUMNS_SQL
+from priority import PRIORITY_SQL, top_suggested
+
+
+# Queries behind /report and /checkin
+
+REPORT_SQL = 'SELECT %s FROM tasks WHERE user_id = %%s AND completed = TRUE' % COLUMNS_SQL
+
+# Aggregates only, for ?view=summary: one row per quadrant and one per week
+# from a single pass over the range.
+SUMMARY_SQL = '''
+    SELECT urgency, importance, date_trunc('week', created_at)::date AS week,
+        GROUPING(urgency, importance) = 0 AS per_quadrant,
+        count(*) AS total, count(*) FILTER (WHERE completed) AS completed
+    FROM tasks
+    WHERE user_id = %(user_id)s {range}
+    GROUP BY GROUPING SETS ((urgency, importance), (date_trunc('week', created_at)::date))
+'''
+
+CURSOR_RE = re.compile(r'^(\d{4}-\d\d-\d\dT[\d:.]+)_(\d+)$')
+
+# Everything the check-in page shows comes from this one scan: open tasks
+# (overdue, upcoming and suggestions are all subsets) plus tasks completed in
+# the last week. Each branch of the OR is an index range scan.
+CHECKIN_SQL = '''
+    SELECT {columns}, {priority} AS priority FROM tasks
+    WHERE user_id = %(user_id)s
+        AND (completed = FALSE OR (completed = TRUE AND created_at >= %(week_ago)s))
+    ORDER BY due_date ASC, id ASC
+'''.format(columns=COLUMNS_SQL, priority=PRIORITY_SQL)
+
+
+def encode_cursor(task):
+    return '%s_%d' % (task.created_at.isoformat(), task.id)
+
+
+def decode_cursor(cursor):
+    # Returns (created_at, id), or None for the first page; raises InvalidCursor
+    if not cursor:
+        return None
+    match = CURSOR_RE.match(cursor)
+    if not match:
+        raise InvalidCursor(cursor)
+    try:
+        created_at = datetime.fromisoformat(match.group(1))
+    except ValueError:
+        raise InvalidCursor(cursor)
+    return created_at, check_id(match.group(2))
+
+
+def report_query(user_id, start_date=None, end_date=None, after=None, limit=None):
+    # Newest first; `after` is a decoded cursor, resuming below that task
+    query = REPORT_SQL
+    params = [user_id]
+    if start_date:
+        query += ' AND created_at >= %s'
+        params.append(start_date)
+    if end_date:
+        query += ' AND created_at <= %s'
+        params.append(end_date)
+    if after:
+        query += ' AND (created_at, id) < (%s, %s)'
+        params.extend(after)
+    query += ' ORDER BY created_at DESC, id DESC'
+    if limit:
+        query += ' LIMIT %s'
+        params.append(limit)
+    return query, params
+
+
+def summary_query(user_id, start_date=None, end_date=None):
+    conditions, params = '', {'user_id': user_id}
+    if start_date:
+        conditions += ' AND created_at >= %(start_date)s'
+        params['start_date'] = start_date
+    if end_date:
+        conditions += ' AND created_at <= %(end_date)s'
+        params['end_date'] = end_date
+    return SUMMARY_SQL.format(range=conditions), params
+
+
+def load_summary(cur, user_id, start_date=None, end_date=None):
+    cur.execute(*summary_query(user_id, start_date, end_date))
+    return summary_dashboard(cur.fetchall())
+
+
+def summary_dashboard(rows):
+    # Totals for the summary view from the rows of SUMMARY_SQL
+    quadrants = {(urgency, importance): (key, label) for key, urgency, importance, label, _ in QUADRANTS}
+    by_quadrant = {key: {'key': key, 'label': label, 'total': 0, 'completed': 0}
+                   for key, label in quadrants.values()}
+    by_week = []
+    for row in rows:
+        counts = {'total': row['total'], 'completed': row['completed']}
+        if not row['per_quadrant']:
+            by_week.append(dict(counts, week=row['week']))
+        elif (row['urgency'], row['importance']) in quadrants:
+            by_quadrant[quadrants[row['urgency'], row['importance']][0]].update(counts)
+    total = sum(row['total'] for row in by_week)
+    completed = sum(row['completed'] for row in by_week)
+    return {
+        'total': total,
+        'completed': completed,
+        'completion_rate': completed / total if total else 0.0,
+        'quadrants': [by_quadrant[key] for key, *_ in QUADRANTS],
+        'weeks': sorted(by_week, key=lambda row: row['week'], reverse=True),
+    }
+
+
+def load_checkin(cur, user_id, today):
+    week_ago = today - timedelta(days=7)
+    cur.execute(CHECKIN_SQL, {'user_id': user_id, 'today': today, 'week_ago': week_ago})
+    return checkin_dashboard(cur.fetchall(), today)
+
+
+def checkin_dashboard(tasks, today):
+    # Splits the rows of CHECKIN_SQL (scored, in due date order) into the page's sections
+    next_week = today + timedelta(days=7)
+    completed, open_tasks = [], []
+    for task in tasks:
+        (completed if task.completed else open_tasks).append(task)
+    completed.sort(key=lambda task: task.created_at, reverse=True)
+    return {
+        'completed_tasks': completed,
+        'overdue_tasks': [t for t in open_tasks if t.due_date and t.due_date < today],
+        'upcoming_tasks': [t for t in open_tasks if t.due_date and today <= t.due_date <= next_week],
+        'suggested_tasks': top_suggested(open_tasks),
+    }
+
+
+class ReportPage:
+    # Iterable page of report rows for stream_template. The rows come from a
+    # server-side cursor, itersize at a time, so neither the worker nor the
+    # template ever holds the whole range; next_cursor is known once the
+    # loop has run.
+    def __init__(self, connect, query, params, limit, itersize=200):
+        self._connect = connect
+        self._query = query
+        self._params = params
+        self.limit = limit
+        self.itersize = itersize
+        self.next_cursor = None
+
+    def __iter__(self):
+        with self._connect() as conn:
+            cur = conn.cursor(name='report', cursor_factory=TaskCursor)
+            cur.itersize = self.itersize
+            try:
+                cur.execute(self._query, self._params)
+                last = None
+                for count, task in enumerate(cur, 1):
+                    if count > self.limit:
+                        self.next_cursor = encode_cursor(last)
+                        break
+                    last = task
+                    yield task
+            finally:
+                cur.close()
+                conn.rollback()
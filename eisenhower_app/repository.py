@@ -0,0 +1,363 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import date
+
+from board import load_board
+from db import TaskCursor, TupleCursor, db_connection, get_db_connection
+from events import notify_task_event, notify_task_events
+from migrations import upgrade
+from models import COLUMNS_SQL
+from priority import suggested_tasks
+from recurrence import FREQUENCY_DAYS, SPAWN_SQL, rollover_recurring_tasks
+from reports import ReportPage, decode_cursor, load_checkin, load_summary, report_query
+from search import search_tasks
+from versions import data_version
+
+
+# Storage behind the core task pages: users, task CRUD, the board, check-in,
+# search, the report and recurring rollover. PostgresRepository is the full
+# deployment; SQLiteRepository (sqlite_repository.py) runs the same pages
+# from a single file. Everything else (JSON API, analytics, import/export,
+# live events, push reminders) needs PostgreSQL.
+
+# Columns a task form can set
+TASK_FIELDS = ('title', 'urgency', 'importance', 'due_date', 'impact', 'frequency')
+
+# Writes that carry the version the client last saw only apply if the row is
+# still at it. A concurrent writer holding the row lock makes this wait, after
+# which PostgreSQL re-checks the condition against the committed row.
+UPDATE_SQL = '''
+    UPDATE tasks SET title = %(title)s, urgency = %(urgency)s, importance = %(importance)s,
+        due_date = %(due_date)s, impact = %(impact)s, frequency = %(frequency)s
+    WHERE id = %(id)s AND user_id = %(user_id)s AND (%(version)s::int IS NULL OR version = %(version)s::int)
+    RETURNING id, version
+'''
+
+TOGGLE_SQL = '''
+    UPDATE tasks SET completed = NOT completed
+    WHERE id = %(id)s AND user_id = %(user_id)s AND (%(version)s::int IS NULL OR version = %(version)s::int)
+    RETURNING id, completed, rolled_over, frequency, version
+'''
+
+GET_TASK_SQL = 'SELECT %s FROM tasks WHERE id = %%s AND user_id = %%s' % COLUMNS_SQL
+
+# The tasks of a versioned batch operation that it didn't write
+UNWRITTEN_SQL = 'SELECT %s FROM tasks WHERE user_id = %%s AND id = ANY(%%s) AND NOT id = ANY(%%s) ORDER BY id' % COLUMNS_SQL
+
+# One statement per batch operation (batch.py), each over every id in it.
+# unnest pairs the ids with the versions the client saw; a NULL version
+# writes regardless.
+BATCH_UPDATE_SQL = '''
+    UPDATE tasks SET {changes}
+    FROM unnest(%(ids)s::int[], %(versions)s::int[]) AS v(id, version)
+    WHERE tasks.id = v.id AND tasks.user_id = %(user_id)s AND (v.version IS NULL OR tasks.version = v.version)
+    RETURNING tasks.id
+'''
+
+BATCH_SQL = {
+    'complete': BATCH_UPDATE_SQL.format(changes='completed = TRUE'),
+    'move': BATCH_UPDATE_SQL.format(changes='urgency = %(urgency)s, importance = %(importance)s'),
+    'reschedule': BATCH_UPDATE_SQL.format(changes='due_date = %(due_date)s'),
+    'delete': '''
+        DELETE FROM tasks
+        USING unnest(%(ids)s::int[], %(versions)s::int[]) AS v(id, version)
+        WHERE tasks.id = v.id AND tasks.user_id = %(user_id)s AND (v.version IS NULL OR tasks.version = v.version)
+        RETURNING tasks.id
+    ''',
+}
+
+# The event listeners get for each task a batch operation wrote
+BATCH_EVENTS = {'complete': 'toggle', 'move': 'update', 'reschedule': 'update', 'delete': 'delete'}
+
+
+class Conflict(Exception):
+    # A versioned write found the task already changed; task is its current
+    # row, a models.Task
+    def __init__(self, task):
+        super().__init__('Task %d has changed (now at version %d)' % (task.id, task.version))
+        self.task = task
+
+
+class BatchConflict(Exception):
+    # Tasks in a batch had changed since the versions sent with it; nothing
+    # was written. tasks are their current rows (models.Task).
+    def __init__(self, tasks):
+        super().__init__('%d tasks have changed' % len(tasks))
+        self.tasks = tasks
+
+
+class TaskRepository(ABC):
+    name = None
+
+    @abstractmethod
+    def migrate(self):
+        # Brings the schema up to date; returns the versions applied
+        pass
+
+    @abstractmethod
+    def get_user(self, user_id):
+        # {'id', 'name', 'password'} or None
+        pass
+
+    @abstractmethod
+    def create_user(self, user_id, name, password_hash):
+        # False if the id is taken
+        pass
+
+    @abstractmethod
+    def data_version(self, user_id):
+        # Changes whenever any of the user's tasks is written
+        pass
+
+    @abstractmethod
+    def add_task(self, user_id, task):
+        # task maps TASK_FIELDS to values; returns the new id
+        pass
+
+    @abstractmethod
+    def get_task(self, user_id, task_id):
+        # A models.Task, as are the tasks every read below returns, or None
+        pass
+
+    @abstractmethod
+    def update_task(self, user_id, task_id, task, version=None):
+        # {'id', 'version'} after the write, or None if there is no such task.
+        # With a version, raises Conflict unless the task is still at it.
+        pass
+
+    @abstractmethod
+    def delete_task(self, user_id, task_id):
+        pass
+
+    @abstractmethod
+    def toggle_task(self, user_id, task_id, today=None, version=None):
+        # Flips completed; completing a recurring task creates its next
+        # instance, once. Returns {'id', 'completed', 'version'} or None, and
+        # raises Conflict like update_task.
+        pass
+
+    @abstractmethod
+    def apply_batch(self, user_id, operations, today=None):
+        # Applies operations as parsed by batch.parse_operations in one
+        # transaction; returns, per operation, the ids it wrote (ids of missing
+        # tasks are left out), and {id: version} for the written tasks that
+        # still exist, as of the commit. Raises BatchConflict, writing
+        # nothing, if any task is no longer at the version given for it.
+        pass
+
+    @abstractmethod
+    def load_board(self, user_id, cursors=None, hide_completed=False, page_size=25):
+        # Quadrant dicts as returned by board.load_board
+        pass
+
+    @abstractmethod
+    def suggested_tasks(self, user_id, today, open_only=False):
+        pass
+
+    @abstractmethod
+    def load_checkin(self, user_id, today):
+        # Sections as returned by reports.checkin_dashboard
+        pass
+
+    @abstractmethod
+    def search_tasks(self, user_id, text, after=None, limit=20):
+        # (tasks, next cursor or None)
+        pass
+
+    @abstractmethod
+    def report_page(self, user_id, start_date=None, end_date=None, after=None, limit=200):
+        # Iterable of completed tasks, newest first, with next_cursor set
+        # once iterated; `after` is the previous page's next_cursor
+        pass
+
+    @abstractmethod
+    def report_summary(self, user_id, start_date=None, end_date=None):
+        # Counts per quadrant and per week, as returned by reports.summary_dashboard
+        pass
+
+    @abstractmethod
+    def rollover_recurring_tasks(self, today=None, chunk_size=500):
+        # Returns the number of instances created
+        pass
+
+
+class PostgresRepository(TaskRepository):
+    name = 'postgres'
+
+    def __init__(self, connection=db_connection):
+        self._connection = connection
+
+    def _read(self, load, *args, cursor_factory=None):
+        with self._connection() as conn:
+            cur = conn.cursor(cursor_factory=cursor_factory)
+            result = load(cur, *args)
+            cur.close()
+        return result
+
+    def migrate(self):
+        # Its own connection, so a gunicorn master doesn't keep a pooled one
+        conn = get_db_connection()
+        try:
+            return upgrade(conn)
+        finally:
+            conn.close()
+
+    def get_user(self, user_id):
+        def load(cur):
+            cur.execute('SELECT id, name, password FROM users WHERE id = %s', (user_id,))
+            return cur.fetchone()
+        return self._read(load)
+
+    def create_user(self, user_id, name, password_hash):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                'INSERT INTO users (id, name, password) VALUES (%s, %s, %s) ON CONFLICT (id) DO NOTHING',
+                (user_id, name, password_hash)
+            )
+            created = cur.rowcount == 1
+            conn.commit()
+            cur.close()
+        return created
+
+    def data_version(self, user_id):
+        return self._read(data_version, user_id)
+
+    def add_task(self, user_id, task):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id',
+                tuple(task[field] for field in TASK_FIELDS) + (user_id,)
+            )
+            task_id = cur.fetchone()['id']
+            notify_task_event(cur, user_id, 'create', task_id)
+            conn.commit()
+            cur.close()
+        return task_id
+
+    def get_task(self, user_id, task_id):
+        def load(cur):
+            cur.execute(GET_TASK_SQL, (task_id, user_id))
+            return cur.fetchone()
+        return self._read(load, cursor_factory=TaskCursor)
+
+    def _written(self, conn, cur, user_id, task_id, version):
+        # The row a versioned write returned; when there is none, tells a
+        # missing task (None) from a conflicting one
+        row = cur.fetchone()
+        if row is None and version is not None:
+            with conn.cursor(cursor_factory=TaskCursor) as tasks:
+                tasks.execute(GET_TASK_SQL, (task_id, user_id))
+                current = tasks.fetchone()
+            conn.rollback()
+            cur.close()
+            if current:
+                raise Conflict(current)
+        return row
+
+    def update_task(self, user_id, task_id, task, version=None):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(UPDATE_SQL, dict(task, id=task_id, user_id=user_id, version=version))
+            updated = self._written(conn, cur, user_id, task_id, version)
+            if updated:
+                notify_task_event(cur, user_id, 'update', task_id)
+            conn.commit()
+            cur.close()
+        return updated
+
+    def delete_task(self, user_id, task_id):
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM tasks WHERE id = %s AND user_id = %s', (task_id, user_id))
+            deleted = cur.rowcount == 1
+            if deleted:
+                notify_task_event(cur, user_id, 'delete', task_id)
+            conn.commit()
+            cur.close()
+        return deleted
+
+    def toggle_task(self, user_id, task_id, today=None, version=None):
+        # Never reads before writing: the UPDATE takes the row lock, which the
+        # transaction keeps until the successor is claimed
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(TOGGLE_SQL, {'id': task_id, 'user_id': user_id, 'version': version})
+            toggled = self._written(conn, cur, user_id, task_id, version)
+            if toggled is None:
+                conn.commit()
+                cur.close()
+                return None
+            if toggled['completed'] and not toggled['rolled_over'] and toggled['frequency'] in FREQUENCY_DAYS:
+                cur.execute(SPAWN_SQL, {'ids': [task_id], 'today': today or date.today()})
+                for row in cur.fetchall():
+                    notify_task_event(cur, user_id, 'create', row['id'])
+                    # Claiming the successor wrote the row once more
+                    toggled['version'] += 1
+            notify_task_event(cur, user_id, 'toggle', task_id)
+            conn.commit()
+            cur.close()
+        return {'id': toggled['id'], 'completed': toggled['completed'], 'version': toggled['version']}
+
+    def apply_batch(self, user_id, operations, today=None):
+        results = []
+        with self._connection() as conn:
+            cur = conn.cursor()
+            for operation in operations:
+                ids = operation['ids']
+                versions = operation['versions'] or [None] * len(ids)
+                cur.execute(BATCH_SQL[operation['op']], dict(operation, user_id=user_id, versions=versions))
+                written = sorted(row['id'] for row in cur.fetchall())
+                if operation['versions'] is not None and len(written) < len(ids):
+                    with conn.cursor(cursor_factory=TaskCursor) as tasks:
+                        tasks.execute(UNWRITTEN_SQL, (user_id, ids, written))
+                        current = tasks.fetchall()
+                    if current:
+                        conn.rollback()
+                        cur.close()
+                        raise BatchConflict(current)
+                if operation['op'] == 'complete':
+                    cur.execute(SPAWN_SQL, {'ids': written, 'today': today or date.today()})
+                    notify_task_events(cur, user_id, 'create', [row['id'] for row in cur.fetchall()])
+                notify_task_events(cur, user_id, BATCH_EVENTS[operation['op']], written)
+                results.append(written)
+            cur.execute('SELECT id, version FROM tasks WHERE id = ANY(%s)', (sorted({i for ids in results for i in ids}),))
+            versions = {row['id']: row['version'] for row in cur.fetchall()}
+            conn.commit()
+            cur.close()
+        return results, versions
+
+    def load_board(self, user_id, cursors=None, hide_completed=False, page_size=25):
+        return self._read(load_board, user_id, cursors, hide_completed, page_size, cursor_factory=TupleCursor)
+
+    def suggested_tasks(self, user_id, today, open_only=False):
+        return self._read(suggested_tasks, user_id, today, open_only, cursor_factory=TaskCursor)
+
+    def load_checkin(self, user_id, today):
+        return self._read(load_checkin, user_id, today, cursor_factory=TaskCursor)
+
+    def search_tasks(self, user_id, text, after=None, limit=20):
+        return self._read(search_tasks, user_id, text, after, limit, cursor_factory=TaskCursor)
+
+    def report_page(self, user_id, start_date=None, end_date=None, after=None, limit=200):
+        query, params = report_query(user_id, start_date, end_date, decode_cursor(after), limit + 1)
+        return ReportPage(self._connection, query, params, limit)
+
+    def report_summary(self, user_id, start_date=None, end_date=None):
+        return self._read(load_summary, user_id, start_date, end_date)
+
+    def rollover_recurring_tasks(self, today=None, chunk_size=500):
+        with self._connection() as conn:
+            return rollover_recurring_tasks(conn, today, chunk_size)
+
+
+def repository_from_env():
+    # STORAGE_BACKEND=sqlite keeps everything in SQLITE_PATH instead of PostgreSQL
+    backend = os.getenv("STORAGE_BACKEND", "postgres")
+    if backend == 'sqlite':
+        from sqlite_repository import SQLiteRepository
+        return SQLiteRepository(os.getenv("SQLITE_PATH", "eisenhower.db"))
+    if backend != 'postgres':
+        raise ValueError("STORAGE_BACKEND must be postgres or sqlite, not %r" % backend)
+    return PostgresRepository()
@@ -0,0 +1,57 @@
+import re
+
+from cursors import InvalidCursor, check_id
+from models import COLUMNS
+
+
+# Matches each word of the query as a prefix ("pla rep" finds "Plan report"),
+# ranked by ts_rank against tasks.search_vector (kept current by a trigger and
+# served by a GIN index). Pages continue below the last (rank, id) shown.
+SEARCH_SQL = '''
+    SELECT {columns}, ts_rank(search_vector, query) AS rank
+    FROM tasks, to_tsquery('simple', %(query)s) AS query
+    WHERE user_id = %(user_id)s AND search_vector @@ query
+        AND (%(after_id)s::int IS NULL OR (ts_rank(search_vector, query), id) < (%(after_rank)s::real, %(after_id)s::int))
+    ORDER BY rank DESC, id DESC
+    LIMIT %(limit)s
+'''.format(columns=', '.join('tasks.' + column for column in COLUMNS))
+
+CURSOR_RE = re.compile(r'^(\d+(?:\.\d+)?(?:e-?\d+)?)_(\d+)$')
+
+
+def prefix_query(text):
+    # 'Plan rep' -> 'plan:* & rep:*'; None when there is nothing to search for
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    return ' & '.join(term + ':*' for term in terms)
+
+
+def encode_cursor(task):
+    return '%r_%d' % (task.rank, task.id)
+
+
+def decode_cursor(value):
+    # (rank, id), or (None, None) for the first page; raises InvalidCursor
+    if not value:
+        return None, None
+    match = CURSOR_RE.match(value)
+    if not match:
+        raise InvalidCursor(value)
+    return float(match.group(1)), check_id(match.group(2))
+
+
+def search_tasks(cur, user_id, text, after=None, limit=20):
+    # Returns (tasks, next cursor or None)
+    query = prefix_query(text)
+    if query is None:
+        return [], None
+    after_rank, after_id = decode_cursor(after)
+    cur.execute(SEARCH_SQL, {
+        'user_id': user_id, 'query': query, 'after_rank': after_rank, 'after_id': after_id, 'limit': limit + 1,
+    })
+    tasks = cur.fetchall()
+    if len(tasks) > limit:
+        del tasks[limit:]
+        return tasks, encode_cursor(tasks[-1])
+    return tasks, None
@@ -0,0 +1,549 @@
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from board import QUADRANTS, decode_cursor as decode_board_cursor, encode_cursor as encode_board_cursor
+from models import COLUMNS, COLUMNS_SQL, row_maker
+from priority import SUGGESTED_DIVISOR
+from recurrence import FREQUENCY_DAYS, next_due_date
+from reports import (checkin_dashboard, decode_cursor as decode_report_cursor, encode_cursor as encode_report_cursor,
+                     summary_dashboard)
+from repository import TASK_FIELDS, BatchConflict, Conflict, TaskRepository
+from search import decode_cursor as decode_search_cursor, encode_cursor as encode_search_cursor
+
+
+# Embedded storage for single-node deployments and tests: one file, no server.
+# WAL lets readers run alongside the single writer; writes take the lock up
+# front (BEGIN IMMEDIATE) so busy_timeout, not a deadlock error, settles
+# contention. Dates and timestamps are stored as ISO text, which sorts
+# chronologically, and come back as date/datetime like psycopg2's.
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    # Durable at each checkpoint rather than each commit; WAL keeps the file consistent
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16384',
+    'PRAGMA mmap_size = 268435456',
+)
+
+# Microseconds always written out, so stored values and cursors compare as text
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime')"
+
+# (version, statements), applied in order and tracked in PRAGMA user_version
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            password TEXT NOT NULL,
+            data_version INTEGER NOT NULL DEFAULT 0,
+            data_changed_at TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            urgency TEXT NOT NULL,
+            importance TEXT NOT NULL,
+            due_date TEXT,
+            impact INTEGER DEFAULT 5,
+            frequency TEXT DEFAULT 'none',
+            completed INTEGER NOT NULL DEFAULT 0,
+            rolled_over INTEGER NOT NULL DEFAULT 0,
+            user_id TEXT NOT NULL REFERENCES users(id),
+            created_at TEXT NOT NULL DEFAULT ({now}),
+            completed_at TEXT
+        )'''.format(now=NOW_SQL),
+        # Board pages, in the board's sort order
+        '''CREATE INDEX IF NOT EXISTS tasks_board_idx
+            ON tasks (user_id, urgency, importance, COALESCE(due_date, '9999-12-31'), id)''',
+        # Check-in, suggestions and the report
+        'CREATE INDEX IF NOT EXISTS tasks_user_completed_due_idx ON tasks (user_id, completed, due_date)',
+        'CREATE INDEX IF NOT EXISTS tasks_user_completed_created_idx ON tasks (user_id, completed, created_at)',
+        '''CREATE TRIGGER IF NOT EXISTS tasks_completed_at_insert AFTER INSERT ON tasks
+            WHEN NEW.completed AND NEW.completed_at IS NULL
+            BEGIN
+                UPDATE tasks SET completed_at = {now} WHERE id = NEW.id;
+            END'''.format(now=NOW_SQL),
+        '''CREATE TRIGGER IF NOT EXISTS tasks_completed_at_update AFTER UPDATE OF completed ON tasks
+            WHEN NEW.completed IS NOT OLD.completed
+            BEGIN
+                UPDATE tasks SET completed_at = CASE WHEN NEW.completed THEN {now} END WHERE id = NEW.id;
+            END'''.format(now=NOW_SQL),
+        # Same contract as the PostgreSQL triggers in migrations.py
+        '''CREATE TRIGGER IF NOT EXISTS tasks_data_version_insert AFTER INSERT ON tasks
+            BEGIN
+                UPDATE users SET data_version = data_version + 1, data_changed_at = {now} WHERE id = NEW.user_id;
+            END'''.format(now=NOW_SQL),
+        '''CREATE TRIGGER IF NOT EXISTS tasks_data_version_update AFTER UPDATE ON tasks
+            BEGIN
+                UPDATE users SET data_version = data_version + 1, data_changed_at = {now} WHERE id = NEW.user_id;
+            END'''.format(now=NOW_SQL),
+        '''CREATE TRIGGER IF NOT EXISTS tasks_data_version_delete AFTER DELETE ON tasks
+            BEGIN
+                UPDATE users SET data_version = data_version + 1, data_changed_at = {now} WHERE id = OLD.user_id;
+            END'''.format(now=NOW_SQL),
+        # Title search, kept in step with tasks by the triggers below
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_search USING fts5(title, content='tasks', content_rowid='id')",
+        '''CREATE TRIGGER IF NOT EXISTS tasks_search_insert AFTER INSERT ON tasks
+            BEGIN
+                INSERT INTO tasks_search (rowid, title) VALUES (NEW.id, NEW.title);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS tasks_search_delete AFTER DELETE ON tasks
+            BEGIN
+                INSERT INTO tasks_search (tasks_search, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS tasks_search_update AFTER UPDATE OF title ON tasks
+            BEGIN
+                INSERT INTO tasks_search (tasks_search, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+                INSERT INTO tasks_search (rowid, title) VALUES (NEW.id, NEW.title);
+            END''',
+    ]),
+    # Bumped by every UPDATE the repository runs, for optimistic concurrency
+    (2, [
+        'ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+    ]),
+]
+
+# The SQLite spelling of priority.PRIORITY_SQL
+PRIORITY_SQL = '''(
+    COALESCE(impact, 5) * CASE WHEN importance = 'important' THEN 1.0 ELSE 0.5 END
+    / MAX(COALESCE(julianday(due_date) - julianday(:today), 30), 1)
+)'''
+
+# Undated tasks sort last, as in PostgreSQL
+SORT_KEY_SQL = "COALESCE(due_date, '9999-12-31')"
+
+BOARD_COUNT_SQL = '''
+    SELECT COUNT(*) AS total FROM tasks
+    WHERE user_id = :user_id AND urgency = :urgency AND importance = :importance{filter}
+'''
+
+BOARD_PAGE_SQL = '''
+    SELECT {columns} FROM tasks
+    WHERE user_id = :user_id AND urgency = :urgency AND importance = :importance{filter}
+        AND (:after_id IS NULL OR ({sort_key}, id) > (:after_due, :after_id))
+    ORDER BY {sort_key}, id
+    LIMIT :limit
+'''
+
+SUGGESTED_SQL = '''
+    SELECT {columns}, {priority} AS priority FROM tasks
+    WHERE user_id = :user_id{filter}
+    ORDER BY priority DESC, due_date IS NULL, due_date, id
+    LIMIT (SELECT MAX(COUNT(*) / {divisor}, 1) FROM tasks WHERE user_id = :user_id{filter})
+'''
+
+CHECKIN_SQL = '''
+    SELECT {columns}, {priority} AS priority FROM tasks
+    WHERE user_id = :user_id
+        AND (completed = 0 OR (completed = 1 AND created_at >= :week_ago))
+    ORDER BY due_date IS NULL, due_date, id
+'''.format(columns=COLUMNS_SQL, priority=PRIORITY_SQL)
+
+# reports.SUMMARY_SQL without GROUPING SETS: the per-quadrant and per-week
+# counts as two groupings of the same range. 'weekday 0' moves to the
+# following Sunday (or stays on one), so six days back is the week's Monday,
+# as date_trunc('week') gives.
+SUMMARY_SQL = '''
+    SELECT urgency, importance, NULL AS week, 1 AS per_quadrant,
+        COUNT(*) AS total, SUM(completed) AS done
+    FROM tasks
+    WHERE user_id = :user_id{range}
+    GROUP BY urgency, importance
+    UNION ALL
+    SELECT NULL, NULL, date(created_at, 'weekday 0', '-6 days'), 0, COUNT(*), SUM(completed)
+    FROM tasks
+    WHERE user_id = :user_id{range}
+    GROUP BY 3
+'''
+
+# bm25() is lower for better matches; negated it ranks like ts_rank
+SEARCH_SQL = '''
+    SELECT * FROM (
+        SELECT {columns}, -bm25(tasks_search) AS rank
+        FROM tasks_search JOIN tasks ON tasks.id = tasks_search.rowid
+        WHERE tasks_search MATCH :query AND tasks.user_id = :user_id
+    )
+    WHERE :after_id IS NULL OR (rank, id) < (:after_rank, :after_id)
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit
+'''.format(columns=', '.join('tasks.' + column for column in COLUMNS))
+
+GET_TASK_SQL = 'SELECT %s FROM tasks WHERE id = ? AND user_id = ?' % COLUMNS_SQL
+
+PENDING_USERS_SQL = '''
+    SELECT DISTINCT user_id FROM tasks
+    WHERE frequency <> 'none' AND completed = 1 AND rolled_over = 0 AND user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+'''
+
+ROLLOVER_SQL = '''
+    INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id)
+    SELECT title, urgency, importance, date(COALESCE(due_date, :today), :days), impact, frequency, user_id
+    FROM tasks
+    WHERE user_id IN ({users}) AND frequency = :frequency AND completed = 1 AND rolled_over = 0
+'''
+
+# Run after ROLLOVER_SQL in the same transaction; the new rows are still open
+ROLLED_OVER_SQL = '''
+    UPDATE tasks SET rolled_over = 1, version = version + 1
+    WHERE user_id IN ({users}) AND frequency = :frequency AND completed = 1 AND rolled_over = 0
+'''
+
+# Batch operations (batch.py) over the ids in {ids}, after their versions were
+# checked under the write lock
+BATCH_SQL = {
+    'complete': '''
+        UPDATE tasks SET completed = 1, version = version + 1,
+            rolled_over = rolled_over OR (completed = 0 AND frequency IN ({frequencies}))
+        WHERE id IN ({ids})
+    ''',
+    'move': 'UPDATE tasks SET urgency = :urgency, importance = :importance, version = version + 1 WHERE id IN ({ids})',
+    'reschedule': 'UPDATE tasks SET due_date = :due_date, version = version + 1 WHERE id IN ({ids})',
+    'delete': 'DELETE FROM tasks WHERE id IN ({ids})',
+}
+
+# Successors of the recurring tasks a batch is about to complete
+BATCH_SPAWN_SQL = '''
+    INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id)
+    SELECT title, urgency, importance, date(COALESCE(due_date, :today), CASE frequency {days} END),
+        impact, frequency, user_id
+    FROM tasks
+    WHERE id IN ({ids}) AND completed = 0 AND rolled_over = 0 AND frequency IN ({frequencies})
+    ORDER BY id
+'''
+
+FREQUENCIES_SQL = ', '.join("'%s'" % frequency for frequency in FREQUENCY_DAYS)
+FREQUENCY_MODIFIER_SQL = ' '.join("WHEN '%s' THEN '+%d days'" % item for item in FREQUENCY_DAYS.items())
+
+CONVERTERS = {
+    'due_date': date.fromisoformat,
+    'created_at': datetime.fromisoformat,
+    'completed_at': datetime.fromisoformat,
+    'data_changed_at': datetime.fromisoformat,
+    'week': date.fromisoformat,
+    'completed': bool,
+    'rolled_over': bool,
+}
+
+
+def dict_row(cursor, values):
+    row = {}
+    for (name, *_), value in zip(cursor.description, values):
+        if value is not None and name in CONVERTERS:
+            value = CONVERTERS[name](value)
+        row[name] = value
+    return row
+
+
+def task_rows(cursor):
+    # Switches an executed cursor to rows as models.Task, converted as dict_row does
+    names = tuple(name for name, *_ in cursor.description)
+    make = row_maker(names)
+    converters = [(index, CONVERTERS[name]) for index, name in enumerate(names) if name in CONVERTERS]
+
+    def task_row(cursor, values):
+        if converters:
+            values = list(values)
+            for index, convert in converters:
+                if values[index] is not None:
+                    values[index] = convert(values[index])
+        return make(values)
+    cursor.row_factory = task_row
+    return cursor
+
+
+def to_sql(value):
+    # Form values arrive as strings already; dates and datetimes become ISO text
+    if isinstance(value, datetime):
+        return value.isoformat(' ', 'microseconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def match_query(text):
+    # 'Plan rep' -> '"plan"* "rep"*' (every word as a prefix); None when there is nothing to search for
+    terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+class SQLiteRepository(TaskRepository):
+    name = 'sqlite'
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        # sqlite3 connections may not cross threads, so each thread opens its own
+        self._local = threading.local()
+        self.migrate()
+        # Nothing stays open to be inherited by forked workers
+        self.close()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: transactions are opened explicitly below
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = dict_row
+            conn.execute('PRAGMA busy_timeout = %d' % (self.timeout * 1000))
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, write=False):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def migrate(self):
+        with self._transaction(write=True) as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()['user_version']
+            applied = []
+            for number, statements in MIGRATIONS:
+                if number > version:
+                    for statement in statements:
+                        conn.execute(statement)
+                    applied.append(number)
+            conn.execute('PRAGMA user_version = %d' % MIGRATIONS[-1][0])
+        return applied
+
+    def get_user(self, user_id):
+        return self._connection().execute(
+            'SELECT id, name, password FROM users WHERE id = ?', (user_id,)).fetchone()
+
+    def create_user(self, user_id, name, password_hash):
+        with self._transaction(write=True) as conn:
+            cur = conn.execute('INSERT OR IGNORE INTO users (id, name, password) VALUES (?, ?, ?)',
+                               (user_id, name, password_hash))
+            return cur.rowcount == 1
+
+    def data_version(self, user_id):
+        row = self._connection().execute('SELECT data_version FROM users WHERE id = ?', (user_id,)).fetchone()
+        return row['data_version'] if row else 0
+
+    def add_task(self, user_id, task):
+        with self._transaction(write=True) as conn:
+            cur = conn.execute(
+                'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                tuple(to_sql(task[field]) for field in TASK_FIELDS) + (user_id,)
+            )
+            return cur.lastrowid
+
+    def get_task(self, user_id, task_id):
+        return task_rows(self._connection().execute(GET_TASK_SQL, (task_id, user_id))).fetchone()
+
+    def _current(self, conn, user_id, task_id, version):
+        # Writes hold the database's write lock, so reading first is race-free
+        task = task_rows(conn.execute(GET_TASK_SQL, (task_id, user_id))).fetchone()
+        if task is not None and version is not None and task.version != version:
+            raise Conflict(task)
+        return task
+
+    def update_task(self, user_id, task_id, task, version=None):
+        with self._transaction(write=True) as conn:
+            if self._current(conn, user_id, task_id, version) is None:
+                return None
+            conn.execute(
+                'UPDATE tasks SET title = ?, urgency = ?, importance = ?, due_date = ?, impact = ?, frequency = ?, version = version + 1 WHERE id = ?',
+                tuple(to_sql(task[field]) for field in TASK_FIELDS) + (task_id,)
+            )
+            return conn.execute('SELECT id, version FROM tasks WHERE id = ?', (task_id,)).fetchone()
+
+    def delete_task(self, user_id, task_id):
+        with self._transaction(write=True) as conn:
+            return conn.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id)).rowcount == 1
+
+    def toggle_task(self, user_id, task_id, today=None, version=None):
+        with self._transaction(write=True) as conn:
+            task = self._current(conn, user_id, task_id, version)
+            if task is None:
+                return None
+            spawn = not task.completed and not task.rolled_over
+            new_due_date = next_due_date(task.frequency, task.due_date, today) if spawn else None
+            if new_due_date:
+                conn.execute(
+                    'INSERT INTO tasks (title, urgency, importance, due_date, impact, frequency, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (task.title, task.urgency, task.importance, to_sql(new_due_date), task.impact, task.frequency, user_id)
+                )
+            conn.execute('UPDATE tasks SET completed = NOT completed, rolled_over = rolled_over OR ?, version = version + 1 WHERE id = ?',
+                         (new_due_date is not None, task_id))
+            return conn.execute('SELECT id, completed, version FROM tasks WHERE id = ?', (task_id,)).fetchone()
+
+    def apply_batch(self, user_id, operations, today=None):
+        today = to_sql(today or date.today())
+        results = []
+        with self._transaction(write=True) as conn:
+            for operation in operations:
+                params = {'id%d' % i: task_id for i, task_id in enumerate(operation['ids'])}
+                ids = ', '.join(':' + name for name in params)
+                current = task_rows(conn.execute(
+                    'SELECT %s FROM tasks WHERE user_id = :user_id AND id IN (%s) ORDER BY id' % (COLUMNS_SQL, ids),
+                    dict(params, user_id=user_id))).fetchall()
+                if operation['versions'] is not None:
+                    expected = dict(zip(operation['ids'], operation['versions']))
+                    changed = [task for task in current if task.version != expected[task.id]]
+                    if changed:
+                        raise BatchConflict(changed)
+                written = [task.id for task in current]
+                params = {'id%d' % i: task_id for i, task_id in enumerate(written)}
+                ids = ', '.join(':' + name for name in params)
+                if operation['op'] == 'complete':
+                    conn.execute(BATCH_SPAWN_SQL.format(ids=ids, days=FREQUENCY_MODIFIER_SQL, frequencies=FREQUENCIES_SQL),
+                                 dict(params, today=today))
+                conn.execute(BATCH_SQL[operation['op']].format(ids=ids, frequencies=FREQUENCIES_SQL),
+                             dict(params, urgency=operation.get('urgency'), importance=operation.get('importance'),
+                                  due_date=to_sql(operation.get('due_date'))))
+                results.append(written)
+            params = {'id%d' % i: task_id for i, task_id in enumerate(sorted({i for ids in results for i in ids}))}
+            rows = conn.execute('SELECT id, version FROM tasks WHERE id IN (%s)' % ', '.join(':' + name for name in params),
+                                params).fetchall()
+        return results, {row['id']: row['version'] for row in rows}
+
+    def load_board(self, user_id, cursors=None, hide_completed=False, page_size=25):
+        # Two indexed queries per quadrant, read from one snapshot
+        cursors = cursors or {}
+        filter_ = ' AND completed = 0' if hide_completed else ''
+        count_sql = BOARD_COUNT_SQL.format(filter=filter_)
+        page_sql = BOARD_PAGE_SQL.format(columns=COLUMNS_SQL, filter=filter_, sort_key=SORT_KEY_SQL)
+        board = []
+        with self._transaction() as conn:
+            for key, urgency, importance, label, css in QUADRANTS:
+                after_due, after_id = decode_board_cursor(cursors.get(key))
+                params = {
+                    'user_id': user_id, 'urgency': urgency, 'importance': importance, 'limit': page_size + 1,
+                    'after_due': '9999-12-31' if after_due == 'infinity' else after_due, 'after_id': after_id,
+                }
+                tasks = task_rows(conn.execute(page_sql, params)).fetchall()
+                quadrant = {
+                    'key': key, 'urgency': urgency, 'importance': importance, 'label': label, 'css': css,
+                    'tasks': tasks, 'total': conn.execute(count_sql, params).fetchone()['total'],
+                    'next_cursor': None, 'paged': bool(cursors.get(key)),
+                }
+                if len(tasks) > page_size:
+                    del tasks[page_size:]
+                    quadrant['next_cursor'] = encode_board_cursor(tasks[-1])
+                board.append(quadrant)
+        return board
+
+    def suggested_tasks(self, user_id, today, open_only=False):
+        query = SUGGESTED_SQL.format(
+            columns=COLUMNS_SQL,
+            priority=PRIORITY_SQL,
+            divisor=SUGGESTED_DIVISOR,
+            filter=' AND completed = 0' if open_only else '',
+        )
+        return task_rows(self._connection().execute(query, {'user_id': user_id, 'today': to_sql(today)})).fetchall()
+
+    def load_checkin(self, user_id, today):
+        week_ago = today - timedelta(days=7)
+        tasks = task_rows(self._connection().execute(CHECKIN_SQL, {
+            'user_id': user_id, 'today': to_sql(today), 'week_ago': to_sql(week_ago),
+        })).fetchall()
+        return checkin_dashboard(tasks, today)
+
+    def search_tasks(self, user_id, text, after=None, limit=20):
+        query = match_query(text)
+        if query is None:
+            return [], None
+        after_rank, after_id = decode_search_cursor(after)
+        tasks = task_rows(self._connection().execute(SEARCH_SQL, {
+            'user_id': user_id, 'query': query, 'after_rank': after_rank, 'after_id': after_id, 'limit': limit + 1,
+        })).fetchall()
+        if len(tasks) > limit:
+            del tasks[limit:]
+            return tasks, encode_search_cursor(tasks[-1])
+        return tasks, None
+
+    def report_page(self, user_id, start_date=None, end_date=None, after=None, limit=200):
+        query = 'SELECT %s FROM tasks WHERE user_id = ? AND completed = 1' % COLUMNS_SQL
+        params = [user_id]
+        if start_date:
+            query += ' AND created_at >= ?'
+            params.append(to_sql(start_date))
+        if end_date:
+            query += ' AND created_at <= ?'
+            params.append(to_sql(end_date))
+        after = decode_report_cursor(after)
+        if after:
+            query += ' AND (created_at, id) < (?, ?)'
+            params.extend(to_sql(value) for value in after)
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        return ReportRows(self._connection, query, params, limit)
+
+    def report_summary(self, user_id, start_date=None, end_date=None):
+        conditions, params = '', {'user_id': user_id}
+        if start_date:
+            conditions += ' AND created_at >= :start_date'
+            params['start_date'] = to_sql(start_date)
+        if end_date:
+            conditions += ' AND created_at <= :end_date'
+            params['end_date'] = to_sql(end_date)
+        rows = self._connection().execute(SUMMARY_SQL.format(range=conditions), params).fetchall()
+        # Counted as done, since a column named completed is read back as a bool
+        return summary_dashboard([dict(row, completed=row['done']) for row in rows])
+
+    def rollover_recurring_tasks(self, today=None, chunk_size=500):
+        # Chunked like the PostgreSQL job, since each write transaction holds
+        # the database's single write lock
+        today = to_sql(today or date.today())
+        created = 0
+        last_user_id = ''
+        while True:
+            with self._transaction(write=True) as conn:
+                user_ids = [row['user_id'] for row in conn.execute(PENDING_USERS_SQL, (last_user_id, chunk_size))]
+                if not user_ids:
+                    break
+                users = ', '.join(':user%d' % i for i in range(len(user_ids)))
+                params = {'user%d' % i: user_id for i, user_id in enumerate(user_ids)}
+                for frequency, days in FREQUENCY_DAYS.items():
+                    cur = conn.execute(ROLLOVER_SQL.format(users=users),
+                                       dict(params, today=today, frequency=frequency, days='+%d days' % days))
+                    created += cur.rowcount
+                    conn.execute(ROLLED_OVER_SQL.format(users=users), dict(params, frequency=frequency))
+            last_user_id = user_ids[-1]
+        return created
+
+
+class ReportRows:
+    # reports.ReportPage for SQLite; the cursor already steps through rows lazily
+    def __init__(self, connect, query, params, limit):
+        self._connect = connect
+        self._query = query
+        self._params = params
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        cur = task_rows(self._connect().execute(self._query, self._params))
+        try:
+            last = None
+            for count, task in enumerate(cur, 1):
+                if count > self.limit:
+                    self.next_cursor = encode_report_cursor(last)
+                    break
+                last = task
+                yield task
+        finally:
+            cur.close()
@@ -1,16 +1,31 @@
 // static/script.js
+// Open tasks from the JSON API. "no-cache" makes the browser revalidate its
+// copy with the ETag, so an unchanged board costs a 304 with no body.
+async function getTasks() {
+  const response = await fetch(
+    "/api/v1/tasks?completed=false&fields=id,title,due_date",
+    { cache: "no-cache", credentials: "same-origin" }
+  );
+  if (!response.ok) return [];
+  return (await response.json()).tasks;
+}
+
+const notifiedTaskIds = new Set();
+
 function checkForNotifications() {
-  // Assume we have a function to get tasks from the server
   getTasks().then((tasks) => {
     const now = new Date();
     tasks.forEach((task) => {
+      if (notifiedTaskIds.has(task.id)) return;
       if (task.due_date && new Date(task.due_date) < now) {
+        notifiedTaskIds.add(task.id);
         showNotification(`Task "${task.title}" is overdue!`);
       } else if (task.due_date) {
         const dueDate = new Date(task.due_date);
         const diff = dueDate - now;
         if (diff < 24 * 60 * 60 * 1000) {
           // Less than a day left
+          notifiedTaskIds.add(task.id);
           showNotification(`Task "${task.title}" is due in less than a day!`);
         }
       }
@@ -22,6 +37,27 @@ function showNotification(message) {
   alert(message); // Or use a more sophisticated notification method
 }
 // static/script.js
+// Typeahead for the navbar search box
+const searchBox = document.getElementById("search-box");
+if (searchBox) {
+  let pending;
+  searchBox.addEventListener("input", () => {
+    clearTimeout(pending);
+    pending = setTimeout(async () => {
+      const q = searchBox.value.trim();
+      if (!q) return;
+      const response = await fetch(`/search/suggest?q=${encodeURIComponent(q)}`);
+      const list = document.getElementById("search-suggestions");
+      list.innerHTML = "";
+      (await response.json()).forEach((task) => {
+        const option = document.createElement("option");
+        option.value = task.title;
+        list.appendChild(option);
+      });
+    }, 150);
+  });
+}
+
 async function subscribeToPush() {
   const registration = await navigator.serviceWorker.ready;
   const subscription = await registration.pushManager.subscribe({
@@ -39,4 +75,219 @@ if ("PushManager" in window) {
   subscribeToPush();
 }
 
-window.setInterval(checkForNotifications, 60000); // Check every minute
+// Live updates: while /events is connected, task changes arrive as they
+// happen and polling is paused. A 204 (streams disabled) or a dropped
+// connection falls back to checking every minute.
+let pollTimer = null;
+
+function startPolling() {
+  if (pollTimer === null) {
+    pollTimer = window.setInterval(checkForNotifications, 60000); // Check every minute
+  }
+}
+
+function stopPolling() {
+  window.clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+if ("EventSource" in window) {
+  const events = new EventSource("/events");
+  events.onopen = stopPolling;
+  events.onerror = startPolling;
+  events.addEventListener("task", () => {
+    checkForNotifications();
+    syncTasks().catch(() => {});
+    const banner = document.getElementById("live-update");
+    if (banner) banner.classList.remove("d-none");
+  });
+}
+
+startPolling();
+
+// Board batch edits: every change is one POST to /tasks/batch, applied in a
+// single transaction. Each task carries the version it was rendered with, so
+// a stale board is refused (409) instead of overwriting newer edits. Offline,
+// edits are queued (sync.js) and the board is redrawn from the local copy.
+function selectedTasks(dragged) {
+  const items = Array.from(document.querySelectorAll("li[data-task-id]")).filter(
+    (li) => li.querySelector(".task-select").checked
+  );
+  if (dragged && !items.includes(dragged)) return [dragged];
+  return items;
+}
+
+async function sendBatch(operation, items) {
+  if (!items.length) return;
+  operation.ids = items.map((li) => Number(li.dataset.taskId));
+  operation.versions = items.map((li) => Number(li.dataset.version));
+  let response;
+  try {
+    if (!navigator.onLine) throw new TypeError("offline");
+    response = await fetch("/tasks/batch", {
+      method: "POST",
+      credentials: "same-origin",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ operations: [operation] }),
+    });
+  } catch (error) {
+    if (!(await queueBatch(operation))) throw error;
+    renderBoard();
+    return;
+  }
+  if (response.status === 409) {
+    alert("Some of these tasks were changed somewhere else. The board will reload.");
+  } else if (!response.ok) {
+    alert((await response.json()).error);
+    return;
+  }
+  window.location.reload();
+}
+
+function compareTasks(a, b) {
+  // The board's order: due date, undated last, then id
+  const dueA = a.due_date || "9999-12-31";
+  const dueB = b.due_date || "9999-12-31";
+  return dueA < dueB ? -1 : dueA > dueB ? 1 : a.id - b.id;
+}
+
+async function renderBoard() {
+  // Redraws the quadrants from IndexedDB, for when the server can't
+  if (!taskStore) return;
+  const tasks = (await localTasks()).sort(compareTasks);
+  const today = new Date().toISOString().slice(0, 10);
+  document.querySelectorAll(".quadrant[data-quadrant]").forEach((panel) => {
+    const [urgency, importance] = QUADRANT_COLUMNS[panel.dataset.quadrant];
+    const list = panel.querySelector("ul");
+    list.innerHTML = "";
+    tasks
+      .filter((task) => task.urgency === urgency && task.importance === importance)
+      .forEach((task) => {
+        const li = document.createElement("li");
+        li.draggable = true;
+        li.dataset.taskId = task.id;
+        li.dataset.version = task.version;
+        if (task.completed) li.className = "completed";
+        else if (task.due_date && task.due_date < today) li.className = "overdue";
+        const checkbox = document.createElement("input");
+        checkbox.type = "checkbox";
+        checkbox.className = "task-select";
+        li.append(checkbox, ` ${task.title}${task.due_date ? ` (Due: ${task.due_date})` : ""} `);
+        // The same links as _quadrant.html; the click handler below decides
+        // what they can do offline
+        [
+          [`/edit_task/${task.id}`, "Edit", "btn-warning"],
+          [`/delete_task/${task.id}`, "Delete", "btn-danger"],
+          [`/toggle_task/${task.id}?version=${task.version}`, task.completed ? "Undo" : "Done", "btn-success"],
+        ].forEach(([href, label, css]) => {
+          const link = document.createElement("a");
+          link.href = href;
+          link.className = `btn btn-sm ${css}`;
+          link.textContent = label;
+          li.append(link, " ");
+        });
+        list.appendChild(li);
+      });
+    // Paging links point at server pages, which need a connection
+    panel.querySelectorAll("a").forEach((link) => link.remove());
+  });
+}
+
+let draggedTask = null;
+
+document.addEventListener("dragstart", (event) => {
+  draggedTask = event.target.closest && event.target.closest("li[data-task-id]");
+  if (draggedTask) event.dataTransfer.effectAllowed = "move";
+});
+document.addEventListener("dragend", () => {
+  draggedTask = null;
+});
+
+document.querySelectorAll(".quadrant[data-quadrant]").forEach((panel) => {
+  panel.addEventListener("dragover", (event) => {
+    if (!draggedTask || panel.contains(draggedTask)) return;
+    event.preventDefault();
+    panel.classList.add("drop-target");
+  });
+  panel.addEventListener("dragleave", () => panel.classList.remove("drop-target"));
+  panel.addEventListener("drop", (event) => {
+    event.preventDefault();
+    panel.classList.remove("drop-target");
+    const items = selectedTasks(draggedTask).filter((li) => !panel.contains(li));
+    sendBatch({ op: "move", quadrant: panel.dataset.quadrant }, items);
+  });
+});
+
+document.querySelectorAll("#batch-toolbar [data-batch]").forEach((button) => {
+  button.addEventListener("click", () => {
+    const operation = { op: button.dataset.batch };
+    if (operation.op === "reschedule") {
+      operation.due_date = document.getElementById("batch-due-date").value || null;
+    }
+    const items = selectedTasks();
+    if (operation.op === "delete" && items.length && !confirm(`Delete ${items.length} tasks?`)) return;
+    sendBatch(operation, items);
+  });
+});
+
+// Offline, a task's Done and Delete are queued like the board's batch edits.
+// Undo, Edit and Add Task need the server, and so does every form.
+function needsConnection() {
+  alert("You are offline. This needs a connection, so try again once you are back online.");
+}
+
+document.addEventListener("click", (event) => {
+  if (navigator.onLine || !event.target.closest) return;
+  const link = event.target.closest("a[href]");
+  if (!link || link.origin !== window.location.origin) return;
+  const li = link.closest("li[data-task-id]");
+  const action = link.pathname.split("/")[1];
+  if (!li && action !== "add_task") return;
+  event.preventDefault();
+  if (li && taskStore && action === "delete_task") {
+    sendBatch({ op: "delete" }, [li]).catch(needsConnection);
+  } else if (li && taskStore && action === "toggle_task" && !li.classList.contains("completed")) {
+    sendBatch({ op: "complete" }, [li]).catch(needsConnection);
+  } else {
+    needsConnection();
+  }
+});
+
+document.addEventListener("submit", (event) => {
+  if (navigator.onLine) return;
+  event.preventDefault();
+  needsConnection();
+});
+
+// Catching up: queued edits go first, then the deltas since the last sync.
+// Edits the server refused are listed for the user, since the board they
+// come back to shows the server's version instead. A board served from the
+// offline cache is drawn from the local copy.
+async function catchUp() {
+  const replay = await replayOutbox();
+  await syncTasks();
+  if (replay.refused.length) {
+    const edits = replay.refused.map(({ operation, titles }) => `${operation.op}: ${titles.join(", ") || "(deleted task)"}`);
+    alert(
+      "These changes made offline were not saved, because the tasks were changed or removed somewhere else:\n\n" +
+        edits.join("\n")
+    );
+  }
+  return replay.sent + replay.refused.length;
+}
+
+if (taskStore) {
+  if (navigator.onLine) {
+    catchUp().catch(() => {});
+  } else {
+    renderBoard();
+  }
+  window.addEventListener("online", () => {
+    catchUp()
+      .then((replayed) => {
+        if (replayed) window.location.reload();
+      })
+      .catch(() => {});
+  });
+  window.addEventListener("offline", renderBoard);
+}
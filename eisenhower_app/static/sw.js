@@ -1,24 +1,12 @@
 // static/sw.js
-self.addEventListener("install", (e) => {
+// The service worker moved to /sw.js (scope /). Browsers that registered this
+// one re-fetch it on their next visit, so it removes itself and its cache.
+self.addEventListener("install", () => self.skipWaiting());
+
+self.addEventListener("activate", (e) => {
   e.waitUntil(
     caches
-      .open("prioritymaster-v1")
-      .then((cache) =>
-        cache.addAll(["/", "/static/style.css", "/static/script.js"])
-      )
-  );
-});
-
-self.addEventListener("fetch", (e) => {
-  e.respondWith(
-    caches.match(e.request).then((response) => response || fetch(e.request))
+      .delete("prioritymaster-v1")
+      .then(() => self.registration.unregister())
   );
 });
-
-self.addEventListener("push", (e) => {
-  const data = e.data.json();
-  self.registration.showNotification(data.title, {
-    body: data.body,
-    icon: "/static/icon.png",
-  });
-});
@@ -0,0 +1,180 @@
+// static/sync.js
+// Offline mode. The user's tasks are kept in IndexedDB and brought up to date
+// from /api/sync, which sends only what changed since the last cursor. Batch
+// edits made while offline (including a task's Done and Delete) wait in an
+// outbox and are replayed, oldest first, on reconnect. One the server refuses
+// (409: the tasks changed elsewhere) is taken off the queue and reported to
+// the user, and the next sync brings the server's version. Needs the JSON
+// API, so PostgreSQL.
+const syncUser = document.body.dataset.syncUser;
+
+// Quadrant keys as in board.py
+const QUADRANT_COLUMNS = {
+  do: ["urgent", "important"],
+  plan: ["not urgent", "important"],
+  delegate: ["urgent", "not important"],
+  eliminate: ["not urgent", "not important"],
+};
+
+function requestResult(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function transactionDone(tx) {
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = resolve;
+    tx.onerror = tx.onabort = () => reject(tx.error);
+  });
+}
+
+function openTaskStore() {
+  // One database per user, so a shared browser never mixes accounts
+  const request = indexedDB.open(`prioritymaster-${syncUser}`, 1);
+  request.onupgradeneeded = () => {
+    const db = request.result;
+    db.createObjectStore("tasks", { keyPath: "id" });
+    db.createObjectStore("meta");
+    db.createObjectStore("outbox", { autoIncrement: true });
+  };
+  return requestResult(request);
+}
+
+const taskStore = syncUser && "indexedDB" in window ? openTaskStore() : null;
+
+// Calls made while a sync is running share one follow-up sync
+let syncRunning = null;
+let syncAgain = false;
+
+function syncTasks() {
+  if (!taskStore) return Promise.resolve(false);
+  if (syncRunning) {
+    syncAgain = true;
+    return syncRunning;
+  }
+  syncRunning = pullChanges().finally(() => {
+    syncRunning = null;
+    if (syncAgain) {
+      syncAgain = false;
+      syncTasks().catch(() => {});
+    }
+  });
+  return syncRunning;
+}
+
+async function pullChanges() {
+  const db = await taskStore;
+  let cursor = await requestResult(db.transaction("meta").objectStore("meta").get("cursor"));
+  for (;;) {
+    const query = cursor ? `?since=${encodeURIComponent(cursor)}` : "";
+    const response = await fetch(`/api/sync${query}`, { credentials: "same-origin" });
+    if (!response.ok) return false;
+    const changes = await response.json();
+    const tx = db.transaction(["tasks", "meta"], "readwrite");
+    const tasks = tx.objectStore("tasks");
+    if (changes.reset) tasks.clear();
+    changes.tasks.forEach((task) => tasks.put(task));
+    changes.deleted.forEach((id) => tasks.delete(id));
+    tx.objectStore("meta").put(changes.cursor, "cursor");
+    await transactionDone(tx);
+    cursor = changes.cursor;
+    if (!changes.more) return true;
+  }
+}
+
+async function queueBatch(operation) {
+  // Keeps an edit for replay and applies it to the local copy; false when
+  // there is no local copy to work from. Versions are left as the server
+  // last sent them: the edit carries what the user saw, and replayOutbox
+  // moves it on past any earlier queued edit to the same task.
+  if (!taskStore) return false;
+  const db = await taskStore;
+  const tx = db.transaction(["tasks", "outbox"], "readwrite");
+  const tasks = tx.objectStore("tasks");
+  const titles = [];
+  for (const id of operation.ids) {
+    const task = await requestResult(tasks.get(id));
+    if (!task) continue;
+    titles.push(task.title);
+    if (operation.op === "delete") {
+      tasks.delete(id);
+      continue;
+    }
+    if (operation.op === "complete") task.completed = true;
+    if (operation.op === "move") [task.urgency, task.importance] = QUADRANT_COLUMNS[operation.quadrant];
+    if (operation.op === "reschedule") task.due_date = operation.due_date;
+    tasks.put(task);
+  }
+  tx.objectStore("outbox").add({ operation, titles });
+  await transactionDone(tx);
+  return true;
+}
+
+async function replayOutbox() {
+  // Sends queued edits oldest first. Returns {sent, refused}, refused being
+  // the queued entries the server turned down (a 4xx such as 409). An edit
+  // stays queued until the server has answered it with JSON: a redirect
+  // (the session expired, so /login), a 5xx or no connection stops the
+  // replay with the rest kept for next time.
+  const result = { sent: 0, refused: [] };
+  if (!taskStore) return result;
+  const db = await taskStore;
+  const tx = db.transaction(["outbox", "meta"]);
+  const [keys, entries, moved] = await Promise.all([
+    requestResult(tx.objectStore("outbox").getAllKeys()),
+    requestResult(tx.objectStore("outbox").getAll()),
+    requestResult(tx.objectStore("meta").get("replayed")),
+  ]);
+  // id -> [version the queued edits saw, version the server reported after
+  // the last of them was replayed], so a later queued edit to the same task
+  // is sent with the version our own writes left rather than refused as
+  // stale. Kept in meta until the outbox is empty, in case the replay stops
+  // part way.
+  const replayed = moved || {};
+  for (let i = 0; i < keys.length; i++) {
+    const operation = entries[i].operation;
+    const queued = operation.versions;
+    if (queued) {
+      operation.versions = operation.ids.map((id, n) =>
+        replayed[id] && replayed[id][0] === queued[n] ? replayed[id][1] : queued[n]
+      );
+    }
+    let response;
+    try {
+      response = await fetch("/tasks/batch", {
+        method: "POST",
+        credentials: "same-origin",
+        redirect: "manual",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ operations: [operation] }),
+      });
+    } catch (error) {
+      break;
+    }
+    const json = (response.headers.get("Content-Type") || "").startsWith("application/json");
+    if (response.ok && json) {
+      const body = await response.json();
+      body.tasks.forEach((task) => {
+        replayed[task.id] = [queued ? queued[operation.ids.indexOf(task.id)] : null, task.version];
+      });
+      result.sent++;
+    } else if (response.status >= 400 && response.status < 500 && json) {
+      result.refused.push(entries[i]);
+    } else {
+      break;
+    }
+    const done = db.transaction(["outbox", "meta"], "readwrite");
+    done.objectStore("outbox").delete(keys[i]);
+    if (i === keys.length - 1) done.objectStore("meta").delete("replayed");
+    else done.objectStore("meta").put(replayed, "replayed");
+    await transactionDone(done);
+  }
+  return result;
+}
+
+async function localTasks() {
+  const db = await taskStore;
+  return requestResult(db.transaction("tasks").objectStore("tasks").getAll());
+}
@@ -0,0 +1,104 @@
+import re
+import time
+
+from cursors import MAX_INT
+
+
+# Delta sync for offline clients (GET /api/sync). Every task row carries the
+# transaction that last wrote it (tasks.change_xid) and deleted tasks leave a
+# tombstone in task_deletions. A client's cursor is the oldest transaction
+# that was still running when it last synced, so anything committed after
+# that is sent next time, at the price of resending the few rows written by
+# transactions that were in flight. Rows come in (change_xid, id) order, in
+# pages that continue from the last row sent.
+
+# What a client stores for each task
+SYNC_FIELDS = ('id', 'title', 'urgency', 'importance', 'due_date', 'impact', 'frequency', 'completed', 'version')
+
+SYNC_SQL = '''
+    (SELECT change_xid, id, FALSE AS deleted, {columns} FROM tasks
+     WHERE user_id = %(user_id)s AND (change_xid, id) > (%(after_xid)s::xid8, %(after_id)s)
+     ORDER BY change_xid, id LIMIT %(limit)s)
+    UNION ALL
+    (SELECT change_xid, task_id, TRUE, {nulls} FROM task_deletions
+     WHERE user_id = %(user_id)s AND (change_xid, task_id) > (%(after_xid)s::xid8, %(after_id)s)
+     ORDER BY change_xid, task_id LIMIT %(limit)s)
+    ORDER BY change_xid, id
+    LIMIT %(limit)s
+'''.format(columns=', '.join(SYNC_FIELDS[1:]), nulls=', '.join(['NULL'] * (len(SYNC_FIELDS) - 1)))
+
+HORIZON_SQL = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin'
+
+PRUNE_SQL = 'DELETE FROM task_deletions WHERE deleted_at < now() - make_interval(days => %s)'
+
+# since-issued, or since-issued-xid-id while a sync is paging
+CURSOR_RE = re.compile(r'^(\d+)-(\d+)(?:-(\d+)-(\d+))?$')
+# xid8 is an unsigned 64-bit counter
+MAX_XID = 2 ** 64 - 1
+
+
+def encode_cursor(since, issued, after=None):
+    cursor = '%d-%d' % (since, issued)
+    if after:
+        cursor += '-%d-%d' % after
+    return cursor
+
+
+def decode_cursor(value):
+    # (since, issued, (xid, id) to continue after or None), or None if
+    # unusable, including numbers the xid8 and int columns can't hold
+    match = CURSOR_RE.match(value or '')
+    if not match:
+        return None
+    since, issued, xid, task_id = (int(group) if group else None for group in match.groups())
+    if since > MAX_XID or (xid is not None and (xid > MAX_XID or task_id > MAX_INT)):
+        return None
+    return since, issued, (xid, task_id) if xid is not None else None
+
+
+def plan_changes(cursor, retention_days=30):
+    # (reset, since, issued, (xid, id) to read after). A missing, malformed or
+    # expired cursor (older than the tombstones) starts over from nothing with
+    # reset set. since and issued are None when a new cursor must be taken
+    # (HORIZON_SQL) before reading, so nothing that commits while the pages
+    # are read can fall behind it.
+    state = decode_cursor(cursor)
+    reset = state is None or state[1] < time.time() - retention_days * 86400
+    if reset:
+        return True, None, None, (0, 0)
+    if state[2] is None:
+        return False, None, None, (state[0], 0)
+    return False, state[0], state[1], state[2]
+
+
+def changes_params(user_id, after, limit):
+    return {'user_id': user_id, 'after_xid': str(after[0]), 'after_id': after[1], 'limit': limit + 1}
+
+
+def changes_page(rows, since, issued, limit, reset):
+    more = len(rows) > limit
+    del rows[limit:]
+    return {
+        'tasks': [{field: row[field] for field in SYNC_FIELDS} for row in rows if not row['deleted']],
+        'deleted': [row['id'] for row in rows if row['deleted']],
+        'cursor': encode_cursor(since, issued, (int(rows[-1]['change_xid']), rows[-1]['id']) if more else None),
+        'more': more,
+        'reset': reset,
+    }
+
+
+def load_changes(cur, user_id, cursor, limit=500, retention_days=30):
+    # Returns {'tasks', 'deleted', 'cursor', 'more', 'reset'}; with reset set
+    # the client replaces its store
+    reset, since, issued, after = plan_changes(cursor, retention_days)
+    if since is None:
+        cur.execute(HORIZON_SQL)
+        since, issued = int(cur.fetchone()['xmin']), int(time.time())
+    cur.execute(SYNC_SQL, changes_params(user_id, after, limit))
+    return changes_page(cur.fetchall(), since, issued, limit, reset)
+
+
+def prune_deletions(cur, retention_days=30):
+    # Clients whose cursor is older than this get a full resync instead
+    cur.execute(PRUNE_SQL, (retention_days,))
+    return cur.rowcount
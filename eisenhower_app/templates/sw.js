@@ -0,0 +1,117 @@
+// Service worker, served from /sw.js so it controls every page. The cache
+// name carries the version of the static files, so changing any of them
+// installs a fresh app shell and the old caches are dropped on activation.
+const CACHE = "prioritymaster-{{ asset_version }}";
+const SHELL = [
+  "/static/style.css",
+  "/static/sync.js",
+  "/static/script.js",
+  "/static/icon.png",
+  "/static/manifest.json",
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css",
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js",
+];
+// The page shown when offline; the board is then drawn from IndexedDB. It is
+// cached per user, under the X-Sync-User header the server sets on pages for
+// a signed-in user, and only shown to that same user.
+const OFFLINE_PAGE = "/tasks";
+// Who the last page the network served was for ("" when signed out)
+const CURRENT_USER = "/sw-current-user";
+
+async function forgetPages(cache) {
+  const requests = await cache.keys();
+  await Promise.all(
+    requests
+      .filter((request) => new URL(request.url).pathname === OFFLINE_PAGE)
+      .map((request) => cache.delete(request))
+  );
+}
+
+async function remember(response) {
+  // Drops every cached page when the signed-in user changes (including a
+  // redirect to /login once a session expires), then keeps this one if it
+  // is the board
+  const url = new URL(response.url);
+  const cache = await caches.open(CACHE);
+  const user = response.headers.get("X-Sync-User") || "";
+  const current = await cache.match(CURRENT_USER);
+  if (!current || (await current.text()) !== user) {
+    await forgetPages(cache);
+    await cache.put(CURRENT_USER, new Response(user));
+  }
+  if (user && url.pathname === OFFLINE_PAGE && !url.search && !response.redirected) {
+    await cache.put(`${OFFLINE_PAGE}?user=${encodeURIComponent(user)}`, response);
+  }
+}
+
+async function offlinePage() {
+  const cache = await caches.open(CACHE);
+  const current = await cache.match(CURRENT_USER);
+  const user = current ? await current.text() : "";
+  const page = user && (await cache.match(`${OFFLINE_PAGE}?user=${encodeURIComponent(user)}`));
+  return page || new Response("You are offline.", { status: 503, headers: { "Content-Type": "text/plain" } });
+}
+
+async function signedOut() {
+  const cache = await caches.open(CACHE);
+  await forgetPages(cache);
+  await cache.put(CURRENT_USER, new Response(""));
+}
+
+self.addEventListener("install", (e) => {
+  e.waitUntil(
+    caches
+      .open(CACHE)
+      .then((cache) => cache.addAll(SHELL.map((url) => new Request(url, { cache: "reload" }))))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener("activate", (e) => {
+  e.waitUntil(
+    caches
+      .keys()
+      .then((names) =>
+        Promise.all(
+          names
+            .filter((name) => name.startsWith("prioritymaster-") && name !== CACHE)
+            .map((name) => caches.delete(name))
+        )
+      )
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener("fetch", (e) => {
+  const request = e.request;
+  const url = new URL(request.url);
+  if (request.mode === "navigate" && ["/login", "/logout", "/register"].includes(url.pathname)) {
+    // Whoever is signing in or out, the cached board isn't theirs to see
+    e.waitUntil(signedOut());
+    return;
+  }
+  if (request.method !== "GET") return;
+  if (request.mode === "navigate") {
+    // Pages are always fetched fresh; the user's last board stands in offline
+    e.respondWith(
+      fetch(request)
+        .then((response) => {
+          if (response.ok) e.waitUntil(remember(response.clone()));
+          return response;
+        })
+        .catch(offlinePage)
+    );
+  } else if (SHELL.includes(url.origin === self.location.origin ? url.pathname : request.url)) {
+    // Versioned with the cache, so the shell is safe to serve cache-first
+    e.respondWith(caches.match(request).then((response) => response || fetch(request)));
+  }
+  // Everything else (the API, /events, search) goes to the network as usual
+});
+
+self.addEventListener("push", (e) => {
+  const data = e.data.json();
+  self.registration.showNotification(data.title, {
+    body: data.body,
+    icon: "/static/icon.png",
+  });
+});
@@ -1,43 +1,51 @@
 import unittest
 import os
-from app import app, get_db_connection, User  # Added User import here
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+from app import create_app, start_scheduler, User, load_user, user_cache, invalidate_user, create_recurring_tasks, checkin_cache, fragment_cache  # Added User import here
 from flask_login import login_user
+from db import TaskCursor, TupleCursor, get_db_connection
+from priority import suggested_tasks
+from board import load_board
+from search import search_tasks
+from reports import load_checkin
+from sqlite_repository import SQLiteRepository
+from migrations import reset_data
+from events import EventBroker, notify_task_event
 from werkzeug.security import generate_password_hash
 import psycopg2
 from datetime import date, timedelta
 
+app = create_app()
+
 class PriorityMasterTestCase(unittest.TestCase):
     def setUp(self):
         # Configure app for testing
         app.config['TESTING'] = True
         app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
         self.app = app.test_client()
+        # Jobs and load_user are called directly, outside a request
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        user_cache.clear()
+        checkin_cache.clear()
+        fragment_cache.clear()
         
         # Use a test database
         self.db = get_db_connection()
         self.db.autocommit = True  # For simplicity in testing
         self.cur = self.db.cursor()
+        # The repository's cursors, for calling the query functions directly
+        self.tasks = self.db.cursor(cursor_factory=TaskCursor)
+        self.rows = self.db.cursor(cursor_factory=TupleCursor)
         
-        # Drop and recreate tables
-        self.cur.execute("DROP TABLE IF EXISTS tasks")
-        self.cur.execute("DROP TABLE IF EXISTS users")
-        self.cur.execute('''CREATE TABLE users (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            password TEXT NOT NULL
-        )''')
-        self.cur.execute('''CREATE TABLE tasks (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            urgency TEXT NOT NULL,
-            importance TEXT NOT NULL,
-            due_date DATE,
-            impact INTEGER DEFAULT 5,
-            frequency TEXT DEFAULT 'none',
-            completed BOOLEAN DEFAULT FALSE,
-            user_id TEXT NOT NULL REFERENCES users(id),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
+        # Empty the tables, migrating first if needed
+        reset_data(self.db)
         
         # Insert a test user
         self.test_user_id = "testuser"
@@ -50,10 +58,9 @@ class PriorityMasterTestCase(unittest.TestCase):
         )
 
     def tearDown(self):
-        # Clean up after each test
-        self.cur.execute("DROP TABLE IF EXISTS tasks")
-        self.cur.execute("DROP TABLE IF EXISTS users")
         self.cur.close()
+        self.tasks.close()
+        self.rows.close()
         self.db.close()
 
     def login(self, user_id, password):
@@ -70,9 +77,23 @@ class PriorityMasterTestCase(unittest.TestCase):
         rv = self.login(self.test_user_id, "wrongpass")
         self.assertIn(b"Invalid username or password.", rv.data)
 
+    def test_load_user_is_cached(self):
+        user = load_user(self.test_user_id)
+        self.assertEqual(user.name, self.test_user_name)
+        self.assertFalse(hasattr(user, 'password'))
+        self.cur.execute("UPDATE users SET name = 'Renamed' WHERE id = %s", (self.test_user_id,))
+        self.assertEqual(load_user(self.test_user_id).name, self.test_user_name)
+        invalidate_user(self.test_user_id)
+        self.assertEqual(load_user(self.test_user_id).name, 'Renamed')
+
+    def test_register_invalidates_cached_miss(self):
+        self.assertIsNone(load_user("newbie"))
+        self.app.post('/register', data=dict(user_id="newbie", name="New", password="pw"), follow_redirects=True)
+        self.assertEqual(load_user("newbie").name, "New")
+
     def test_add_task(self):
         with app.test_request_context():
-            login_user(User(self.test_user_id, self.test_user_name, generate_password_hash(self.test_user_password)))
+            login_user(User(self.test_user_id, self.test_user_name))
             rv = self.app.post('/add_task', data=dict(
                 title="Test Task",
                 urgency="urgent",
@@ -87,9 +108,23 @@ class PriorityMasterTestCase(unittest.TestCase):
             self.assertIsNotNone(task)
             self.assertEqual(task['urgency'], "urgent")
 
+    def test_add_task_rejects_unknown_codes(self):
+        with app.test_request_context():
+            login_user(User(self.test_user_id, self.test_user_name))
+            rv = self.app.post('/add_task', data=dict(
+                title="Odd Task",
+                urgency="someday",
+                importance="important",
+                impact=5,
+                frequency="none"
+            ))
+            self.assertEqual(rv.status_code, 400)
+            self.cur.execute("SELECT COUNT(*) AS n FROM tasks WHERE title = 'Odd Task'")
+            self.assertEqual(self.cur.fetchone()['n'], 0)
+
     def test_recurring_task_creation(self):
         with app.test_request_context():
-            login_user(User(self.test_user_id, self.test_user_name, generate_password_hash(self.test_user_password)))
+            login_user(User(self.test_user_id, self.test_user_name))
             # Add a recurring task
             self.app.post('/add_task', data=dict(
                 title="Daily Test",
@@ -110,9 +145,139 @@ class PriorityMasterTestCase(unittest.TestCase):
             self.assertIsNotNone(new_task)
             self.assertEqual(new_task['due_date'], date(2025, 4, 8))  # +1 day from original
 
+    def test_scheduler_rollover_is_idempotent(self):
+        self.cur.execute("INSERT INTO users (id, name, password) VALUES ('other', 'Other', 'x')")
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, due_date, frequency, user_id, completed) VALUES "
+            "('Water plants', 'urgent', 'important', '2025-04-07', 'weekly', %s, TRUE), "
+            "('Standup', 'urgent', 'important', NULL, 'daily', 'other', TRUE), "
+            "('One-off', 'urgent', 'important', '2025-04-07', 'none', 'other', TRUE)",
+            (self.test_user_id,)
+        )
+        create_recurring_tasks()
+        create_recurring_tasks()
+        self.cur.execute("SELECT title, due_date FROM tasks WHERE completed = FALSE ORDER BY title")
+        created = self.cur.fetchall()
+        self.assertEqual([task['title'] for task in created], ['Standup', 'Water plants'])
+        self.assertEqual(created[0]['due_date'], date.today() + timedelta(days=1))
+        self.assertEqual(created[1]['due_date'], date(2025, 4, 14))
+
+    def test_toggle_and_scheduler_do_not_duplicate(self):
+        with app.test_request_context():
+            login_user(User(self.test_user_id, self.test_user_name))
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, due_date, frequency, user_id) "
+                "VALUES ('Daily Test', 'urgent', 'important', '2025-04-07', 'daily', %s) RETURNING id",
+                (self.test_user_id,)
+            )
+            task_id = self.cur.fetchone()['id']
+            self.app.get(f'/toggle_task/{task_id}')
+            create_recurring_tasks()
+            self.cur.execute("SELECT COUNT(*) AS n FROM tasks WHERE title = 'Daily Test'")
+            self.assertEqual(self.cur.fetchone()['n'], 2)
+
+    def test_stale_edit_and_toggle_are_rejected(self):
+        self.login(self.test_user_id, self.test_user_password)
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Draft', 'urgent', 'important', %s) RETURNING id",
+            (self.test_user_id,)
+        )
+        task_id = self.cur.fetchone()['id']
+        form = dict(title='Draft v2', urgency='urgent', importance='important', due_date='', impact=5, frequency='none', version=1)
+        self.assertEqual(self.app.post(f'/edit_task/{task_id}', data=form).status_code, 302)
+        rv = self.app.post(f'/edit_task/{task_id}', data=dict(form, title='Stale'))
+        self.assertEqual(rv.status_code, 409)
+        self.assertIn(b'value="Draft v2"', rv.data)
+        self.assertIn(b'name="version" value="2"', rv.data)
+        rv = self.app.get(f'/toggle_task/{task_id}?version=1', follow_redirects=True)
+        self.assertIn(b"changed somewhere else", rv.data)
+        self.assertEqual(self.app.get(f'/toggle_task/{task_id}?version=99999999999').status_code, 400)
+        self.assertEqual(self.app.post(f'/edit_task/{task_id}', data=dict(form, version='99999999999')).status_code, 400)
+        self.assertEqual(self.app.post(f'/edit_task/{task_id}', data=dict(form, version='two')).status_code, 400)
+        self.cur.execute("SELECT title, completed FROM tasks WHERE id = %s", (task_id,))
+        self.assertEqual(dict(self.cur.fetchone()), {'title': 'Draft v2', 'completed': False})
+
+    def test_batch_endpoint(self):
+        self.login(self.test_user_id, self.test_user_password)
+        ids = []
+        for title in ('One', 'Two'):
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, user_id) VALUES (%s, 'urgent', 'important', %s) RETURNING id",
+                (title, self.test_user_id)
+            )
+            ids.append(self.cur.fetchone()['id'])
+        rv = self.app.post('/tasks/batch', json={'operations': [{'op': 'move', 'ids': ids, 'quadrant': 'nowhere'}]})
+        self.assertEqual(rv.status_code, 400)
+        self.assertIn('quadrant', rv.get_json()['error'])
+        for bad in ({'ids': [2 ** 31]}, {'ids': ids, 'versions': [1, -1]}):
+            rv = self.app.post('/tasks/batch', json={'operations': [dict(bad, op='delete')]})
+            self.assertEqual(rv.status_code, 400)
+
+        move = {'op': 'move', 'ids': ids, 'versions': [1, 1], 'quadrant': 'delegate'}
+        rv = self.app.post('/tasks/batch', json={'operations': [move]})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.get_json()['results'], [{'op': 'move', 'ids': ids}])
+        self.assertEqual(rv.get_json()['tasks'], [{'id': ids[0], 'version': 2}, {'id': ids[1], 'version': 2}])
+        rv = self.app.post('/tasks/batch', json={'operations': [{'op': 'delete', 'ids': ids[:1]}, move]})
+        self.assertEqual(rv.status_code, 409)
+        # The delete before it was rolled back too
+        self.assertEqual(rv.get_json()['tasks'], [{'id': ids[1], 'version': 2}])
+        self.cur.execute("SELECT importance FROM tasks WHERE user_id = %s ORDER BY id", (self.test_user_id,))
+        self.assertEqual([row['importance'] for row in self.cur.fetchall()], ['not important', 'not important'])
+
+    def test_suggested_tasks_top_fifth_by_priority(self):
+        today = date(2025, 4, 1)
+        rows = [
+            ("Due tomorrow", "important", 8, today + timedelta(days=1), False),
+            ("Minor tomorrow", "not important", 8, today + timedelta(days=1), False),
+            ("No due date", "important", 9, None, False),
+            ("Overdue", "important", 3, today - timedelta(days=5), True),
+        ] + [("Later %d" % i, "important", 5, today + timedelta(days=20 + i), False) for i in range(6)]
+        for title, importance, impact, due_date, completed in rows:
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, impact, due_date, completed, user_id) "
+                "VALUES (%s, 'urgent', %s, %s, %s, %s, %s)",
+                (title, importance, impact, due_date, completed, self.test_user_id)
+            )
+        suggested = suggested_tasks(self.tasks, self.test_user_id, today)
+        self.assertEqual([(t.title, t.priority) for t in suggested], [("Due tomorrow", 8.0), ("Minor tomorrow", 4.0)])
+        open_suggested = suggested_tasks(self.tasks, self.test_user_id, today, open_only=True)
+        self.assertEqual(len(open_suggested), 1)
+        self.assertEqual(open_suggested[0].title, "Due tomorrow")
+
+    def test_board_pages_each_quadrant(self):
+        for i, due_date in enumerate(['2025-04-03', None, '2025-04-01', '2025-04-02']):
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, due_date, completed, user_id) "
+                "VALUES (%s, 'urgent', 'important', %s, %s, %s)",
+                ("Do %d" % i, due_date, i == 2, self.test_user_id)
+            )
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Someday', 'not urgent', 'not important', %s)",
+            (self.test_user_id,)
+        )
+        board = {q['key']: q for q in load_board(self.rows, self.test_user_id, page_size=2)}
+        self.assertEqual(board['do']['total'], 4)
+        self.assertEqual([t.title for t in board['do']['tasks']], ["Do 2", "Do 3"])
+        self.assertEqual(board['plan']['tasks'], [])
+        self.assertIsNone(board['eliminate']['next_cursor'])
+        self.assertEqual(board['eliminate']['total'], 1)
+        cursors = {'do': board['do']['next_cursor']}
+        page_two = load_board(self.rows, self.test_user_id, cursors, page_size=2)[0]
+        self.assertEqual([t.title for t in page_two['tasks']], ["Do 0", "Do 1"])
+        self.assertIsNone(page_two['next_cursor'])
+        open_only = load_board(self.rows, self.test_user_id, hide_completed=True, page_size=2)[0]
+        self.assertEqual(open_only['total'], 3)
+        self.assertEqual([t.title for t in open_only['tasks']], ["Do 3", "Do 0"])
+
+        self.login(self.test_user_id, self.test_user_password)
+        self.assertEqual(self.app.get('/tasks?do_after=' + board['do']['next_cursor']).status_code, 200)
+        for cursor in ('2025-02-30.1', '2025-04-01.99999999999', 'garbage'):
+            self.assertEqual(self.app.get('/tasks?do_after=' + cursor).status_code, 400)
+
     def test_search_tasks(self):
         with app.test_request_context():
-            login_user(User(self.test_user_id, self.test_user_name, generate_password_hash(self.test_user_password)))
+            login_user(User(self.test_user_id, self.test_user_name))
             self.app.post('/add_task', data=dict(
                 title="Searchable Task",
                 urgency="urgent",
@@ -124,6 +289,403 @@ class PriorityMasterTestCase(unittest.TestCase):
             rv = self.app.get('/search?q=Searchable', follow_redirects=True)
             self.assertIn(b"Searchable Task", rv.data)
 
+    def test_search_ranks_prefix_matches_and_pages(self):
+        for title in ["Plan quarterly report", "Plan", "Report bug", "Unrelated", "Planning session"]:
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, user_id) VALUES (%s, 'urgent', 'important', %s)",
+                (title, self.test_user_id)
+            )
+        self.cur.execute("UPDATE tasks SET title = 'Plan renamed' WHERE title = 'Unrelated'")
+        found, cursor = search_tasks(self.tasks, self.test_user_id, "pla", limit=2)
+        self.assertEqual(len(found), 2)
+        self.assertIsNotNone(cursor)
+        rest, cursor = search_tasks(self.tasks, self.test_user_id, "pla", after=cursor, limit=2)
+        self.assertIsNone(cursor)
+        titles = {task.title for task in found + rest}
+        self.assertEqual(titles, {"Plan quarterly report", "Plan", "Planning session", "Plan renamed"})
+        found, _ = search_tasks(self.tasks, self.test_user_id, "plan rep")
+        self.assertEqual([task.title for task in found], ["Plan quarterly report"])
+        self.assertEqual(search_tasks(self.tasks, self.test_user_id, "  %% "), ([], None))
+
+        self.login(self.test_user_id, self.test_user_password)
+        self.assertEqual(self.app.get('/search?q=pla&after=0.5_99999999999').status_code, 400)
+        self.assertEqual(self.app.get('/search?q=pla&after=nonsense').status_code, 400)
+
+    def test_search_suggest_returns_json(self):
+        with app.test_request_context():
+            login_user(User(self.test_user_id, self.test_user_name))
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Typeahead task', 'urgent', 'important', %s)",
+                (self.test_user_id,)
+            )
+            rv = self.app.get('/search/suggest?q=type')
+            self.assertEqual(rv.get_json()[0]['title'], "Typeahead task")
+
+    def test_checkin_single_query_is_cached_until_tasks_change(self):
+        today = date.today()
+        rows = [
+            ("Overdue", today - timedelta(days=2), False),
+            ("Upcoming", today + timedelta(days=3), False),
+            ("Far away", today + timedelta(days=30), False),
+            ("Done", today, True),
+        ]
+        for title, due_date, completed in rows:
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, due_date, completed, user_id) "
+                "VALUES (%s, 'urgent', 'important', %s, %s, %s)",
+                (title, due_date, completed, self.test_user_id)
+            )
+        with app.test_request_context():
+            login_user(User(self.test_user_id, self.test_user_name))
+            checkin_cache.clear()
+            rv = self.app.get('/checkin')
+            self.assertIn(b"Overdue", rv.data)
+            self.assertIn(b"Completed: ", rv.data)
+            hits = checkin_cache.stats()['hits']
+            self.app.get('/checkin')
+            self.assertEqual(checkin_cache.stats()['hits'], hits + 1)
+            self.cur.execute("UPDATE tasks SET title = 'Renamed overdue' WHERE title = 'Overdue'")
+            rv = self.app.get('/checkin')
+            self.assertIn(b"Renamed overdue", rv.data)
+
+    def test_load_checkin_partitions_one_scan(self):
+        today = date(2025, 4, 10)
+        for title, due_date, completed in [("Late", date(2025, 4, 1), False), ("Soon", date(2025, 4, 12), False),
+                                           ("Later", date(2025, 5, 1), False), ("Undated", None, False)]:
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, due_date, completed, user_id) "
+                "VALUES (%s, 'urgent', 'important', %s, %s, %s)",
+                (title, due_date, completed, self.test_user_id)
+            )
+        dashboard = load_checkin(self.tasks, self.test_user_id, today)
+        self.assertEqual([t.title for t in dashboard['overdue_tasks']], ["Late"])
+        self.assertEqual([t.title for t in dashboard['upcoming_tasks']], ["Soon"])
+        self.assertEqual(dashboard['completed_tasks'], [])
+        self.assertEqual([t.title for t in dashboard['suggested_tasks']],
+                         [t.title for t in suggested_tasks(self.tasks, self.test_user_id, today, open_only=True)])
+
+    def test_api_tasks_conditional_get(self):
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, due_date, user_id) VALUES "
+            "('API task', 'urgent', 'important', '2025-04-07', %s), ('Other', 'not urgent', 'important', NULL, %s)",
+            (self.test_user_id, self.test_user_id)
+        )
+        with app.test_request_context():
+            login_user(User(self.test_user_id, self.test_user_name))
+            rv = self.app.get('/api/v1/tasks?quadrant=do&fields=id,title,due_date')
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.get_json()['tasks'][0]['title'], "API task")
+            self.assertEqual(rv.get_json()['tasks'][0]['due_date'], "2025-04-07")
+            self.assertEqual(set(rv.get_json()['tasks'][0]), {'id', 'title', 'due_date'})
+            etag = rv.headers['ETag']
+            self.assertIn('Last-Modified', rv.headers)
+            rv = self.app.get('/api/v1/tasks?quadrant=do&fields=id,title,due_date', headers={'If-None-Match': etag})
+            self.assertEqual(rv.status_code, 304)
+            self.assertEqual(rv.data, b'')
+            rv = self.app.get('/api/tasks?quadrant=plan', headers={'If-None-Match': etag})
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual([t['title'] for t in rv.get_json()['tasks']], ["Other"])
+            for limit in ('0', '-1'):
+                self.assertEqual(self.app.get('/api/tasks?limit=' + limit).status_code, 400)
+            self.cur.execute("UPDATE tasks SET completed = TRUE WHERE title = 'API task'")
+            rv = self.app.get('/api/v1/tasks?quadrant=do&fields=id,title,due_date', headers={'If-None-Match': etag})
+            self.assertEqual(rv.status_code, 200)
+            self.assertNotEqual(rv.headers['ETag'], etag)
+            self.assertEqual(self.app.get('/api/v1/tasks?fields=password').status_code, 400)
+
+    def test_api_requires_login(self):
+        rv = self.app.get('/api/v1/tasks')
+        self.assertEqual(rv.status_code, 401)
+
+    def test_offline_sync_and_service_worker(self):
+        self.login(self.test_user_id, self.test_user_password)
+        rv = self.app.get('/sw.js')
+        self.assertEqual(rv.mimetype, 'application/javascript')
+        self.assertRegex(rv.get_data(as_text=True), r'const CACHE = "prioritymaster-[0-9a-f]{12}";')
+        self.assertEqual(self.app.get('/tasks').headers['X-Sync-User'], self.test_user_id)
+        self.assertIn(b'data-sync-user="testuser"', self.app.get('/tasks').data)
+
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Offline', 'urgent', 'important', %s) RETURNING id",
+            (self.test_user_id,)
+        )
+        task_id = self.cur.fetchone()['id']
+        changes = self.app.get('/api/sync').get_json()
+        self.assertTrue(changes['reset'])
+        self.assertEqual([(t['id'], t['title'], t['version']) for t in changes['tasks']], [(task_id, 'Offline', 1)])
+        self.app.get(f'/delete_task/{task_id}')
+        changes = self.app.get('/api/sync?since=' + changes['cursor']).get_json()
+        self.assertEqual((changes['tasks'], changes['deleted'], changes['reset']), ([], [task_id], False))
+
+        self.app.get('/logout')
+        self.assertNotIn('X-Sync-User', self.app.get('/login').headers)
+
+    def test_event_broker_fans_out_notifications(self):
+        broker = EventBroker(poll_interval=0.1)
+        mine, other = broker.subscribe(self.test_user_id), broker.subscribe('someone-else')
+        self.assertTrue(broker.wait_until_listening(5))
+        notify_task_event(self.cur, self.test_user_id, 'delete', 42)
+        self.assertEqual(mine.get(timeout=5), {'user_id': self.test_user_id, 'event': 'delete', 'task_id': 42})
+        self.assertTrue(other.empty())
+        broker.unsubscribe(self.test_user_id, mine)
+        self.assertEqual(broker.subscriber_count(), 1)
+
+    def test_event_listener_survives_unexpected_errors(self):
+        attempts = []
+
+        def connect():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError('not a database error')
+            return get_db_connection()
+
+        broker = EventBroker(connect=connect, poll_interval=0.1)
+        with self.assertLogs('events', 'ERROR'):
+            mine = broker.subscribe(self.test_user_id)
+            self.assertTrue(broker.wait_until_listening(5))
+        notify_task_event(self.cur, self.test_user_id, 'create', 7)
+        self.assertEqual(mine.get(timeout=5)['task_id'], 7)
+
+    def test_event_stream_pushes_task_changes(self):
+        self.login(self.test_user_id, self.test_user_password)
+        self.assertEqual(self.app.get('/events').status_code, 204)
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Live', TRUE, TRUE, %s) RETURNING id",
+            (self.test_user_id,)
+        )
+        task_id = self.cur.fetchone()['id']
+        app.config['EVENT_STREAM'] = True
+        try:
+            rv = self.app.get('/events', buffered=False)
+            self.assertEqual(rv.mimetype, 'text/event-stream')
+            stream = iter(rv.response)
+            self.assertEqual(next(stream), b'retry: 5000\n\n')
+            from events import broker
+            self.assertTrue(broker.wait_until_listening(5))
+            self.app.get(f'/toggle_task/{task_id}')
+            chunk = next(stream)
+            self.assertTrue(chunk.startswith(b'event: task\n'))
+            self.assertIn(b'"event": "toggle"', chunk)
+            rv.close()
+        finally:
+            app.config['EVENT_STREAM'] = False
+
+    def test_report_streams_pages_and_summary(self):
+        self.login(self.test_user_id, self.test_user_password)
+        for day in range(1, 6):
+            self.cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, completed, created_at, user_id) VALUES (%s, 'urgent', 'important', TRUE, %s, %s)",
+                (f"Done {day}", date(2025, 4, day), self.test_user_id)
+            )
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, created_at, user_id) VALUES ('Open', 'not urgent', 'important', '2025-04-03', %s)",
+            (self.test_user_id,)
+        )
+        app.config['REPORT_PAGE_SIZE'] = 2
+        try:
+            rv = self.app.get('/report')
+            self.assertTrue(rv.is_streamed)
+            page = rv.get_data(as_text=True)
+            self.assertIn("Done 5", page)
+            self.assertIn("Done 4", page)
+            self.assertNotIn("Done 3", page)
+            after = page.split('after=')[1].split('"')[0]
+            page = self.app.get(f'/report?after={after}').get_data(as_text=True)
+            self.assertIn("Done 3", page)
+            self.assertNotIn("Done 4", page)
+            self.assertIn("First page", page)
+            rv = self.app.get('/report?start_date=2025-04-05')
+            self.assertNotIn("after=", rv.get_data(as_text=True))
+            for bad in ('2025-04-03T00:00:00_99999999999', '2025-13-01T00:00:00_1', 'garbage'):
+                self.assertEqual(self.app.get(f'/report?after={bad}').status_code, 400)
+        finally:
+            app.config['REPORT_PAGE_SIZE'] = 200
+        page = self.app.get('/report?view=summary').get_data(as_text=True)
+        self.assertIn("5 of 6 tasks completed\n  (83.3%)", page)
+        self.assertIn("<tr><td>Important, Not Urgent</td><td>0</td><td>1</td></tr>", page)
+        self.assertIn("<tr><td>2025-03-31</td><td>5</td><td>6</td></tr>", page)
+
+    def test_task_stats_follow_completions(self):
+        self.login(self.test_user_id, self.test_user_password)
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, created_at, user_id) VALUES "
+            "('A', 'urgent', 'important', now() - interval '2 hours', %(user)s), "
+            "('B', 'urgent', 'important', now() - interval '4 hours', %(user)s), "
+            "('C', 'not urgent', 'important', now(), %(user)s) RETURNING id",
+            {'user': self.test_user_id}
+        )
+        a, b, c = [row['id'] for row in self.cur.fetchall()]
+        self.cur.execute("INSERT INTO tasks (title, urgency, importance, due_date, user_id) VALUES ('Late', 'urgent', 'important', '2000-01-01', %s)",
+                         (self.test_user_id,))
+        # Two days ago, so yesterday breaks the streak
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, completed, completed_at, created_at, user_id) VALUES "
+            "('Old', 'urgent', 'important', TRUE, CURRENT_DATE - 2, CURRENT_DATE - 3, %s)",
+            (self.test_user_id,)
+        )
+        for task_id in (a, b, c):
+            self.app.get(f'/toggle_task/{task_id}')
+        self.app.get(f'/toggle_task/{c}')
+        self.app.get(f'/delete_task/{b}')
+
+        self.cur.execute("SELECT day, urgency, completed, lead_seconds FROM task_stats WHERE completed <> 0 ORDER BY day")
+        rows = self.cur.fetchall()
+        self.assertEqual([(row['urgency'], row['completed']) for row in rows], [('urgent', 1), ('urgent', 1)])
+        self.assertAlmostEqual(rows[1]['lead_seconds'], 7200, delta=60)
+
+        rv = self.app.get('/api/v1/analytics?days=7')
+        stats = rv.get_json()
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['overdue'], 1)
+        self.assertEqual(stats['current_streak'], 1)
+        self.assertEqual(stats['longest_streak'], 1)
+        self.assertEqual(len(stats['days']), 7)
+        self.assertEqual(stats['days'][-1]['do'], 1)
+        self.assertEqual(self.app.get('/api/v1/analytics?days=7', headers={'If-None-Match': rv.headers['ETag']}).status_code, 304)
+        self.assertEqual(self.app.get('/api/v1/analytics?days=0').status_code, 400)
+        self.assertIn(b"Current streak: 1 days", self.app.get('/analytics').data)
+
+    def test_quadrant_panels_are_cached_per_data_version(self):
+        self.login(self.test_user_id, self.test_user_password)
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Cached', 'urgent', 'important', %s) RETURNING id",
+            (self.test_user_id,)
+        )
+        task_id = self.cur.fetchone()['id']
+        before = fragment_cache.stats()
+        renders = lambda: fragment_cache.stats()['renders'] - before['renders']
+        first = self.app.get('/tasks').data
+        self.assertEqual(renders(), 4)
+        self.assertEqual(self.app.get('/tasks').data, first)
+        self.assertEqual(renders(), 4)
+        self.assertEqual(fragment_cache.stats()['hits'] - before['hits'], 4)
+        # Any write bumps the data version, so the next request re-renders
+        self.app.get(f'/toggle_task/{task_id}')
+        rv = self.app.get('/tasks')
+        self.assertIn(b"Undo", rv.data)
+        self.assertEqual(renders(), 8)
+        # Other pages and filters have their own entries
+        self.app.get('/tasks?hide_completed=1')
+        self.assertEqual(renders(), 12)
+
+    def test_metrics_and_server_timing_are_opt_in(self):
+        self.login(self.test_user_id, self.test_user_password)
+        self.assertNotIn('Server-Timing', self.app.get('/tasks').headers)
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+        app.config['METRICS_ENABLED'] = True
+        try:
+            rv = self.app.get('/tasks')
+            timing = rv.headers.getlist('Server-Timing')
+            self.assertRegex(timing[0], r'^db;dur=[\d.]+;desc="\d+ queries"$')
+            self.assertTrue(timing[-1].startswith('app;dur='))
+            create_recurring_tasks()
+            rv = self.app.get('/metrics')
+            self.assertEqual(rv.mimetype, 'text/plain')
+            body = rv.get_data(as_text=True)
+            self.assertIn('http_requests_total{endpoint="tasks",method="GET",status="200"}', body)
+            self.assertIn('db_queries_per_request_count{endpoint="tasks"}', body)
+            self.assertIn('job_duration_seconds_count{job="create_recurring_tasks"}', body)
+        finally:
+            app.config['METRICS_ENABLED'] = False
+
+    def test_import_upload_and_export_download(self):
+        self.login(self.test_user_id, self.test_user_password)
+        upload = b'title,urgency,importance\nImported,urgent,important\n'
+        rv = self.app.post('/tasks/import', data={'file': (io.BytesIO(upload), 'tasks.csv')},
+                           content_type='multipart/form-data', follow_redirects=True)
+        self.assertIn(b"Imported 1 tasks.", rv.data)
+        rv = self.app.post('/tasks/import', data={'file': (io.BytesIO(b'{"title": "x"}\n'), 'tasks.ndjson')},
+                           content_type='multipart/form-data', follow_redirects=True)
+        self.assertIn(b"Nothing imported, line 1: urgency", rv.data)
+        rv = self.app.get('/tasks/export?format=ndjson')
+        self.assertEqual(rv.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['title'] for line in rv.data.splitlines()], ["Imported"])
+
+
+class SQLiteAppTestCase(unittest.TestCase):
+    # The backend-neutral pages against STORAGE_BACKEND=sqlite; no database
+    # server involved
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.repo = SQLiteRepository(os.path.join(directory.name, 'app.db'))
+        self.addCleanup(self.repo.close)
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        checkin_cache.clear()
+        fragment_cache.clear()
+        self.app = create_app({'TESTING': True}, repository=self.repo).test_client()
+        self.app.post('/register', data={'user_id': 'lite', 'name': 'Lite', 'password': 'pw'})
+        self.app.post('/login', data={'user_id': 'lite', 'password': 'pw'})
+
+    def add(self, title, **fields):
+        form = dict(title=title, urgency='urgent', importance='important', due_date='', impact=5, frequency='none')
+        form.update(fields)
+        self.assertEqual(self.app.post('/add_task', data=form).status_code, 302)
+        return form
+
+    def test_task_pages(self):
+        form = self.add("Draft plan", due_date='2025-04-10')
+        self.add("Weekly review", frequency='weekly', importance='not important')
+        page = self.app.get('/tasks').get_data(as_text=True)
+        self.assertIn("Draft plan", page)
+        self.assertIn("Weekly review", page)
+        task_id = self.repo.search_tasks('lite', 'draft')[0][0].id
+
+        self.assertEqual(self.app.post(f'/edit_task/{task_id}', data=dict(form, title='Draft v2', version=1)).status_code, 302)
+        rv = self.app.post(f'/edit_task/{task_id}', data=dict(form, title='Stale', version=1))
+        self.assertEqual(rv.status_code, 409)
+        self.assertIn(b'value="Draft v2"', rv.data)
+        self.app.get(f'/toggle_task/{task_id}?version=2')
+        self.assertTrue(self.repo.get_task('lite', task_id).completed)
+
+        self.assertIn("Draft v2", self.app.get('/search?q=dra').get_data(as_text=True))
+        self.assertEqual([t['title'] for t in self.app.get('/search/suggest?q=week').get_json()], ["Weekly review"])
+        self.assertIn("Draft v2", self.app.get('/checkin').get_data(as_text=True))
+        self.assertIn("Draft v2", self.app.get('/report').get_data(as_text=True))
+        page = self.app.get('/report?view=summary').get_data(as_text=True)
+        self.assertIn("1 of 2 tasks completed", page)
+        self.assertIn("<tr><td>Urgent &amp; Important</td><td>1</td><td>1</td></tr>", page)
+        self.assertIn("<td>1</td><td>2</td></tr>", page)
+
+        weekly = self.repo.search_tasks('lite', 'weekly')[0][0].id
+        rv = self.app.post('/tasks/batch', json={'operations': [{'op': 'delete', 'ids': [weekly], 'versions': [1]}]})
+        self.assertEqual(rv.get_json()['results'], [{'op': 'delete', 'ids': [weekly]}])
+        self.app.get(f'/delete_task/{task_id}')
+        self.assertNotIn("Draft v2", self.app.get('/tasks').get_data(as_text=True))
+
+    def test_postgres_only_pages_are_not_found(self):
+        for path in ('/analytics', '/tasks/import', '/tasks/export'):
+            self.assertEqual(self.app.get(path).status_code, 404, path)
+
+
+class AppFactoryTestCase(unittest.TestCase):
+    def test_import_and_create_app_start_nothing(self):
+        # In a fresh interpreter, since other tests load the lazy modules
+        script = ("import sys, threading, app; app.create_app({'SCHEDULER_MODE': 'lease'}); "
+                  "print(threading.active_count(), 'pywebpush' in sys.modules, 'apscheduler' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.split(), ['1', 'False', 'False'])
+
+    def test_scheduler_runs_only_where_started(self):
+        self.assertIsNone(start_scheduler(create_app({'SCHEDULER_MODE': 'off'})))
+        threads = threading.active_count()
+        leased = create_app({'SCHEDULER_MODE': 'lease'})
+        self.assertEqual(threading.active_count(), threads)
+        scheduler = start_scheduler(leased)
+        try:
+            self.assertEqual([job.id for job in scheduler.get_jobs()], ['run_due_jobs'])
+        finally:
+            scheduler.shutdown()
+        scheduler = start_scheduler(create_app({'SCHEDULER_MODE': 'local'}))
+        try:
+            self.assertEqual(sorted(job.id for job in scheduler.get_jobs()),
+                             ['create_recurring_tasks', 'notify_due_tasks', 'prune_task_deletions'])
+        finally:
+            scheduler.shutdown()
+
+
 if __name__ == '__main__':
     # Ensure test database is used
     os.environ['DB_NAME'] = 'eisenhower_test'
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import unittest
+from urllib.parse import urlencode
+
+import asgi
+from app import user_cache
+from db import get_db_connection
+from events import notify_task_event
+from migrations import reset_data
+from werkzeug.security import generate_password_hash
+
+
+app = asgi.app
+
+
+class AsgiTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app.config['TESTING'] = True
+        user_cache.clear()
+        self.db = get_db_connection()
+        self.db.autocommit = True
+        reset_data(self.db)
+        self.cur = self.db.cursor()
+        self.cur.execute("INSERT INTO users (id, name, password) VALUES ('alice', 'Alice', %s)",
+                         (generate_password_hash('pw'),))
+        self.cookie = None
+        self.lifespan = asyncio.Queue()
+        self.lifespan_sent = asyncio.Queue()
+        self.server = asyncio.ensure_future(asgi.application({'type': 'lifespan'}, self.lifespan.get, self.lifespan_sent.put))
+        await self.lifespan.put({'type': 'lifespan.startup'})
+        self.assertEqual((await self.lifespan_sent.get())['type'], 'lifespan.startup.complete')
+
+    async def asyncTearDown(self):
+        await self.lifespan.put({'type': 'lifespan.shutdown'})
+        await self.server
+        app.config['EVENT_STREAM'] = False
+        self.cur.close()
+        self.db.close()
+
+    def scope(self, method, path, query='', headers=()):
+        headers = [(name.lower().encode(), value.encode()) for name, value in headers]
+        if self.cookie:
+            headers.append((b'cookie', self.cookie.encode()))
+        return {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'root_path': '',
+                'query_string': query.encode(), 'headers': headers, 'server': ('testserver', 80), 'scheme': 'http'}
+
+    async def request(self, method, path, query='', headers=(), body=b''):
+        # (status, headers, body) of one complete response
+        sent = []
+        received = [{'type': 'http.request', 'body': body}]
+        if body:
+            headers = list(headers) + [('Content-Length', str(len(body)))]
+
+        async def receive():
+            if received:
+                return received.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi.application(self.scope(method, path, query, headers), receive, send)
+        start = sent[0]
+        response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+        cookie = response_headers.get('set-cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return start['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+    async def login(self):
+        body = urlencode({'user_id': 'alice', 'password': 'pw'}).encode()
+        status, headers, _ = await self.request('POST', '/login', body=body,
+                                                headers=[('Content-Type', 'application/x-www-form-urlencoded')])
+        self.assertEqual(status, 302)
+
+    def add_task(self, title):
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES (%s, 'urgent', 'important', 'alice') RETURNING id",
+            (title,))
+        return self.cur.fetchone()['id']
+
+    async def test_task_list_matches_the_wsgi_view(self):
+        first, second = self.add_task('One'), self.add_task('Two')
+        await self.login()
+        status, headers, body = await self.request('GET', '/api/v1/tasks', 'fields=title&limit=1')
+        self.assertEqual(status, 200)
+        page = json.loads(body)
+        self.assertEqual((page['tasks'], page['next_after']), ([{'title': 'One'}], first))
+
+        client = app.test_client()
+        client.post('/login', data={'user_id': 'alice', 'password': 'pw'})
+        expected = client.get('/api/v1/tasks?fields=title&limit=1')
+        self.assertEqual(page, expected.get_json())
+        self.assertEqual(headers['etag'], expected.headers['ETag'])
+
+        status, _, _ = await self.request('GET', '/api/tasks', 'fields=title&limit=1', [('If-None-Match', headers['etag'])])
+        self.assertEqual(status, 304)
+        self.add_task('Three')
+        status, _, _ = await self.request('GET', '/api/tasks', 'fields=title&limit=1', [('If-None-Match', headers['etag'])])
+        self.assertEqual(status, 200)
+
+    async def test_errors_and_login_use_the_api_handlers(self):
+        status, _, body = await self.request('GET', '/api/tasks')
+        self.assertEqual((status, json.loads(body)['error'].startswith('The server could not verify')), (401, True))
+        await self.login()
+        status, _, body = await self.request('GET', '/api/tasks', 'quadrant=someday')
+        self.assertEqual((status, json.loads(body)), (400, {'error': 'Unknown quadrant: someday'}))
+
+    async def test_sync_pages_through_changes(self):
+        task_id = self.add_task('One')
+        await self.login()
+        status, headers, body = await self.request('GET', '/api/sync')
+        self.assertEqual(status, 200)
+        self.assertIn('no-store', headers['cache-control'])
+        changes = json.loads(body)
+        self.assertTrue(changes['reset'])
+        self.assertEqual([task['id'] for task in changes['tasks']], [task_id])
+
+        self.cur.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
+        _, _, body = await self.request('GET', '/api/sync', urlencode({'since': changes['cursor']}))
+        changes = json.loads(body)
+        self.assertEqual((changes['reset'], changes['tasks'], changes['deleted']), (False, [], [task_id]))
+
+    async def test_pages_fall_back_to_the_flask_views(self):
+        self.add_task('Write the report')
+        await self.login()
+        status, headers, body = await self.request('GET', '/tasks')
+        self.assertEqual(status, 200)
+        self.assertIn(b'Write the report', body)
+        self.assertEqual(headers['x-sync-user'], 'alice')
+
+    async def test_event_stream_is_a_coroutine(self):
+        await self.login()
+        status, _, _ = await self.request('GET', '/events')
+        self.assertEqual(status, 204)
+        app.config['EVENT_STREAM'] = True
+        sent = asyncio.Queue()
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        stream = asyncio.ensure_future(asgi.application(self.scope('GET', '/events'), receive, sent.put))
+        self.assertEqual((await sent.get())['status'], 200)
+        self.assertEqual((await sent.get())['body'], b'retry: 5000\n\n')
+        await asyncio.wait_for(asgi.broker.listening.wait(), 5)
+        notify_task_event(self.cur, 'alice', 'create', 7)
+        message = await asyncio.wait_for(sent.get(), 5)
+        self.assertIn(b'"task_id": 7', message['body'])
+
+        disconnect.set()
+        await asyncio.wait_for(stream, 5)
+        self.assertEqual(asgi.broker.subscriber_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
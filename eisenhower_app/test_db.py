@@ -0,0 +1,124 @@
+import unittest
+import threading
+import time
+from db import ConnectionPool, PoolTimeout, TaskCursor, get_db_connection
+from models import Frequency, Task, Urgency
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(get_db_connection, minconn=0, maxconn=2, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.closeall()
+
+    def test_connection_is_reused(self):
+        with self.pool.connection() as conn:
+            first = conn
+        with self.pool.connection() as conn:
+            self.assertIs(conn, first)
+        stats = self.pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_open_transaction_is_rolled_back_on_return(self):
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+        self.assertFalse(conn.closed)
+        self.assertEqual(conn.get_transaction_status(), 0)
+
+    def test_exhaustion_times_out(self):
+        first = self.pool.getconn()
+        second = self.pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn()
+        stats = self.pool.stats()
+        self.assertEqual(stats['exhausted'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.pool.putconn(first)
+        self.pool.putconn(second)
+
+    def test_waiter_gets_returned_connection(self):
+        self.pool.timeout = 5
+        first = self.pool.getconn()
+        second = self.pool.getconn()
+        result = {}
+
+        def wait_for_connection():
+            result['conn'] = self.pool.getconn()
+
+        waiter = threading.Thread(target=wait_for_connection)
+        waiter.start()
+        time.sleep(0.1)
+        self.pool.putconn(first)
+        waiter.join(5)
+        self.assertIs(result['conn'], first)
+        self.assertGreater(self.pool.stats()['wait_seconds'], 0)
+        self.pool.putconn(first)
+        self.pool.putconn(second)
+
+    def test_closed_connection_is_replaced(self):
+        with self.pool.connection() as conn:
+            broken = conn
+        broken.close()
+        with self.pool.connection() as conn:
+            self.assertIsNot(conn, broken)
+        self.assertEqual(self.pool.stats()['failed_checks'], 1)
+
+    def test_idle_connections_are_recycled(self):
+        self.pool.max_idle = 0
+        with self.pool.connection() as conn:
+            first = conn
+        with self.pool.connection() as conn:
+            self.assertIsNot(conn, first)
+        self.assertEqual(self.pool.stats()['recycled'], 1)
+
+    def test_forked_process_does_not_reuse_parent_connections(self):
+        with self.pool.connection() as conn:
+            parent_conn = conn
+        # Pretend the pool was created in another process
+        self.pool._pid = -1
+        with self.pool.connection() as conn:
+            self.assertIsNot(conn, parent_conn)
+        self.assertFalse(parent_conn.closed)
+        parent_conn.close()
+
+
+class TaskCursorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = get_db_connection()
+
+    def tearDown(self):
+        self.conn.rollback()
+        self.conn.close()
+
+    QUERY = '''SELECT n AS id, 'Task ' || n AS title, 'urgent' AS urgency, 'weekly' AS frequency
+               FROM generate_series(1, %s) AS n'''
+
+    def test_fetches_return_tasks(self):
+        with self.conn.cursor(cursor_factory=TaskCursor) as cur:
+            cur.execute(self.QUERY, (3,))
+            first = cur.fetchone()
+            self.assertIsInstance(first, Task)
+            self.assertEqual((first.id, first.title), (1, 'Task 1'))
+            self.assertIs(first.urgency, Urgency.URGENT)
+            self.assertIs(first.frequency, Frequency.WEEKLY)
+            self.assertIsNone(first.importance)
+            self.assertEqual([task.id for task in cur.fetchmany(1)], [2])
+            self.assertEqual([task.id for task in cur.fetchall()], [3])
+            self.assertIsNone(cur.fetchone())
+
+    def test_named_cursor_iterates_across_batches(self):
+        with self.conn.cursor(name='tasks', cursor_factory=TaskCursor) as cur:
+            cur.itersize = 2
+            cur.execute(self.QUERY, (5,))
+            tasks = list(cur)
+        self.assertEqual([task.id for task in tasks], [1, 2, 3, 4, 5])
+        self.assertTrue(all(isinstance(task, Task) for task in tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from cache import MISSING, TTLCache
+from fragments import FragmentCache
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def test_size_bound_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=100, ttl=60, maxbytes=10)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.get('a')
+        cache.set('c', 'xxxx')
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('a'), 'xxxx')
+        self.assertEqual(cache.stats()['bytes'], 8)
+        cache.set('a', 'x')
+        self.assertEqual(cache.stats()['bytes'], 5)
+
+    def test_render_only_on_miss_and_report_savings(self):
+        fragments = FragmentCache(TTLCache(maxsize=10, ttl=60))
+        calls = []
+
+        def render():
+            calls.append(1)
+            return '<div>panel</div>'
+
+        for _ in range(3):
+            self.assertEqual(fragments.get_or_render('key', render), '<div>panel</div>')
+        self.assertEqual(len(calls), 1)
+        stats = fragments.stats()
+        self.assertEqual((stats['renders'], stats['hits'], stats['misses']), (1, 2, 1))
+        self.assertAlmostEqual(stats['saved_seconds'], 2 * stats['render_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
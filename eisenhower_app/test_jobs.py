@@ -0,0 +1,95 @@
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from db import get_db_connection
+from jobs import JobRunner, next_run
+from migrations import reset_data
+
+
+class JobRunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = get_db_connection()
+        self.db.autocommit = True
+        reset_data(self.db)
+        self.cur = self.db.cursor()
+        self.calls = []
+
+    def tearDown(self):
+        self.cur.close()
+        self.db.close()
+
+    def runner(self, owner, job=None, **kwargs):
+        runner = JobRunner(owner=owner, **kwargs)
+        runner.job('rollover', 86400)(job or (lambda: self.calls.append(owner)))
+        return runner
+
+    def job_row(self):
+        self.cur.execute("SELECT * FROM job_runs WHERE name = 'rollover'")
+        return self.cur.fetchone()
+
+    def test_next_run_keeps_the_cadence(self):
+        scheduled = datetime(2025, 4, 7, 3, 0, tzinfo=timezone.utc)
+        self.assertEqual(next_run(scheduled, scheduled + timedelta(minutes=5), 3600), scheduled + timedelta(hours=1))
+        # Three missed slots are coalesced into the run that just happened
+        self.assertEqual(next_run(scheduled, scheduled + timedelta(hours=3, minutes=5), 3600),
+                         scheduled + timedelta(hours=4))
+
+    def test_each_due_job_runs_in_one_process(self):
+        gate = threading.Barrier(4)
+        runners = [self.runner('worker-%d' % n) for n in range(4)]
+        # The first poll creates the job's row and runs it, since it's new
+        self.assertEqual(runners[0].run_due(), ['rollover'])
+
+        self.cur.execute("UPDATE job_runs SET next_run_at = now() - interval '3 days'")
+        ran = []
+
+        def poll(runner):
+            gate.wait()
+            ran.extend(runner.run_due())
+
+        threads = [threading.Thread(target=poll, args=(runner,)) for runner in runners]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ran, ['rollover'])
+        self.assertEqual(len(self.calls), 2)
+
+        row = self.job_row()
+        self.assertEqual(row['runs'], 2)
+        self.assertIsNone(row['lease_owner'])
+        # Caught up once, then back on the daily cadence
+        self.assertGreater(row['next_run_at'], datetime.now(timezone.utc))
+        self.assertLessEqual(row['next_run_at'], datetime.now(timezone.utc) + timedelta(days=1))
+        self.assertEqual(runners[1].run_due(), [])
+
+    def test_expired_lease_is_taken_over(self):
+        self.runner('first').run_due()
+        self.cur.execute("UPDATE job_runs SET next_run_at = now(), lease_owner = 'crashed', "
+                         "lease_expires_at = now() + interval '1 hour'")
+        self.assertEqual(self.runner('second').run_due(), [])
+        self.cur.execute("UPDATE job_runs SET lease_expires_at = now() - interval '1 second'")
+        self.assertEqual(self.runner('third').run_due(), ['rollover'])
+        self.assertEqual(self.calls, ['first', 'third'])
+
+    def test_failed_run_is_recorded_and_retried_sooner(self):
+        def broken():
+            raise RuntimeError('disk full')
+
+        before = datetime.now(timezone.utc)
+        self.runner('worker', broken, retry_seconds=60).run_due()
+        row = self.job_row()
+        self.assertEqual((row['runs'], row['failures']), (1, 1))
+        self.assertIn('disk full', row['last_error'])
+        self.assertLess(row['next_run_at'], before + timedelta(minutes=2))
+
+        self.cur.execute("UPDATE job_runs SET next_run_at = now()")
+        self.runner('worker').run_due()
+        row = self.job_row()
+        self.assertEqual((row['runs'], row['failures']), (2, 1))
+        self.assertIsNone(row['last_error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
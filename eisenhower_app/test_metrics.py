@@ -0,0 +1,56 @@
+import unittest
+from db import get_db_connection, query_listeners
+from metrics import Counter, Histogram, QueryStats, JOB_FAILURES, JOB_SECONDS, timed_job
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'tasks')
+        self.assertEqual(histogram.render(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="tasks",le="0.1"} 2',
+            'latency_seconds_bucket{route="tasks",le="1.0"} 3',
+            'latency_seconds_bucket{route="tasks",le="+Inf"} 4',
+            'latency_seconds_sum{route="tasks"} 3.65',
+            'latency_seconds_count{route="tasks"} 4',
+        ])
+        counter = Counter('hits_total', 'Hits.', ('path',))
+        counter.inc('say "hi"')
+        self.assertEqual(counter.render()[-1], 'hits_total{path="say \\"hi\\""} 1')
+
+    def test_timed_cursor_reports_statements_without_parameters(self):
+        stats = QueryStats()
+        query_listeners.append(stats.record)
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            for i in range(5):
+                cur.execute('SELECT %s  AS n', (i,))
+            cur.execute('SELECT 1')
+            cur.close()
+        finally:
+            query_listeners.remove(stats.record)
+            conn.close()
+        self.assertEqual(stats.count, 6)
+        self.assertEqual(stats.repeated(), {'SELECT %s AS n': 5})
+        self.assertGreater(stats.seconds, 0)
+
+    def test_timed_job_records_duration_and_failures(self):
+        @timed_job('flaky')
+        def flaky(fail):
+            if fail:
+                raise RuntimeError('boom')
+            return 'done'
+
+        self.assertEqual(flaky(False), 'done')
+        with self.assertRaises(RuntimeError):
+            flaky(True)
+        self.assertEqual(JOB_SECONDS.count('flaky'), 2)
+        self.assertEqual(JOB_FAILURES.value('flaky'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
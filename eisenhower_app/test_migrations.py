@@ -0,0 +1,85 @@
+import unittest
+from db import get_db_connection
+from migrations import LATEST_VERSION, check_query_plans, current_version, downgrade, upgrade
+
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = get_db_connection()
+        downgrade(self.db, 0)
+
+    def tearDown(self):
+        downgrade(self.db, 0)
+        self.db.close()
+
+    def table_exists(self, name):
+        cur = self.db.cursor()
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+        present = cur.fetchone()['present']
+        cur.close()
+        self.db.rollback()
+        return present
+
+    def test_upgrade_and_downgrade(self):
+        self.assertEqual(upgrade(self.db, 1), [1])
+        self.assertEqual(current_version(self.db), 1)
+        self.assertTrue(self.table_exists('tasks'))
+        self.assertFalse(self.table_exists('subscriptions'))
+        self.assertEqual(upgrade(self.db), list(range(2, LATEST_VERSION + 1)))
+        self.assertEqual(upgrade(self.db), [])
+        self.assertTrue(self.table_exists('tasks_user_completed_due_idx'))
+        self.assertEqual(downgrade(self.db, 1), list(range(LATEST_VERSION, 1, -1)))
+        self.assertFalse(self.table_exists('subscriptions'))
+        self.assertTrue(self.table_exists('tasks'))
+
+    def test_existing_schema_is_adopted(self):
+        # Tables created by app.py before migrations existed
+        cur = self.db.cursor()
+        cur.execute("CREATE TABLE users (id TEXT PRIMARY KEY, name TEXT NOT NULL, password TEXT NOT NULL)")
+        cur.execute(
+            "CREATE TABLE tasks (id SERIAL PRIMARY KEY, title TEXT NOT NULL, urgency TEXT NOT NULL, "
+            "importance TEXT NOT NULL, due_date DATE, impact INTEGER DEFAULT 5, frequency TEXT DEFAULT 'none', "
+            "completed BOOLEAN DEFAULT FALSE, user_id TEXT NOT NULL REFERENCES users(id), "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        cur.execute("INSERT INTO users VALUES ('u', 'U', 'x')")
+        cur.execute("INSERT INTO tasks (title, urgency, importance, frequency, completed, user_id) "
+                    "VALUES ('Old', 'urgent', 'important', 'daily', TRUE, 'u')")
+        self.db.commit()
+        upgrade(self.db)
+        cur.execute("SELECT rolled_over FROM tasks WHERE title = 'Old'")
+        self.assertTrue(cur.fetchone()['rolled_over'])
+        cur.close()
+        self.db.rollback()
+
+    def test_route_queries_use_indexes(self):
+        upgrade(self.db)
+        self.assertEqual(check_query_plans(self.db), [])
+
+    def test_missing_index_is_reported(self):
+        upgrade(self.db)
+        cur = self.db.cursor()
+        cur.execute("DROP INDEX tasks_user_completed_created_idx")
+        cur.execute("DROP INDEX tasks_user_completed_due_idx")
+        cur.execute("DROP INDEX tasks_user_quadrant_idx")
+        cur.execute("DROP INDEX tasks_user_change_idx")
+        self.db.commit()
+        cur.close()
+        failures = dict(check_query_plans(self.db))
+        self.assertEqual(failures['report'], ['tasks'])
+        self.assertEqual(failures['sync'], ['tasks'])
+
+    def test_index_standing_in_for_a_missing_one_is_reported(self):
+        # The other (user_id, ...) indexes could still serve the report, slowly
+        upgrade(self.db)
+        cur = self.db.cursor()
+        cur.execute("DROP INDEX tasks_user_completed_created_idx")
+        self.db.commit()
+        cur.close()
+        failures = dict(check_query_plans(self.db))
+        self.assertEqual(failures['report'], ['tasks'])
+        self.assertNotIn('tasks board', failures)
+
+
+if __name__ == '__main__':
+    unittest.main()
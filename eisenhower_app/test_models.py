@@ -0,0 +1,40 @@
+import sys
+import unittest
+from datetime import date
+
+from models import COLUMNS, Frequency, Importance, Task, Urgency, row_maker
+
+
+class TaskModelTestCase(unittest.TestCase):
+    def test_rows_share_enum_members(self):
+        make = row_maker(('id', 'title', 'urgency', 'importance', 'frequency', 'due_date', 'search_vector'))
+        first = make((1, 'Plan', 'urgent', 'not important', 'weekly', date(2025, 4, 10), "'plan':1"))
+        second = make((2, 'Call', 'urgent', 'important', None, None, "'call':1"))
+        self.assertIs(first.urgency, Urgency.URGENT)
+        self.assertIs(second.urgency, first.urgency)
+        self.assertIs(first.importance, Importance.NOT_IMPORTANT)
+        self.assertIs(first.frequency, Frequency.WEEKLY)
+        self.assertIsNone(second.frequency)
+        # Columns outside the model are dropped, ones not selected are None
+        self.assertFalse(hasattr(first, '__dict__'))
+        self.assertIsNone(first.version)
+        self.assertEqual((first.id, first.title, first.due_date), (1, 'Plan', date(2025, 4, 10)))
+
+    def test_enums_read_and_write_as_their_text(self):
+        self.assertEqual(Urgency.NOT_URGENT, 'not urgent')
+        self.assertEqual('%s' % Frequency.NONE, 'none')
+        self.assertEqual([member.label for member in Importance], ['Important', 'Not Important'])
+        # Text that isn't a member is kept, so old rows still show
+        self.assertEqual(row_maker(('urgency',))(('someday',)).urgency, 'someday')
+
+    def test_task_is_smaller_than_a_row_dict(self):
+        values = dict(zip(COLUMNS, (1, 'Plan', 'urgent', 'important', None, 5, 'none', False, False,
+                                    'alice', None, None, 1)))
+        task = Task(**values)
+        self.assertLess(sys.getsizeof(task), sys.getsizeof(values))
+        with self.assertRaises(TypeError):
+            Task(title='Plan', colour='red')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import base64
+import json
+import os
+import threading
+import unittest
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid02
+
+from db import get_db_connection
+from migrations import reset_data
+from notifications import PushDispatcher, notify_due_tasks
+
+
+class PushService(BaseHTTPRequestHandler):
+    # Local stand-in for a push service: /ok accepts, /gone has unsubscribed
+    # /busy rate-limits the first request it sees and /slow asks for an hour.
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append(self.path)
+        if self.path == '/gone':
+            self.send_response(410)
+        elif self.path == '/busy' and self.server.received.count('/busy') == 1:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+        elif self.path == '/slow':
+            self.send_response(429)
+            self.send_header('Retry-After', '3600')
+        else:
+            self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def browser_keys():
+    key = ec.generate_private_key(ec.SECP256R1())
+    public = key.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    encode = lambda raw: base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+    return {'p256dh': encode(public), 'auth': encode(os.urandom(16))}
+
+
+class PushDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PushService)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        vapid = Vapid02()
+        vapid.generate_keys()
+        self.dispatcher = PushDispatcher(vapid, {'sub': 'mailto:test@example.com'}, backoff=0.01)
+        self.keys = browser_keys()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def subscription(self, path):
+        return {'endpoint': 'http://127.0.0.1:%d%s' % (self.server.server_port, path), 'keys': self.keys}
+
+    def test_dispatch_retries_and_reports_gone_endpoints(self):
+        message = {'title': 'Task Reminder', 'body': 'hi'}
+        results = self.dispatcher.dispatch([
+            (1, self.subscription('/ok'), message),
+            (2, self.subscription('/ok'), message),
+            (3, self.subscription('/gone'), message),
+            (4, self.subscription('/busy'), message),
+        ])
+        self.assertEqual(sorted(results['sent']), [1, 2, 4])
+        self.assertEqual(results['gone'], [3])
+        self.assertEqual(results['failed'], [])
+        # Duplicate rows for one endpoint are pushed once; /busy is retried
+        self.assertEqual(sorted(self.server.received), ['/busy', '/busy', '/gone', '/ok'])
+
+    def test_long_retry_after_is_not_waited_for(self):
+        message = {'title': 'Task Reminder', 'body': 'hi'}
+        results = self.dispatcher.dispatch([(1, self.subscription('/slow'), message)])
+        self.assertEqual(results['failed'], [1])
+        self.assertEqual(self.server.received, ['/slow'])
+        # Without retries a rate-limited push fails straight away
+        self.server.received = []
+        results = self.dispatcher.dispatch([(2, self.subscription('/busy'), message)], max_retries=0)
+        self.assertEqual(results['failed'], [2])
+        self.assertEqual(self.server.received, ['/busy'])
+
+    def test_notify_due_tasks_sweeps_all_users_once(self):
+        db = get_db_connection()
+        reset_data(db)
+        try:
+            cur = db.cursor()
+            today = date(2025, 4, 7)
+            for user_id, path in (('alice', '/ok'), ('bob', '/gone'), ('carol', '/ok')):
+                cur.execute("INSERT INTO users (id, name, password) VALUES (%s, %s, 'x')", (user_id, user_id))
+                cur.execute('INSERT INTO subscriptions (user_id, subscription) VALUES (%s, %s)',
+                            (user_id, json.dumps(self.subscription(path))))
+            cur.execute(
+                '''INSERT INTO tasks (title, urgency, importance, due_date, completed, user_id) VALUES
+                ('Late', TRUE, TRUE, %(yesterday)s, FALSE, 'alice'),
+                ('Soon', TRUE, TRUE, %(today)s, FALSE, 'bob'),
+                ('Done', TRUE, TRUE, %(yesterday)s, TRUE, 'carol'),
+                ('Later', TRUE, TRUE, %(next_week)s, FALSE, 'carol')''',
+                {'today': today, 'yesterday': today - timedelta(days=1), 'next_week': today + timedelta(days=7)}
+            )
+            db.commit()
+
+            results = notify_due_tasks(db, self.dispatcher, today=today, chunk_size=1)
+            self.assertEqual(len(results['sent']), 1)
+            self.assertEqual(len(results['gone']), 1)
+            cur.execute('SELECT user_id, last_notified_at FROM subscriptions ORDER BY user_id')
+            rows = cur.fetchall()
+            self.assertEqual([row['user_id'] for row in rows], ['alice', 'carol'])
+            self.assertIsNotNone(rows[0]['last_notified_at'])
+            self.assertIsNone(rows[1]['last_notified_at'])
+            db.commit()
+
+            # Reminded users are left alone until the quiet period has passed
+            self.assertEqual(notify_due_tasks(db, self.dispatcher, today=today)['sent'], [])
+            cur.close()
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
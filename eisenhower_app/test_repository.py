@@ -0,0 +1,270 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+
+from db import get_db_connection
+from migrations import reset_data
+from batch import parse_operations
+from repository import BatchConflict, Conflict, PostgresRepository
+from sqlite_repository import SQLiteRepository
+from models import Frequency, Task, Urgency
+
+
+def task(title, urgency='urgent', importance='important', due_date=None, impact=5, frequency='none'):
+    return {'title': title, 'urgency': urgency, 'importance': importance, 'due_date': due_date,
+            'impact': impact, 'frequency': frequency}
+
+
+class RepositoryConformance:
+    # Runs against every backend; subclasses provide make_repository()
+    today = date(2025, 4, 7)
+
+    def setUp(self):
+        self.repo = self.make_repository()
+        self.assertTrue(self.repo.create_user('alice', 'Alice', 'hash'))
+        self.repo.create_user('bob', 'Bob', 'hash')
+
+    def test_users(self):
+        self.assertFalse(self.repo.create_user('alice', 'Other', 'hash'))
+        self.assertEqual(self.repo.get_user('alice'), {'id': 'alice', 'name': 'Alice', 'password': 'hash'})
+        self.assertIsNone(self.repo.get_user('nobody'))
+        self.assertEqual(self.repo.data_version('nobody'), 0)
+
+    def test_task_crud_bumps_data_version(self):
+        version = self.repo.data_version('alice')
+        task_id = self.repo.add_task('alice', task('Write report', due_date='2025-04-10', impact=8))
+        saved = self.repo.get_task('alice', task_id)
+        self.assertEqual(saved.due_date, date(2025, 4, 10))
+        self.assertIs(saved.completed, False)
+        self.assertIsInstance(saved, Task)
+        self.assertIs(saved.urgency, Urgency.URGENT)
+        self.assertIs(saved.frequency, Frequency.NONE)
+        self.assertIsNone(self.repo.get_task('bob', task_id))
+        self.assertGreater(self.repo.data_version('alice'), version)
+
+        version = self.repo.data_version('alice')
+        self.assertTrue(self.repo.update_task('alice', task_id, task('Write the report', due_date=None)))
+        self.assertFalse(self.repo.update_task('bob', task_id, task('Hijacked')))
+        self.assertEqual(self.repo.get_task('alice', task_id).title, 'Write the report')
+        self.assertIsNone(self.repo.get_task('alice', task_id).due_date)
+        self.assertGreater(self.repo.data_version('alice'), version)
+
+        self.assertFalse(self.repo.delete_task('bob', task_id))
+        self.assertTrue(self.repo.delete_task('alice', task_id))
+        self.assertIsNone(self.repo.get_task('alice', task_id))
+
+    def test_toggle_spawns_next_recurring_instance_once(self):
+        task_id = self.repo.add_task('alice', task('Water plants', due_date='2025-04-07', frequency='weekly'))
+        self.assertTrue(self.repo.toggle_task('alice', task_id, today=self.today))
+        done = self.repo.get_task('alice', task_id)
+        self.assertTrue(done.completed)
+        self.assertIsNotNone(done.completed_at)
+        self.assertTrue(self.repo.toggle_task('alice', task_id, today=self.today))
+        self.assertIsNone(self.repo.get_task('alice', task_id).completed_at)
+        self.assertTrue(self.repo.toggle_task('alice', task_id, today=self.today))
+        due_dates = [t.due_date for t in self.repo.load_board('alice')[0]['tasks']]
+        self.assertEqual(due_dates, [date(2025, 4, 7), date(2025, 4, 14)])
+        self.assertEqual(self.repo.rollover_recurring_tasks(self.today), 0)
+        self.assertFalse(self.repo.toggle_task('bob', task_id))
+
+    def test_versioned_writes_report_conflicts(self):
+        task_id = self.repo.add_task('alice', task('Draft'))
+        version = self.repo.get_task('alice', task_id).version
+        updated = self.repo.update_task('alice', task_id, task('Draft v2'), version)
+        self.assertGreater(updated['version'], version)
+        with self.assertRaises(Conflict) as conflict:
+            self.repo.update_task('alice', task_id, task('Stale edit'), version)
+        self.assertEqual(conflict.exception.task.title, 'Draft v2')
+        with self.assertRaises(Conflict):
+            self.repo.toggle_task('alice', task_id, version=version)
+        self.assertFalse(self.repo.get_task('alice', task_id).completed)
+
+        toggled = self.repo.toggle_task('alice', task_id, version=updated['version'])
+        self.assertTrue(toggled['completed'])
+        self.assertEqual(toggled['version'], self.repo.get_task('alice', task_id).version)
+        # Unknown tasks are missing, not conflicting
+        self.assertIsNone(self.repo.toggle_task('bob', task_id, version=1))
+        self.assertIsNone(self.repo.update_task('alice', task_id + 100, task('Nope'), 1))
+
+    def test_concurrent_toggles_spawn_one_instance(self):
+        task_id = self.repo.add_task('alice', task('Standup', due_date='2025-04-07', frequency='daily'))
+        version = self.repo.get_task('alice', task_id).version
+        outcomes = []
+
+        def click():
+            try:
+                outcomes.append(self.repo.toggle_task('alice', task_id, today=self.today, version=version))
+            except Conflict:
+                outcomes.append('conflict')
+
+        threads = [threading.Thread(target=click) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outcomes.count('conflict'), 7)
+        tasks = self.repo.load_board('alice')[0]['tasks']
+        self.assertEqual([(t.due_date, t.completed) for t in tasks],
+                         [(date(2025, 4, 7), True), (date(2025, 4, 8), False)])
+
+    def test_batch_applies_each_operation_to_every_task(self):
+        ids = [self.repo.add_task('alice', task('Task %d' % n, due_date='2025-04-07')) for n in range(4)]
+        recurring = self.repo.add_task('alice', task('Standup', due_date='2025-04-07', frequency='daily'))
+        other = self.repo.add_task('bob', task('Not yours'))
+        results, versions = self.repo.apply_batch('alice', parse_operations({'operations': [
+            {'op': 'complete', 'ids': [ids[0], recurring, other]},
+            {'op': 'move', 'ids': ids[1:3], 'quadrant': 'eliminate'},
+            {'op': 'reschedule', 'ids': [ids[2]], 'due_date': None},
+            {'op': 'delete', 'ids': [ids[3]]},
+        ]}), today=self.today)
+        self.assertEqual(results, [sorted([ids[0], recurring]), ids[1:3], [ids[2]], [ids[3]]])
+        # Final versions, however many times a task was written
+        self.assertEqual(versions, {task_id: self.repo.get_task('alice', task_id).version
+                                    for task_id in (ids[0], recurring, ids[1], ids[2])})
+
+        board = self.repo.load_board('alice')
+        self.assertEqual([(t.title, t.due_date, t.completed) for t in board[0]['tasks']], [
+            ('Task 0', date(2025, 4, 7), True), ('Standup', date(2025, 4, 7), True),
+            ('Standup', date(2025, 4, 8), False)])
+        self.assertEqual([(t.title, t.due_date) for t in board[3]['tasks']],
+                         [('Task 1', date(2025, 4, 7)), ('Task 2', None)])
+        self.assertIsNone(self.repo.get_task('alice', ids[3]))
+        self.assertFalse(self.repo.get_task('bob', other).completed)
+        # Completing again writes the tasks but never spawns a second successor
+        self.repo.apply_batch('alice', parse_operations({'operations': [{'op': 'complete', 'ids': [recurring]}]}))
+        self.assertEqual(self.repo.load_board('alice')[0]['total'], 3)
+
+    def test_stale_batch_writes_nothing(self):
+        ids = [self.repo.add_task('alice', task('Task %d' % n)) for n in range(3)]
+        versions = [self.repo.get_task('alice', task_id).version for task_id in ids]
+        self.repo.update_task('alice', ids[2], task('Edited elsewhere'))
+        with self.assertRaises(BatchConflict) as conflict:
+            self.repo.apply_batch('alice', parse_operations({'operations': [
+                {'op': 'delete', 'ids': ids[:1]},
+                {'op': 'move', 'ids': ids[1:], 'versions': versions[1:], 'quadrant': 'plan'},
+            ]}))
+        self.assertEqual([t.id for t in conflict.exception.tasks], [ids[2]])
+        self.assertIsNotNone(self.repo.get_task('alice', ids[0]))
+        self.assertEqual(self.repo.get_task('alice', ids[1]).urgency, 'urgent')
+
+    def test_rollover_recurring_tasks(self):
+        for n in range(3):
+            task_id = self.repo.add_task('alice', task('Daily %d' % n, frequency='daily'))
+            self.repo.toggle_task('alice', task_id, today=self.today)
+        # Completed some other way than toggle_task, so still waiting for a successor
+        for user_id in ('alice', 'bob'):
+            self.repo.add_task(user_id, task('Monthly', due_date='2025-04-01', frequency='monthly'))
+        self.complete_without_rollover()
+        self.assertEqual(self.repo.rollover_recurring_tasks(self.today, chunk_size=1), 2)
+        self.assertEqual(self.repo.rollover_recurring_tasks(self.today), 0)
+        board = self.repo.load_board('bob')
+        self.assertEqual([t.due_date for t in board[0]['tasks']], [date(2025, 4, 1), date(2025, 5, 1)])
+
+    def test_board_pages_each_quadrant(self):
+        for n in range(5):
+            self.repo.add_task('alice', task('Do %d' % n, due_date=(self.today + timedelta(days=n)).isoformat()))
+        self.repo.add_task('alice', task('Undated'))
+        self.repo.add_task('alice', task('Someday', urgency='not urgent', importance='not important'))
+        board = self.repo.load_board('alice', page_size=4)
+        self.assertEqual([q['key'] for q in board], ['do', 'plan', 'delegate', 'eliminate'])
+        self.assertEqual(board[0]['total'], 6)
+        self.assertEqual([t.title for t in board[0]['tasks']], ['Do 0', 'Do 1', 'Do 2', 'Do 3'])
+        self.assertEqual(board[3]['total'], 1)
+        self.assertIsNone(board[3]['next_cursor'])
+
+        board = self.repo.load_board('alice', {'do': board[0]['next_cursor']}, page_size=4)
+        self.assertEqual([t.title for t in board[0]['tasks']], ['Do 4', 'Undated'])
+        self.assertTrue(board[0]['paged'])
+        self.assertIsNone(board[0]['next_cursor'])
+
+        self.repo.toggle_task('alice', board[0]['tasks'][0].id)
+        self.assertEqual(self.repo.load_board('alice', hide_completed=True)[0]['total'], 5)
+
+    def test_suggestions_and_checkin(self):
+        overdue = self.repo.add_task('alice', task('Overdue', due_date='2025-04-01', impact=2))
+        self.repo.add_task('alice', task('Tomorrow', due_date='2025-04-08', impact=9))
+        self.repo.add_task('alice', task('Undated', importance='not important'))
+        self.repo.add_task('alice', task('Next month', due_date='2025-05-07'))
+        self.repo.add_task('alice', task('Done', due_date='2025-04-02'))
+        done = self.repo.add_task('alice', task('Done', due_date='2025-04-02'))
+        self.repo.toggle_task('alice', done)
+
+        suggested = self.repo.suggested_tasks('alice', self.today)
+        self.assertEqual([t.title for t in suggested], ['Tomorrow'])
+        self.assertAlmostEqual(suggested[0].priority, 9.0)
+
+        dashboard = self.repo.load_checkin('alice', self.today)
+        self.assertEqual([t.id for t in dashboard['overdue_tasks']][0], overdue)
+        self.assertEqual([t.title for t in dashboard['upcoming_tasks']], ['Tomorrow'])
+        self.assertEqual([t.id for t in dashboard['completed_tasks']], [done])
+        self.assertEqual([t.title for t in dashboard['suggested_tasks']], ['Tomorrow'])
+
+    def test_search_matches_prefixes_and_pages(self):
+        for n in range(5):
+            self.repo.add_task('alice', task('Plan report %d' % n))
+        self.repo.add_task('alice', task('Water plants'))
+        self.repo.add_task('bob', task('Plan report'))
+        tasks, after = self.repo.search_tasks('alice', 'pla rep', limit=3)
+        self.assertEqual(len(tasks), 3)
+        more, end = self.repo.search_tasks('alice', 'pla rep', after=after, limit=3)
+        self.assertEqual(len(more), 2)
+        self.assertIsNone(end)
+        self.assertEqual(len({t.id for t in tasks + more}), 5)
+        self.assertEqual(self.repo.search_tasks('alice', '  '), ([], None))
+
+        # Renamed tasks are found under their new title only
+        self.repo.update_task('alice', more[0].id, task('Quarterly taxes'))
+        self.assertEqual(len(self.repo.search_tasks('alice', 'report')[0]), 4)
+        self.assertEqual([t.title for t in self.repo.search_tasks('alice', 'tax')[0]], ['Quarterly taxes'])
+
+    def test_report_pages_newest_first(self):
+        ids = []
+        for n in range(5):
+            ids.append(self.repo.add_task('alice', task('Done %d' % n)))
+            self.repo.toggle_task('alice', ids[-1])
+        self.repo.add_task('alice', task('Open'))
+        page = self.repo.report_page('alice', limit=3)
+        self.assertEqual([t.id for t in page], ids[:1:-1])
+        self.assertIsNotNone(page.next_cursor)
+        page = self.repo.report_page('alice', after=page.next_cursor, limit=3)
+        self.assertEqual([t.id for t in page], ids[1::-1])
+        self.assertIsNone(page.next_cursor)
+
+
+class SQLiteRepositoryTestCase(RepositoryConformance, unittest.TestCase):
+    def make_repository(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        repo = SQLiteRepository(os.path.join(directory.name, 'test.db'))
+        self.addCleanup(repo.close)
+        return repo
+
+    def complete_without_rollover(self):
+        self.repo._connection().execute("UPDATE tasks SET completed = 1 WHERE title = 'Monthly'")
+
+    def test_pragmas(self):
+        conn = self.repo._connection()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()['journal_mode'], 'wal')
+        self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()['foreign_keys'], 1)
+        self.assertEqual(self.repo.migrate(), [])
+
+
+class PostgresRepositoryTestCase(RepositoryConformance, unittest.TestCase):
+    def make_repository(self):
+        conn = get_db_connection()
+        reset_data(conn)
+        conn.close()
+        return PostgresRepository()
+
+    def complete_without_rollover(self):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("UPDATE tasks SET completed = TRUE WHERE title = 'Monthly'")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import unittest
+
+from db import get_db_connection
+from migrations import reset_data
+from sync import decode_cursor, encode_cursor, load_changes, prune_deletions
+
+
+class DeltaSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = get_db_connection()
+        self.db.autocommit = True
+        reset_data(self.db)
+        self.cur = self.db.cursor()
+        self.cur.execute("INSERT INTO users (id, name, password) VALUES ('alice', 'Alice', 'x'), ('bob', 'Bob', 'x')")
+
+    def tearDown(self):
+        self.cur.close()
+        self.db.close()
+
+    def add(self, title, user_id='alice'):
+        self.cur.execute(
+            "INSERT INTO tasks (title, urgency, importance, user_id) VALUES (%s, 'urgent', 'important', %s) RETURNING id",
+            (title, user_id)
+        )
+        return self.cur.fetchone()['id']
+
+    def sync(self, cursor=None, limit=500):
+        return load_changes(self.cur, 'alice', cursor, limit)
+
+    def test_sends_only_changes_since_the_cursor(self):
+        first, second = self.add('One'), self.add('Two')
+        self.add('Not yours', 'bob')
+        changes = self.sync()
+        self.assertTrue(changes['reset'])
+        self.assertEqual([t['id'] for t in changes['tasks']], [first, second])
+        self.assertEqual(changes['tasks'][0]['version'], 1)
+
+        unchanged = self.sync(changes['cursor'])
+        self.assertFalse(unchanged['reset'])
+        self.assertEqual((unchanged['tasks'], unchanged['deleted']), ([], []))
+
+        self.cur.execute("UPDATE tasks SET completed = TRUE WHERE id = %s", (second,))
+        self.cur.execute("DELETE FROM tasks WHERE id = %s", (first,))
+        changes = self.sync(unchanged['cursor'])
+        self.assertEqual([(t['id'], t['completed'], t['version']) for t in changes['tasks']], [(second, True, 2)])
+        self.assertEqual(changes['deleted'], [first])
+
+    def test_write_committed_after_a_sync_is_not_missed(self):
+        self.add('One')
+        writer = get_db_connection()
+        try:
+            writer_cur = writer.cursor()
+            writer_cur.execute(
+                "INSERT INTO tasks (title, urgency, importance, user_id) VALUES ('Late', 'urgent', 'important', 'alice')")
+            # Synced while the insert is uncommitted, so it isn't seen yet
+            changes = self.sync()
+            self.assertEqual([t['title'] for t in changes['tasks']], ['One'])
+            writer.commit()
+        finally:
+            writer.close()
+        self.assertEqual([t['title'] for t in self.sync(changes['cursor'])['tasks']], ['Late'])
+
+    def test_pages_continue_where_the_last_one_stopped(self):
+        ids = [self.add('Task %d' % n) for n in range(5)]
+        self.cur.execute("DELETE FROM tasks WHERE id = %s", (ids[0],))
+        seen, deleted, cursor = [], [], None
+        while True:
+            changes = self.sync(cursor, limit=2)
+            seen += [t['id'] for t in changes['tasks']]
+            deleted += changes['deleted']
+            cursor = changes['cursor']
+            if not changes['more']:
+                break
+        self.assertEqual((seen, deleted), (ids[1:], [ids[0]]))
+        self.assertEqual(self.sync(cursor)['tasks'], [])
+
+    def test_expired_or_garbled_cursor_starts_over(self):
+        self.add('One')
+        since, issued, _ = decode_cursor(self.sync()['cursor'])
+        self.assertTrue(self.sync('garbage')['reset'])
+        # Past what xid8 and the id column hold: a full resync, not a 500
+        for cursor in ('%d-%d' % (2 ** 64, issued), '%d-%d-%d-1' % (since, issued, 2 ** 64),
+                       '%d-%d-1-%d' % (since, issued, 2 ** 31)):
+            self.assertTrue(self.sync(cursor)['reset'], cursor)
+        expired = self.sync(encode_cursor(since, int(time.time()) - 31 * 86400))
+        self.assertTrue(expired['reset'])
+        self.assertEqual(len(expired['tasks']), 1)
+
+        self.cur.execute("DELETE FROM tasks")
+        self.cur.execute("UPDATE task_deletions SET deleted_at = now() - interval '31 days'")
+        self.assertEqual(prune_deletions(self.cur), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+import unittest
+
+from db import get_db_connection
+from migrations import reset_data
+from transfer import CopySource, RowError, export_tasks, import_tasks
+
+
+CSV_FILE = '''title,urgency,importance,due_date,impact,frequency,completed
+"Write report, draft",urgent,important,2025-04-07,8,none,false
+Water plants,not urgent,important,,,weekly,
+Old chore,urgent,not important,2025-01-01,3,none,true
+'''
+
+
+class TransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = get_db_connection()
+        reset_data(self.db)
+        cur = self.db.cursor()
+        cur.execute("INSERT INTO users (id, name, password) VALUES ('testuser', 'Test User', 'x')")
+        self.db.commit()
+        cur.close()
+
+    def tearDown(self):
+        self.db.rollback()
+        self.db.close()
+
+    def titles(self):
+        cur = self.db.cursor()
+        cur.execute("SELECT title FROM tasks ORDER BY id")
+        titles = [row['title'] for row in cur.fetchall()]
+        cur.close()
+        self.db.rollback()
+        return titles
+
+    def test_import_csv_applies_defaults(self):
+        self.assertEqual(import_tasks(self.db, 'testuser', io.StringIO(CSV_FILE)), 3)
+        cur = self.db.cursor()
+        cur.execute("SELECT * FROM tasks WHERE title = 'Water plants'")
+        task = cur.fetchone()
+        cur.close()
+        self.assertIsNone(task['due_date'])
+        self.assertEqual(task['impact'], 5)
+        self.assertEqual(task['frequency'], 'weekly')
+        self.assertFalse(task['completed'])
+        self.assertEqual(self.titles(), ["Write report, draft", "Water plants", "Old chore"])
+
+    def test_invalid_row_imports_nothing(self):
+        lines = [json.dumps({'title': 'Fine', 'urgency': 'urgent', 'importance': 'important'}),
+                 json.dumps({'title': 'Bad', 'urgency': 'soonish', 'importance': 'important'})]
+        with self.assertRaises(RowError) as error:
+            import_tasks(self.db, 'testuser', lines, 'ndjson')
+        self.assertEqual(error.exception.line, 2)
+        self.assertIn('urgency', str(error.exception))
+        self.assertEqual(self.titles(), [])
+
+    def test_unreadable_rows_are_row_errors(self):
+        # Not UTF-8, a NUL character and an impact past the column's range
+        latin1 = io.TextIOWrapper(io.BytesIO('title,urgency,importance\nCaf\xe9,urgent,important\n'.encode('latin-1')),
+                                  encoding='utf-8', newline='')
+        cases = [(latin1, 'csv', 1, 'UTF-8'),
+                 (['{"title": "a\\u0000b", "urgency": "urgent", "importance": "important"}'], 'ndjson', 1, 'NUL'),
+                 (['{"title": "Big", "urgency": "urgent", "importance": "important", "impact": 99999999999}'],
+                  'ndjson', 1, 'impact')]
+        for lines, fmt, line, message in cases:
+            with self.assertRaises(RowError) as error:
+                import_tasks(self.db, 'testuser', lines, fmt)
+            self.assertEqual(error.exception.line, line)
+            self.assertIn(message, str(error.exception))
+        self.assertEqual(self.titles(), [])
+
+    def test_completed_recurring_task_is_not_rolled_over_again(self):
+        import_tasks(self.db, 'testuser', io.StringIO(CSV_FILE))
+        cur = self.db.cursor()
+        cur.execute("SELECT title, rolled_over FROM tasks ORDER BY id")
+        rolled_over = {row['title']: row['rolled_over'] for row in cur.fetchall()}
+        cur.close()
+        self.db.rollback()
+        self.assertEqual(rolled_over, {"Write report, draft": False, "Water plants": False, "Old chore": True})
+
+    def test_copy_source_reads_in_chunks(self):
+        rows = iter([('testuser', 'Task %d' % i, 'urgent', 'important', None, 5, 'none', 'f') for i in range(1000)])
+        source = CopySource(rows)
+        chunk = source.read(100)
+        self.assertEqual(len(chunk), 100)
+        self.assertTrue(chunk.startswith('testuser,Task 0,urgent,important,,5,none,f\r\n'))
+        # Only a chunk's worth of rows has been rendered so far
+        self.assertLess(len(source.read(100)) + source._buffer.tell(), 200)
+
+    def test_export_round_trips(self):
+        import_tasks(self.db, 'testuser', io.StringIO(CSV_FILE))
+        exported = ''.join(export_tasks(self.db, 'testuser', 'csv'))
+        rows = list(csv.DictReader(io.StringIO(exported)))
+        self.assertEqual([row['title'] for row in rows], ["Write report, draft", "Water plants", "Old chore"])
+        self.assertEqual(rows[0]['due_date'], '2025-04-07')
+        self.assertEqual(rows[1]['due_date'], '')
+
+        lines = ''.join(export_tasks(self.db, 'testuser', 'ndjson')).splitlines()
+        self.assertEqual(json.loads(lines[2])['completed'], True)
+        # An export feeds straight back into an import
+        self.assertEqual(import_tasks(self.db, 'testuser', io.StringIO(exported)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
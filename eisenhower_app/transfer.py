@@ -0,0 +1,237 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+import click
+
+from cursors import MAX_INT
+from db import TaskCursor, get_db_connection
+from models import Frequency, Importance, Urgency
+
+
+# Bulk import and export of a user's tasks as CSV or NDJSON (one JSON object
+# per line). Both directions stream: imports feed COPY FROM STDIN as rows are
+# parsed, exports read through a server-side cursor, so neither holds the
+# whole file or table in memory.
+
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('title', 'urgency', 'importance', 'due_date', 'impact', 'frequency', 'completed')
+EXPORT_COLUMNS = ('id',) + COLUMNS + ('created_at',)
+URGENCY, IMPORTANCE, FREQUENCIES = set(Urgency), set(Importance), set(Frequency)
+TRUE_VALUES, FALSE_VALUES = {'true', 't', '1', 'yes'}, {'false', 'f', '0', 'no', ''}
+EXPORT_BATCH = 2000
+
+COPY_SQL = 'COPY tasks (user_id, %s, rolled_over) FROM STDIN WITH (FORMAT csv)' % ', '.join(COLUMNS)
+EXPORT_SQL = 'SELECT %s FROM tasks WHERE user_id = %%s ORDER BY id' % ', '.join(EXPORT_COLUMNS)
+
+
+class RowError(ValueError):
+    def __init__(self, line, message):
+        super().__init__('line %d: %s' % (line, message))
+        self.line = line
+
+
+def format_for(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'ndjson'
+    return 'csv' if extension == 'csv' else default
+
+
+def read_records(lines, fmt):
+    # Yields (line number, dict) from an iterable of text lines. Undecodable
+    # bytes and CSV syntax errors surface while reading ahead, so they are
+    # reported against the first line not yet returned (text is decoded a
+    # block at a time, so a bad byte may be further on).
+    line_number = 0
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(lines)
+            for record in reader:
+                line_number = reader.line_num
+                yield line_number, record
+            return
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise RowError(line_number, 'not valid JSON')
+            if not isinstance(record, dict):
+                raise RowError(line_number, 'expected a JSON object')
+            yield line_number, record
+    except UnicodeDecodeError:
+        raise RowError(line_number + 1, 'not UTF-8 text') from None
+    except csv.Error as e:
+        raise RowError(line_number + 1, str(e)) from None
+
+
+def validate(line_number, record):
+    # Returns the row in COLUMNS order, applying the add-task form's defaults
+    def text(name, allowed=None, default=None):
+        value = record.get(name)
+        value = default if value in (None, '') else str(value).strip()
+        if value is not None and '\x00' in value:
+            # Postgres text can't hold NUL characters
+            raise RowError(line_number, '%s contains a NUL character' % name)
+        if value is None or (allowed is not None and value not in allowed):
+            raise RowError(line_number, '%s must be one of %s' % (name, ', '.join(sorted(allowed))) if allowed
+                           else '%s is required' % name)
+        return value
+
+    title = text('title')
+    urgency = text('urgency', URGENCY)
+    importance = text('importance', IMPORTANCE)
+    due_date = record.get('due_date') or None
+    if due_date is not None:
+        try:
+            due_date = date.fromisoformat(str(due_date)).isoformat()
+        except ValueError:
+            raise RowError(line_number, 'due_date must be YYYY-MM-DD')
+    impact = record.get('impact')
+    try:
+        impact = 5 if impact in (None, '') else int(impact)
+    except (TypeError, ValueError):
+        raise RowError(line_number, 'impact must be a whole number')
+    if not -MAX_INT - 1 <= impact <= MAX_INT:
+        raise RowError(line_number, 'impact is out of range')
+    frequency = text('frequency', FREQUENCIES, Frequency.NONE)
+    completed = record.get('completed')
+    if not isinstance(completed, bool):
+        completed = str(completed or '').strip().lower()
+        if completed not in TRUE_VALUES | FALSE_VALUES:
+            raise RowError(line_number, 'completed must be true or false')
+        completed = completed in TRUE_VALUES
+    return title, urgency, importance, due_date, impact, frequency, 't' if completed else 'f'
+
+
+class CopySource(io.TextIOBase):
+    # File-like view over an iterator of row tuples, rendered as CSV on demand
+    # for cursor.copy_expert(); only one buffer's worth is ever held.
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        # psycopg2 turns exceptions raised here into a generic COPY failure,
+        # so the original is kept for import_tasks to re-raise
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or self._buffer.tell() < size:
+            try:
+                row = next(self._rows, None)
+            except RowError as e:
+                self.error = e
+                raise
+            if row is None:
+                break
+            # COPY's CSV format reads an unquoted empty field as NULL
+            self._writer.writerow(['' if value is None else value for value in row])
+        data = self._buffer.getvalue()
+        if size < 0:
+            size = len(data)
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffer.write(data[size:])
+        return data[:size]
+
+
+def import_tasks(conn, user_id, lines, fmt='csv'):
+    # All or nothing: the first invalid row raises RowError and the COPY is
+    # rolled back. Returns the number of tasks created.
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+    # Completed rows go in as rolled over, like migration 2 marked existing
+    # ones, so the rollover job doesn't spawn successors for recurring tasks
+    # that were finished before the export.
+    rows = ((user_id,) + row + (row[-1],)
+            for row in (validate(line_number, record) for line_number, record in read_records(lines, fmt)))
+    source = CopySource(rows)
+    cur = conn.cursor()
+    try:
+        cur.copy_expert(COPY_SQL, source)
+        count = cur.rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if source.error is not None:
+            raise source.error from None
+        raise
+    finally:
+        cur.close()
+    return count
+
+
+def to_text(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def export_tasks(conn, user_id, fmt='csv'):
+    # Yields the file in chunks of EXPORT_BATCH tasks
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    # A named cursor keeps the result on the server and fetches itersize rows at a time
+    cur = conn.cursor(name='task_export', cursor_factory=TaskCursor)
+    cur.itersize = EXPORT_BATCH
+    try:
+        cur.execute(EXPORT_SQL, (user_id,))
+        for count, task in enumerate(cur, 1):
+            if fmt == 'csv':
+                writer.writerow([to_text(getattr(task, column)) for column in EXPORT_COLUMNS])
+            else:
+                buffer.write(json.dumps({column: to_text(getattr(task, column)) for column in EXPORT_COLUMNS}) + '\n')
+            if count % EXPORT_BATCH == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+@click.group('tasks')
+def tasks_cli():
+    """Import and export tasks."""
+
+
+@tasks_cli.command('import')
+@click.argument('user_id')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the file extension.')
+def import_command(user_id, source, fmt):
+    """Import tasks for USER_ID from a CSV or NDJSON file (- for stdin)."""
+    conn = get_db_connection()
+    try:
+        count = import_tasks(conn, user_id, source, fmt or format_for(source.name))
+    except RowError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    click.echo('Imported %d tasks' % count)
+
+
+@tasks_cli.command('export')
+@click.argument('user_id')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the file extension.')
+def export_command(user_id, target, fmt):
+    """Export USER_ID's tasks as CSV or NDJSON (default: stdout)."""
+    conn = get_db_connection()
+    try:
+        for chunk in export_tasks(conn, user_id, fmt or format_for(target.name)):
+            target.write(chunk)
+    finally:
+        conn.close()
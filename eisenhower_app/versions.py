@@ -0,0 +1,21 @@
+# users.data_version is bumped (and users.data_changed_at stamped) by
+# statement-level triggers on tasks whenever any of the user's tasks is
+# inserted, updated or deleted, by any code path. Caches and HTTP validators
+# key on it instead of tracking writes.
+DATA_VERSION_SQL = 'SELECT data_version, data_changed_at FROM users WHERE id = %s'
+
+
+def stamp_of(row):
+    # (version, last change time or None) from a DATA_VERSION_SQL row
+    if not row:
+        return 0, None
+    return row['data_version'], row['data_changed_at']
+
+
+def data_stamp(cur, user_id):
+    cur.execute(DATA_VERSION_SQL, (user_id,))
+    return stamp_of(cur.fetchone())
+
+
+def data_version(cur, user_id):
+    return data_stamp(cur, user_id)[0]